@@ -1,12 +1,18 @@
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import JSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from models.energy import EnergyConsumptionSchema, EnergyDeviceSchema
+from models.energy import EnergyConsumptionSchema, EnergyDeviceSchema, LoadShiftRequestSchema
 from services.energy_service import EnergyService
 from services.efficiency_service import EfficiencyService
-from database.connection import get_db
-from typing import List
+from services.cache_service import cached, response_cache, DEVICES, ML, READINGS
+from database.connection import get_db, get_async_db
+from datetime import datetime
+from typing import List, Optional
 import paho.mqtt.client as mqtt
+import csv
+import io
 import json
 import os
 
@@ -43,13 +49,13 @@ connect_mqtt()
 @router.post("/energy/consumption")
 async def create_energy_consumption(
     consumption: EnergyConsumptionSchema,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     # Check if device is ON before recording consumption
-    result = db.execute(
+    result = (await db.execute(
         text("SELECT status FROM devices WHERE name = :name"),
         {"name": consumption.device_name}
-    ).fetchone()
+    )).fetchone()
     
     if result is None:
         raise HTTPException(status_code=404, detail=f"Device '{consumption.device_name}' not found")
@@ -64,26 +70,187 @@ async def create_energy_consumption(
         }
     
     # Device is ON, record consumption
-    service = EnergyService(db)
-    return await service.record_consumption(consumption)
+    return await db.run_sync(
+        lambda session: EnergyService(session).record_consumption(consumption)
+    )
+
+@router.post("/energy/consumption/batch")
+async def create_energy_consumption_batch(
+    readings: List[EnergyConsumptionSchema],
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Record many readings in one request
+
+    Device status is checked with a single lookup and every reading of a
+    device that is ON is inserted in one transaction. Readings of devices
+    that are OFF or unknown are skipped and reported per row.
+    """
+    from config import settings
+
+    if len(readings) > settings.INGEST_MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Batch too large ({len(readings)} readings, max {settings.INGEST_MAX_BATCH_SIZE})"
+        )
+
+    return await db.run_sync(
+        lambda session: EnergyService(session).record_consumptions(readings)
+    )
+
+@router.get("/ingest/status")
+def get_ingest_status():
+    """Queue depth and counters of the in-process MQTT ingestion worker"""
+    from services import ingestion_service
+
+    if ingestion_service.ingestion_worker is None:
+        return {"running": False, "message": "MQTT ingestion is disabled (MQTT_INGEST_ENABLED=False)"}
+    return ingestion_service.ingestion_worker.status()
+
+@router.get("/system/db-pool")
+def get_db_pool_status():
+    """
+    Connection pool occupancy and checkout wait statistics
+
+    Reports configured size, checked-out, idle and overflow connections for
+    the sync and async engines, plus checkout counts and wait times since
+    startup, to size DB_POOL_SIZE / DB_MAX_OVERFLOW from real load.
+    """
+    from database.connection import engine, async_engine
+    from database.pool_metrics import pool_snapshot
+
+    return {
+        "sync": pool_snapshot(engine.pool),
+        "async": pool_snapshot(async_engine.sync_engine.pool)
+    }
+
+@router.get("/system/cache")
+def get_cache_status():
+    """Entry count, hit/miss and coalescing counters of the response cache and analytics snapshots"""
+    from services.analytics_snapshot import analytics_snapshots
+
+    return {**response_cache.stats(), "analytics_snapshots": analytics_snapshots.stats()}
+
+@router.get("/system/models")
+def get_model_registry_status():
+    """Models held by the in-process model registry and its load/hit counters"""
+    from services.model_registry import model_registry
+
+    return model_registry.stats()
 
 @router.get("/energy/consumption/{device_name}")
+@cached(ttl=10)
 async def get_energy_consumption(
     device_name: str,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    service = EnergyService(db)
-    return await service.get_consumption(device_name)
+    return await db.run_sync(
+        lambda session: EnergyService(session).get_consumption(device_name)
+    )
 
 @router.get("/energy/consumption")
-async def list_energy_consumptions(db: Session = Depends(get_db)):
-    service = EnergyService(db)
-    return await service.list_consumptions()
+@cached(ttl=10)
+async def list_energy_consumptions(
+    device: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    after_ts: Optional[datetime] = None,  # Keyset cursor: last row of the previous page
+    after_id: Optional[int] = None,
+    limit: int = 100,
+    order: str = "desc",  # desc (newest first) or asc
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Raw readings, one page at a time
+
+    Pages are ordered by (timestamp, id). When a page is full, the
+    X-Next-After-Ts / X-Next-After-Id headers carry the cursor for the next
+    page. Use /energy/export to download a whole range.
+    """
+    from config import settings
+
+    if order not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="order must be 'asc' or 'desc'")
+    if after_id is not None and after_ts is None:
+        raise HTTPException(status_code=400, detail="after_id requires after_ts")
+    if not 1 <= limit <= settings.CONSUMPTION_PAGE_MAX:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {settings.CONSUMPTION_PAGE_MAX}")
+
+    rows = await db.run_sync(
+        lambda session: EnergyService(session).page_consumptions(
+            device_name=device,
+            start_time=start,
+            end_time=end,
+            after_ts=after_ts,
+            after_id=after_id,
+            limit=limit,
+            descending=order == "desc"
+        )
+    )
+
+    headers = {}
+    if len(rows) == limit:
+        headers = {"X-Next-After-Ts": rows[-1]["timestamp"], "X-Next-After-Id": str(rows[-1]["id"])}
+    return JSONResponse(content=rows, headers=headers)
+
+@router.get("/energy/export")
+def export_energy_consumptions(
+    format: str = "ndjson",  # ndjson or csv
+    device: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """
+    Stream raw readings (oldest first) as NDJSON or CSV
+
+    Rows are read through a server-side cursor and written as they arrive,
+    so memory use does not depend on the size of the range.
+    """
+    from config import settings
+    from database.connection import SessionLocal
+
+    if format not in ("ndjson", "csv"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'csv'")
+
+    def generate():
+        db = SessionLocal()
+        try:
+            readings = EnergyService(db).iter_consumptions(
+                device_name=device,
+                start_time=start,
+                end_time=end,
+                batch_size=settings.EXPORT_BATCH_SIZE
+            )
+            # Rows are written into a small buffer that is flushed in ~64 KB chunks
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            if format == "csv":
+                writer.writerow(["id", "device_name", "consumption", "timestamp"])
+            for reading in readings:
+                if format == "csv":
+                    writer.writerow([reading["id"], reading["device_name"], reading["consumption"], reading["timestamp"]])
+                else:
+                    buffer.write(json.dumps(reading) + "\n")
+                if buffer.tell() >= 65536:
+                    yield buffer.getvalue()
+                    buffer.seek(0)
+                    buffer.truncate()
+            yield buffer.getvalue()
+        finally:
+            db.close()
+
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    return StreamingResponse(
+        generate(),
+        media_type=media_type,
+        headers={"Content-Disposition": f"attachment; filename=energy_consumption.{format}"}
+    )
 
 @router.get("/devices")
-def get_devices(db: Session = Depends(get_db)):
+@cached(ttl=30, tags=(DEVICES,))
+async def get_devices(db: AsyncSession = Depends(get_async_db)):
     """Get all devices with their current status"""
-    result = db.execute(text("SELECT id, name, type, status, last_updated FROM devices ORDER BY id"))
+    result = await db.execute(text("SELECT id, name, type, status, last_updated FROM devices ORDER BY id"))
     devices = []
     for row in result:
         devices.append({
@@ -96,13 +263,13 @@ def get_devices(db: Session = Depends(get_db)):
     return devices
 
 @router.patch("/devices/{device_id}/toggle")
-def toggle_device(device_id: int, db: Session = Depends(get_db)):
+async def toggle_device(device_id: int, db: AsyncSession = Depends(get_async_db)):
     """Toggle device on/off status"""
     # Get current device
-    result = db.execute(
+    result = (await db.execute(
         text("SELECT id, name, status FROM devices WHERE id = :id"),
         {"id": device_id}
-    ).fetchone()
+    )).fetchone()
     
     if not result:
         raise HTTPException(status_code=404, detail="Device not found")
@@ -112,18 +279,19 @@ def toggle_device(device_id: int, db: Session = Depends(get_db)):
     new_status = "off" if current_status == "on" else "on"
     
     # Update database
-    db.execute(
+    await db.execute(
         text("UPDATE devices SET status = :status, last_updated = CURRENT_TIMESTAMP WHERE id = :id"),
         {"status": new_status, "id": device_id}
     )
-    db.commit()
+    await db.commit()
+    response_cache.invalidate(DEVICES)
     
     # Publish MQTT control message
     control_topic = f"smart_home/control/{device_name}"
     control_message = json.dumps({
         "device_name": device_name,
         "command": new_status,
-        "timestamp": str(db.execute(text("SELECT CURRENT_TIMESTAMP")).fetchone()[0])
+        "timestamp": str((await db.execute(text("SELECT CURRENT_TIMESTAMP"))).fetchone()[0])
     })
     
     try:
@@ -144,107 +312,100 @@ def toggle_device(device_id: int, db: Session = Depends(get_db)):
     }
 
 @router.get("/energy")
-async def get_energy_stats(db: Session = Depends(get_db)):
-    from config import settings
-    service = EnergyService(db)
-    consumptions = await service.list_consumptions()
-    
-    total = sum(c.consumption for c in consumptions) if consumptions else 0
-    avg = total / len(consumptions) if consumptions else 0
+@cached(ttl=10)
+async def get_energy_stats(
+    start: Optional[datetime] = None,  # Optional window, default: all data
+    end: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Total, peak and average cost per reading, aggregated from the rollups"""
+    from services.rollup_service import RollupService
+    from services.tariff_service import total_cost
+
+    def load(session):
+        return RollupService(session).summary(start, end), total_cost(session, start, end)
+
+    summary, cost = await db.run_sync(load)
     
     return {
-        "totalConsumption": round(total, 2),
-        "peakUsage": round(max([c.consumption for c in consumptions], default=0), 2),
-        "averageCost": round(avg * settings.ELECTRICITY_RATE, 2)
+        "totalConsumption": round(summary["total"], 2),
+        "peakUsage": round(summary["peak"], 2),
+        "averageCost": round(cost / summary["readings"] if summary["readings"] else 0.0, 2)
     }
 
 @router.get("/energy/cost")
+@cached(ttl=60)
 async def get_energy_cost(
     period: str = "7days",  # hourly, daily, weekly, monthly, 7days, 30days
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Calculate energy costs for different time periods
+    Calculate energy costs for different time periods under the configured tariff
     """
-    from config import settings
     from datetime import datetime, timedelta
     
+    from services.rollup_service import RollupService
+    from services.tariff_service import tariffs, window_costs
+    
     # Determine time range
     now = datetime.now()
     if period == "hourly":
         start_time = now - timedelta(hours=24)
-        group_by = "DATE_TRUNC('hour', timestamp)"
+        grain = "hour"
     elif period == "daily":
         start_time = now - timedelta(days=7)
-        group_by = "DATE_TRUNC('day', timestamp)"
+        grain = "day"
     elif period == "weekly":
         start_time = now - timedelta(weeks=4)
-        group_by = "DATE_TRUNC('week', timestamp)"
+        grain = "week"
     elif period == "monthly":
         start_time = now - timedelta(days=365)
-        group_by = "DATE_TRUNC('month', timestamp)"
+        grain = "month"
     elif period == "30days":
         start_time = now - timedelta(days=30)
-        group_by = "DATE_TRUNC('day', timestamp)"
+        grain = "day"
     else:  # 7days default
         start_time = now - timedelta(days=7)
-        group_by = "DATE_TRUNC('day', timestamp)"
+        grain = "day"
+    
+    # Totals, device breakdown and time buckets all come from the rollups,
+    # costs from their hourly buckets priced by the tariff
+    def load(session):
+        rollups = RollupService(session)
+        return (
+            rollups.summary(start_time),
+            rollups.device_totals(start_time),
+            rollups.series(start_time, grain),
+            window_costs(session, start_time)
+        )
+    
+    total_stats, device_results, period_results, costs = await db.run_sync(load)
+    device_costs = costs.by_device()
+    period_costs = costs.by_period(grain)
     
     # Get total cost
-    total_query = text("""
-        SELECT 
-            SUM(consumption) as total_consumption,
-            COUNT(*) as data_points
-        FROM energy_consumption
-        WHERE timestamp >= :start_time
-    """)
-    total_result = db.execute(total_query, {"start_time": start_time}).fetchone()
-    total_consumption = float(total_result[0]) if total_result[0] else 0.0
-    total_cost = round(total_consumption * settings.ELECTRICITY_RATE, 2)
+    total_consumption = total_stats["total"]
+    total_cost = round(costs.total(), 2)
     
     # Get cost by device
-    device_query = text("""
-        SELECT 
-            device_name,
-            SUM(consumption) as consumption,
-            COUNT(*) as readings
-        FROM energy_consumption
-        WHERE timestamp >= :start_time
-        GROUP BY device_name
-        ORDER BY consumption DESC
-    """)
-    device_results = db.execute(device_query, {"start_time": start_time}).fetchall()
-    
     devices_cost = []
     for row in device_results:
-        device_consumption = float(row[1])
-        device_cost = round(device_consumption * settings.ELECTRICITY_RATE, 2)
+        device_consumption = row["total"]
+        device_cost = round(device_costs.get(row["device_name"], 0.0), 2)
         devices_cost.append({
-            "device": row[0],
+            "device": row["device_name"],
             "consumption": round(device_consumption, 3),
             "cost": device_cost,
             "percentage": round((device_consumption / total_consumption * 100) if total_consumption > 0 else 0, 1)
         })
     
-    # Get cost by time period
-    period_query = text(f"""
-        SELECT 
-            {group_by} as period,
-            SUM(consumption) as consumption
-        FROM energy_consumption
-        WHERE timestamp >= :start_time
-        GROUP BY period
-        ORDER BY period DESC
-        LIMIT 30
-    """)
-    period_results = db.execute(period_query, {"start_time": start_time}).fetchall()
-    
+    # Get cost by time period (latest 30 periods, newest first)
     periods_cost = []
-    for row in period_results:
-        period_consumption = float(row[1])
-        period_cost = round(period_consumption * settings.ELECTRICITY_RATE, 2)
+    for row in reversed(period_results[-30:]):
+        period_consumption = row["total"]
+        period_cost = round(period_costs.get(row["period"], 0.0), 2)
         periods_cost.append({
-            "period": row[0].isoformat() if row[0] else None,
+            "period": row["period"].isoformat() if row["period"] else None,
             "consumption": round(period_consumption, 3),
             "cost": period_cost
         })
@@ -259,7 +420,8 @@ async def get_energy_cost(
     
     return {
         "period": period,
-        "electricityRate": settings.ELECTRICITY_RATE,
+        "tariff": tariffs.name,
+        "electricityRate": round(costs.average_rate(), 4),
         "totalConsumption": round(total_consumption, 2),
         "totalCost": total_cost,
         "projectedMonthlyCost": projected_monthly,
@@ -270,137 +432,99 @@ async def get_energy_cost(
     }
 
 @router.get("/energy/stats")
+@cached(ttl=30)
 async def get_energy_stats_detailed(
     period: str = "24h",  # 24h, 7d, 30d, 1y
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get detailed energy statistics with time-series data for charts
     """
-    from config import settings
     from datetime import datetime, timedelta
     
+    from services.rollup_service import RollupService
+    from services.tariff_service import tariffs, window_costs
+    
     # Determine time range and grouping
     now = datetime.now()
     if period == "24h":
         start_time = now - timedelta(hours=24)
-        group_by = "DATE_TRUNC('hour', timestamp)"
-        label_format = "hour"
+        grain = "hour"
     elif period == "7d":
         start_time = now - timedelta(days=7)
-        group_by = "DATE_TRUNC('day', timestamp)"
-        label_format = "day"
+        grain = "day"
     elif period == "30d":
         start_time = now - timedelta(days=30)
-        group_by = "DATE_TRUNC('day', timestamp)"
-        label_format = "day"
+        grain = "day"
     else:  # 1y
         start_time = now - timedelta(days=365)
-        group_by = "DATE_TRUNC('month', timestamp)"
-        label_format = "month"
+        grain = "month"
+    
+    # Every aggregate below is served from the hourly/daily rollups
+    def load(session):
+        rollups = RollupService(session)
+        return (
+            rollups.series(start_time, grain),
+            rollups.series(start_time, grain, by_device=True),
+            rollups.summary(start_time),
+            rollups.device_totals(start_time),
+            window_costs(session, start_time)
+        )
+    
+    timeseries_results, device_timeseries_results, total_stats, device_totals_results, costs = await db.run_sync(load)
+    period_costs = costs.by_period(grain)
+    device_costs = costs.by_device()
     
     # Time series data - consumption over time
-    timeseries_query = text(f"""
-        SELECT 
-            {group_by} as period,
-            SUM(consumption) as total_consumption,
-            AVG(consumption) as avg_consumption,
-            MAX(consumption) as peak_consumption,
-            COUNT(*) as readings
-        FROM energy_consumption
-        WHERE timestamp >= :start_time
-        GROUP BY period
-        ORDER BY period ASC
-    """)
-    timeseries_results = db.execute(timeseries_query, {"start_time": start_time}).fetchall()
-    
     timeseries_data = []
     for row in timeseries_results:
         timeseries_data.append({
-            "period": row[0].isoformat() if row[0] else None,
-            "totalConsumption": round(float(row[1]), 3),
-            "avgConsumption": round(float(row[2]), 4),
-            "peakConsumption": round(float(row[3]), 4),
-            "readings": row[4],
-            "cost": round(float(row[1]) * settings.ELECTRICITY_RATE, 2)
+            "period": row["period"].isoformat() if row["period"] else None,
+            "totalConsumption": round(row["total"], 3),
+            "avgConsumption": round(row["average"], 4),
+            "peakConsumption": round(row["peak"], 4),
+            "readings": row["readings"],
+            "cost": round(period_costs.get(row["period"], 0.0), 2)
         })
     
-    # Device breakdown over time
-    device_timeseries_query = text(f"""
-        SELECT 
-            device_name,
-            {group_by} as period,
-            SUM(consumption) as consumption
-        FROM energy_consumption
-        WHERE timestamp >= :start_time
-        GROUP BY device_name, period
-        ORDER BY device_name, period ASC
-    """)
-    device_timeseries_results = db.execute(device_timeseries_query, {"start_time": start_time}).fetchall()
-    
-    # Organize by device
+    # Device breakdown over time, organized by device
     device_series = {}
     for row in device_timeseries_results:
-        device_name = row[0]
+        device_name = row["device_name"]
         if device_name not in device_series:
             device_series[device_name] = []
         device_series[device_name].append({
-            "period": row[1].isoformat() if row[1] else None,
-            "consumption": round(float(row[2]), 3)
+            "period": row["period"].isoformat() if row["period"] else None,
+            "consumption": round(row["total"], 3)
         })
     
-    # Total statistics
-    total_stats_query = text("""
-        SELECT 
-            SUM(consumption) as total,
-            AVG(consumption) as average,
-            MAX(consumption) as peak,
-            MIN(consumption) as minimum,
-            COUNT(*) as readings
-        FROM energy_consumption
-        WHERE timestamp >= :start_time
-    """)
-    total_stats = db.execute(total_stats_query, {"start_time": start_time}).fetchone()
-    
     # Device totals
-    device_totals_query = text("""
-        SELECT 
-            device_name,
-            SUM(consumption) as total_consumption,
-            AVG(consumption) as avg_consumption,
-            COUNT(*) as readings
-        FROM energy_consumption
-        WHERE timestamp >= :start_time
-        GROUP BY device_name
-        ORDER BY total_consumption DESC
-    """)
-    device_totals_results = db.execute(device_totals_query, {"start_time": start_time}).fetchall()
-    
     device_totals = []
-    total_consumption = float(total_stats[0]) if total_stats[0] else 0.0
+    total_consumption = total_stats["total"]
     for row in device_totals_results:
-        device_consumption = float(row[1])
+        device_consumption = row["total"]
         device_totals.append({
-            "device": row[0],
+            "device": row["device_name"],
             "totalConsumption": round(device_consumption, 3),
-            "avgConsumption": round(float(row[2]), 4),
-            "readings": row[3],
+            "avgConsumption": round(row["average"], 4),
+            "readings": row["readings"],
             "percentage": round((device_consumption / total_consumption * 100) if total_consumption > 0 else 0, 1),
-            "cost": round(device_consumption * settings.ELECTRICITY_RATE, 2)
+            "cost": round(device_costs.get(row["device_name"], 0.0), 2)
         })
     
     return {
         "period": period,
         "startTime": start_time.isoformat(),
         "endTime": now.isoformat(),
-        "electricityRate": settings.ELECTRICITY_RATE,
+        "tariff": tariffs.name,
+        "electricityRate": round(costs.average_rate(), 4),
         "summary": {
-            "totalConsumption": round(float(total_stats[0]) if total_stats[0] else 0.0, 2),
-            "avgConsumption": round(float(total_stats[1]) if total_stats[1] else 0.0, 4),
-            "peakConsumption": round(float(total_stats[2]) if total_stats[2] else 0.0, 4),
-            "minConsumption": round(float(total_stats[3]) if total_stats[3] else 0.0, 4),
-            "totalReadings": total_stats[4],
-            "totalCost": round((float(total_stats[0]) if total_stats[0] else 0.0) * settings.ELECTRICITY_RATE, 2)
+            "totalConsumption": round(total_stats["total"], 2),
+            "avgConsumption": round(total_stats["average"], 4),
+            "peakConsumption": round(total_stats["peak"], 4),
+            "minConsumption": round(total_stats["minimum"], 4),
+            "totalReadings": total_stats["readings"],
+            "totalCost": round(costs.total(), 2)
         },
         "timeseries": timeseries_data,
         "deviceSeries": device_series,
@@ -410,9 +534,13 @@ async def get_energy_stats_detailed(
 # ============================================================================
 # ML Prediction Endpoints
 # ============================================================================
+# Model training, loading and prediction are CPU-bound and synchronous, so
+# these handlers are plain functions that FastAPI runs in its threadpool
+# instead of on the event loop.
 
 @router.get("/ml/predictions")
-async def get_predictions(
+@cached(ttl=60, tags=(ML,))
+def get_predictions(
     hours: int = 24,
     device: str = None,
     db: Session = Depends(get_db)
@@ -441,7 +569,8 @@ async def get_predictions(
     return result
 
 @router.get("/ml/predictions/summary")
-async def get_predictions_summary(
+@cached(ttl=60, tags=(ML,))
+def get_predictions_summary(
     hours: int = 24,
     db: Session = Depends(get_db)
 ):
@@ -467,37 +596,114 @@ async def get_predictions_summary(
     
     return result
 
-@router.post("/ml/train")
-async def train_models(
+@router.post("/energy/optimize")
+def optimize_energy_usage(
+    request: Optional[LoadShiftRequestSchema] = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Schedule flexible devices into the cheapest hours of the forecast horizon
+    
+    Uses the per-device ML forecast, the configured tariff and the device
+    constraints (run length, allowed hours, finish-by) under an optional
+    household peak cap.
+    
+    Args:
+        request: Flexible loads, peak cap and horizon (all optional)
+    
+    Returns:
+        Run hours per device with baseline and optimized cost, savings and hourly load
+    """
+    from services.load_shifting import FlexibleLoad
+    
+    request = request or LoadShiftRequestSchema()
+    if not 1 <= request.hours <= 168:
+        raise HTTPException(status_code=400, detail="hours must be between 1 and 168")
+    
+    loads = None
+    if request.loads is not None:
+        loads = []
+        for load in request.loads:
+            if len(load.allowed_hours) != 2 or not all(0 <= hour <= 24 for hour in load.allowed_hours):
+                raise HTTPException(status_code=400, detail=f"{load.device_name}: allowed_hours must be [start, end] within 0-24")
+            loads.append(FlexibleLoad(**{**load.model_dump(), "allowed_hours": tuple(load.allowed_hours)}))
+    
+    return EnergyService(db).optimize_energy_usage(loads, request.peak_cap_kw, request.hours)
+
+@router.post("/ml/train", status_code=202)
+def train_models(
     device: str = None,
     days: int = 7,
     db: Session = Depends(get_db)
 ):
     """
-    Train or retrain ML models
+    Queue training or retraining of ML models
+    
+    Training runs in background worker processes; poll
+    /ml/train/jobs/{job_id} for progress and results.
     
     Args:
         device: Specific device to train (optional, if not provided trains all)
         days: Number of days of historical data to use (default: 7)
     
     Returns:
-        Training results
+        The queued training job
     """
-    from services.ml_service import MLService
+    from services.training_jobs import training_manager, training_targets
     
-    ml_service = MLService(db)
+    # device=__global__ trains only the shared cross-device model
+    devices = [device] if device else training_targets(db)
+    job = training_manager.submit(devices, days)
+    return {"success": True, **job.as_dict()}
+
+@router.post("/ml/update")
+def update_models(
+    device: str = None,
+    db: Session = Depends(get_db)
+):
+    """
+    Incrementally update trained models with the readings since their last update
     
-    if device:
-        # Train specific device
-        result = ml_service.train_model(device, days)
-    else:
-        # Train all devices
-        result = ml_service.train_all_models(days)
+    Much cheaper than /ml/train: only new readings are read and Ridge
+    models are updated exactly; tree models only get fresh hourly averages.
+    
+    Args:
+        device: Specific device to update (optional, if not provided updates all)
     
+    Returns:
+        Update results
+    """
+    from services.ml_service import MLService
+    from services.training_jobs import training_manager
+    
+    if training_manager.running():
+        raise HTTPException(status_code=409, detail="A training job is in progress")
+    
+    ml_service = MLService(db)
+    result = ml_service.update_model(device) if device else ml_service.update_all_models()
+    response_cache.invalidate(ML)
     return result
 
+@router.get("/ml/train/jobs")
+def list_training_jobs():
+    """Recent training jobs, newest first (without per-device results)"""
+    from services.training_jobs import training_manager
+
+    return {"jobs": [job.as_dict(include_results=False) for job in training_manager.list()]}
+
+@router.get("/ml/train/jobs/{job_id}")
+def get_training_job(job_id: str):
+    """Status, progress and per-device results of a training job"""
+    from services.training_jobs import training_manager
+
+    job = training_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Training job '{job_id}' not found")
+    return job.as_dict()
+
 @router.get("/ml/device/{device_name}/predictions")
-async def get_device_predictions(
+@cached(ttl=60, tags=(ML,))
+def get_device_predictions(
     device_name: str,
     hours: int = 24,
     db: Session = Depends(get_db)
@@ -523,7 +729,8 @@ async def get_device_predictions(
     return result
 
 @router.get("/ml/models")
-async def get_all_models(db: Session = Depends(get_db)):
+@cached(ttl=300, tags=(ML,))
+def get_all_models(db: Session = Depends(get_db)):
     """
     Get information about all trained ML models
     
@@ -531,8 +738,7 @@ async def get_all_models(db: Session = Depends(get_db)):
         List of models with their metrics and metadata
     """
     from services.ml_service import MLService
-    import os
-    import joblib
+    from services.model_registry import model_registry
     
     ml_service = MLService(db)
     models_info = []
@@ -542,11 +748,12 @@ async def get_all_models(db: Session = Depends(get_db)):
     devices = [row[0] for row in result.fetchall()]
     
     for device_name in devices:
-        metadata_path = os.path.join(ml_service.model_dir, f"{device_name}_metadata.pkl")
+        # Only the manifest is read; the model itself is not loaded
+        manifest = model_registry.manifest(ml_service.model_dir, device_name)
         
-        if os.path.exists(metadata_path):
+        if manifest is not None and manifest["metadata"]:
             try:
-                metadata = joblib.load(metadata_path)
+                metadata = manifest["metadata"]
                 
                 # Convert numpy types to Python types
                 training_start = metadata.get('training_start_time')
@@ -562,6 +769,7 @@ async def get_all_models(db: Session = Depends(get_db)):
                 models_info.append({
                     "device_name": device_name,
                     "algorithm": algorithm,
+                    "version": manifest["version"],
                     "train_r2_score": train_r2,
                     "test_r2_score": test_r2,
                     "test_mae": test_mae,
@@ -583,7 +791,8 @@ async def get_all_models(db: Session = Depends(get_db)):
     }
 
 @router.get("/ml/device/{device_name}/model-info")
-async def get_device_model_info(device_name: str, db: Session = Depends(get_db)):
+@cached(ttl=300, tags=(ML,))
+def get_device_model_info(device_name: str, db: Session = Depends(get_db)):
     """
     Get detailed model information for a specific device
     
@@ -593,18 +802,18 @@ async def get_device_model_info(device_name: str, db: Session = Depends(get_db))
     Returns:
         Detailed model metrics and information
     """
+    from services.feature_store import feature_store
     from services.ml_service import MLService
-    import os
-    import joblib
+    from services.model_registry import model_registry
     
     ml_service = MLService(db)
-    metadata_path = os.path.join(ml_service.model_dir, f"{device_name}_metadata.pkl")
+    manifest = model_registry.manifest(ml_service.model_dir, device_name)
     
-    if not os.path.exists(metadata_path):
+    if manifest is None or not manifest["metadata"]:
         raise HTTPException(status_code=404, detail=f"No trained model found for {device_name}")
     
     try:
-        metadata = joblib.load(metadata_path)
+        metadata = manifest["metadata"]
         
         # Convert numpy types to Python types
         algorithm = metadata.get('algorithm', 'Linear Regression')
@@ -620,6 +829,7 @@ async def get_device_model_info(device_name: str, db: Session = Depends(get_db))
             "success": True,
             "device_name": device_name,
             "algorithm": f"{algorithm} (scikit-learn)",
+            "version": manifest["version"],
             "model_type": "Simple Averaging Fallback" if bool(metadata.get('use_simple_model')) else "Advanced ML Model",
             "metrics": {
                 "train_r2_score": round(train_r2, 4),
@@ -645,7 +855,9 @@ async def get_device_model_info(device_name: str, db: Session = Depends(get_db))
                 "time_encoding": "Cyclical hour and day encoding",
                 "statistical": "Rolling std, min, max over 24h window",
                 "interactions": "Combined effects (hour × weekend)"
-            }
+            },
+            # Read from the feature store, not recomputed
+            "latest_features": feature_store.latest(device_name)
         }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error loading model info: {str(e)}")
@@ -671,9 +883,10 @@ def get_r2_interpretation(r2_score):
 # ============================================================================
 
 @router.get("/efficiency/score")
+@cached(ttl=60)
 async def get_efficiency_score(
     days: int = 7,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get energy efficiency score and grade
@@ -684,28 +897,39 @@ async def get_efficiency_score(
     Returns:
         Score (0-100), grade (A+ to F), comparison, tips, historical data
     """
-    efficiency_service = EfficiencyService(db)
-    result = efficiency_service.calculate_efficiency_score(days)
-    return result
+    from services.analytics_snapshot import analytics_snapshots
+    
+    if not 1 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+    
+    snapshot = await analytics_snapshots.aget(db, days)
+    return await db.run_sync(
+        lambda session: EfficiencyService(session).calculate_efficiency_score(days, snapshot)
+    )
 
 
 @router.get("/efficiency/insights")
-async def get_efficiency_insights(db: Session = Depends(get_db)):
+@cached(ttl=60)
+async def get_efficiency_insights(db: AsyncSession = Depends(get_async_db)):
     """
     Get detailed efficiency insights
     
     Returns:
         Device-level and time-based efficiency analysis
     """
-    efficiency_service = EfficiencyService(db)
-    result = efficiency_service.get_efficiency_insights()
-    return result
+    from services.analytics_snapshot import analytics_snapshots
+    
+    snapshot = await analytics_snapshots.aget(db, 7)
+    return await db.run_sync(
+        lambda session: EfficiencyService(session).get_efficiency_insights(snapshot)
+    )
 
 
 @router.get("/energy/peak-hours")
+@cached(ttl=60)
 async def get_peak_hours(
     days: int = 7,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Get peak consumption hours analysis
@@ -716,39 +940,30 @@ async def get_peak_hours(
     Returns:
         Hourly average consumption, peak hours, off-peak hours, potential savings
     """
-    from datetime import datetime, timedelta
-    from sqlalchemy import func
-    from models.energy import EnergyConsumption
+    from services.analytics_snapshot import analytics_snapshots
+    
+    if not 1 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 366")
     
     try:
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
-        
-        # Get hourly consumption averages
-        hourly_data = db.query(
-            func.extract('hour', EnergyConsumption.timestamp).label('hour'),
-            func.avg(EnergyConsumption.consumption).label('avg_consumption'),
-            func.sum(EnergyConsumption.consumption).label('total_consumption'),
-            func.count(EnergyConsumption.id).label('count')
-        ).filter(
-            EnergyConsumption.timestamp >= start_date
-        ).group_by(
-            func.extract('hour', EnergyConsumption.timestamp)
-        ).order_by('hour').all()
+        # Hour-of-day profile from the analytics snapshot shared with the efficiency endpoints
+        hourly_data = (await analytics_snapshots.aget(db, days)).hour_of_day()
         
         # Convert to dictionary
         hourly_avg = {}
         hourly_total = {}
-        for row in hourly_data:
-            hour = int(row.hour)
-            hourly_avg[hour] = round(row.avg_consumption, 3)
-            hourly_total[hour] = round(row.total_consumption, 2)
+        hourly_cost = {}
+        for hour, row in hourly_data.items():
+            hourly_avg[hour] = round(row["average"], 3)
+            hourly_total[hour] = round(row["total"], 2)
+            hourly_cost[hour] = row["cost"]
         
         # Fill missing hours with 0
         for hour in range(24):
             if hour not in hourly_avg:
                 hourly_avg[hour] = 0.0
                 hourly_total[hour] = 0.0
+                hourly_cost[hour] = 0.0
         
         # Identify peak and off-peak hours
         if hourly_avg:
@@ -767,7 +982,7 @@ async def get_peak_hours(
         # Calculate potential savings (assuming 30% rate difference between peak and off-peak)
         total_peak_consumption = sum(hourly_total[h] for h in peak_hours)
         potential_savings_kwh = total_peak_consumption * 0.3
-        potential_savings_monthly = (potential_savings_kwh / days) * 30 * 0.12  # $0.12/kWh
+        potential_savings_monthly = (sum(hourly_cost[h] for h in peak_hours) * 0.3 / days) * 30  # At tariff rates
         
         # Generate recommendations
         recommendations = []
@@ -802,77 +1017,98 @@ async def get_peak_hours(
         raise HTTPException(status_code=500, detail=f"Error analyzing peak hours: {str(e)}")
 
 
+@router.get("/energy/peak-demand")
+@cached(ttl=60, tags=(READINGS,))
+async def get_peak_demand(
+    days: int = 31,
+    top: int = 3,
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Get coincident household peaks and demand charges
+    
+    Args:
+        days: Number of days to analyze (default 31)
+        top: Peaks reported per billing month and window length (default 3)
+    
+    Returns:
+        Per billing month: top 15- and 30-minute peaks with device shares, and the demand charge
+    """
+    from datetime import timedelta
+    from services.peak_demand import PeakDemandService
+    
+    if not 1 <= days <= 366:
+        raise HTTPException(status_code=400, detail="days must be between 1 and 366")
+    if not 1 <= top <= 20:
+        raise HTTPException(status_code=400, detail="top must be between 1 and 20")
+    
+    start_time = datetime.utcnow() - timedelta(days=days)
+    try:
+        return await db.run_sync(
+            lambda session: PeakDemandService(session).analyze(start_time, top_n=top)
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error analyzing peak demand: {str(e)}")
+
+
 @router.get("/recommendations")
-async def get_recommendations(db: Session = Depends(get_db)):
+@cached(ttl=60, tags=(READINGS, DEVICES))
+async def get_recommendations(db: AsyncSession = Depends(get_async_db)):
     """
     Get smart recommendations to reduce energy consumption
     
     Returns:
         List of actionable recommendations with priority and potential savings
     """
-    from datetime import datetime, timedelta
-    from sqlalchemy import func
-    from models.energy import EnergyConsumption
+    from services.analytics_snapshot import analytics_snapshots
     
     try:
         recommendations = []
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=7)
         
-        # Analyze device usage patterns
-        device_data = db.query(
-            EnergyConsumption.device_name,
-            func.sum(EnergyConsumption.consumption).label('total'),
-            func.avg(EnergyConsumption.consumption).label('average'),
-            func.count(EnergyConsumption.id).label('count')
-        ).filter(
-            EnergyConsumption.timestamp >= start_date
-        ).group_by(
-            EnergyConsumption.device_name
-        ).all()
+        # Analyze device usage patterns and hour-of-day profile from the shared snapshot
+        snapshot = await analytics_snapshots.aget(db, 7)
+        device_data, hourly_data = snapshot.device_totals(), snapshot.hour_of_day()
         
-        total_consumption = sum(d.total for d in device_data)
+        total_consumption = sum(d["total"] for d in device_data)
+        total_cost = sum(d["cost"] for d in device_data)
         
         # Recommendation 1: High consumption devices
         for device in device_data:
-            device_percentage = (device.total / total_consumption * 100) if total_consumption > 0 else 0
+            device_percentage = (device['total'] / total_consumption * 100) if total_consumption > 0 else 0
             
             if device_percentage > 40:
                 recommendations.append({
                     "id": len(recommendations) + 1,
                     "priority": "high",
                     "type": "high_consumption",
-                    "device": device.device_name,
-                    "title": f"High Consumption Alert: {device.device_name}",
-                    "message": f"{device.device_name} accounts for {device_percentage:.1f}% of total consumption",
+                    "device": device['device_name'],
+                    "title": f"High Consumption Alert: {device['device_name']}",
+                    "message": f"{device['device_name']} accounts for {device_percentage:.1f}% of total consumption",
                     "action": "Consider upgrading to energy-efficient model or reducing usage time",
-                    "savings": f"${(device.total * 0.12 * 0.3):.2f}/week",
+                    "savings": f"${(device['cost'] * 0.3):.2f}/week",
                     "impact": "high"
                 })
         
         # Recommendation 2: Always-on devices
         for device in device_data:
-            readings_per_day = device.count / 7
+            readings_per_day = device['readings'] / 7
             if readings_per_day > 140:  # More than ~144 readings/day (every 10 min)
                 recommendations.append({
                     "id": len(recommendations) + 1,
                     "priority": "medium",
                     "type": "always_on",
-                    "device": device.device_name,
-                    "title": f"Always-On Device: {device.device_name}",
-                    "message": f"{device.device_name} has been running continuously",
+                    "device": device['device_name'],
+                    "title": f"Always-On Device: {device['device_name']}",
+                    "message": f"{device['device_name']} has been running continuously",
                     "action": "Turn off when not in use to save energy",
-                    "savings": f"${(device.total * 0.12 * 0.2):.2f}/week",
+                    "savings": f"${(device['cost'] * 0.2):.2f}/week",
                     "impact": "medium"
                 })
         
         # Recommendation 3: Peak hours usage
-        peak_consumption = db.query(
-            func.sum(EnergyConsumption.consumption)
-        ).filter(
-            EnergyConsumption.timestamp >= start_date,
-            func.extract('hour', EnergyConsumption.timestamp).between(18, 22)
-        ).scalar() or 0.0
+        peak_hours = [row for hour, row in hourly_data.items() if 18 <= hour <= 22]
+        peak_consumption = sum(row["total"] for row in peak_hours)
+        peak_cost = sum(row["cost"] for row in peak_hours)
         
         if peak_consumption > total_consumption * 0.35:
             recommendations.append({
@@ -883,7 +1119,7 @@ async def get_recommendations(db: Session = Depends(get_db)):
                 "title": "Peak Hours Consumption",
                 "message": "35%+ of consumption occurs during peak hours (6 PM - 10 PM)",
                 "action": "Shift washing machine and other flexible loads to 2 AM - 6 AM",
-                "savings": f"${(peak_consumption * 0.12 * 0.25):.2f}/week",
+                "savings": f"${(peak_cost * 0.25):.2f}/week",
                 "impact": "high"
             })
         
@@ -897,7 +1133,7 @@ async def get_recommendations(db: Session = Depends(get_db)):
                 "title": "Overall Efficiency Improvement",
                 "message": "Daily consumption is above average household levels",
                 "action": "Review all devices and identify inefficient appliances",
-                "savings": f"${(total_consumption * 0.12 * 0.15):.2f}/week",
+                "savings": f"${(total_cost * 0.15):.2f}/week",
                 "impact": "medium"
             })
         
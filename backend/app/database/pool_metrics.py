@@ -0,0 +1,111 @@
+"""
+Connection pool instrumentation
+
+Pool classes that time every checkout so pool sizing can be based on data:
+how long requests wait for a connection, how often the overflow is used and
+how many checkouts time out.
+"""
+import logging
+import threading
+import time
+from typing import Dict
+
+from sqlalchemy import exc
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+
+class PoolMetrics:
+    """Thread-safe checkout counters for one pool"""
+
+    def __init__(self, slow_checkout_ms: float = 500.0):
+        self.slow_checkout_ms = slow_checkout_ms
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.slow_checkouts = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+
+    def record_checkout(self, wait_ms: float, pool: QueuePool):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait_ms += wait_ms
+            self.max_wait_ms = max(self.max_wait_ms, wait_ms)
+            slow = wait_ms >= self.slow_checkout_ms
+            if slow:
+                self.slow_checkouts += 1
+
+        if slow:
+            logger.warning(f"Slow connection checkout: waited {wait_ms:.0f} ms ({pool.status()})")
+
+    def record_timeout(self, wait_ms: float, pool: QueuePool):
+        with self._lock:
+            self.timeouts += 1
+        logger.error(f"Connection checkout timed out after {wait_ms:.0f} ms ({pool.status()})")
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "slow_checkouts": self.slow_checkouts,
+                "avg_wait_ms": round(self.total_wait_ms / self.checkouts, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_ms, 3)
+            }
+
+
+class _InstrumentedPoolMixin:
+    """Times QueuePool._do_get, which blocks while the pool is exhausted"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics(settings.DB_POOL_SLOW_CHECKOUT_MS)
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_timeout((time.perf_counter() - start) * 1000, self)
+            raise
+        self.metrics.record_checkout((time.perf_counter() - start) * 1000, self)
+        return connection
+
+
+class InstrumentedQueuePool(_InstrumentedPoolMixin, QueuePool):
+    pass
+
+
+class InstrumentedAsyncAdaptedQueuePool(_InstrumentedPoolMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def pool_snapshot(pool) -> Dict:
+    """
+    Current occupancy and checkout statistics of a pool
+
+    Args:
+        pool: The engine's pool (engine.pool or async_engine.sync_engine.pool)
+
+    Returns:
+        Dictionary with configured size, checked-out, idle and overflow
+        connections plus checkout wait statistics
+    """
+    snapshot = {
+        "pool_class": type(pool).__name__,
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "idle": pool.checkedin(),
+        # QueuePool.overflow() is negative while base slots are still free
+        "overflow_in_use": max(0, pool.overflow()),
+        "max_overflow": getattr(pool, "_max_overflow", None),
+        "timeout_seconds": pool.timeout()
+    }
+    metrics = getattr(pool, "metrics", None)
+    if metrics is not None:
+        snapshot.update(metrics.as_dict())
+    return snapshot
@@ -6,7 +6,12 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from api.routes import router as api_router
 from config import settings
-from database.connection import engine, Base
+from database.connection import engine, Base, SessionLocal
+from services.ingestion_service import start_ingestion_worker, stop_ingestion_worker
+from services.partition_service import PartitionService
+from services.rollup_service import RollupService
+from services.training_jobs import training_manager
+from services import scheduler
 
 # Create database tables
 Base.metadata.create_all(bind=engine)
@@ -19,10 +24,61 @@ app.add_middleware(
     allow_credentials=False if '*' in settings.origins_list else True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-After-Ts", "X-Next-After-Id"],
 )
 
 app.include_router(api_router)
 
+@app.on_event("startup")
+def backfill_rollups():
+    db = SessionLocal()
+    try:
+        RollupService(db).backfill_if_empty()
+    finally:
+        db.close()
+
+def run_partition_maintenance():
+    db = SessionLocal()
+    try:
+        PartitionService(db).run_maintenance()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def run_model_updates():
+    from services.ml_service import MLService
+
+    # Full retrains rewrite the same artifacts; they also include the new data
+    if training_manager.running():
+        return
+    db = SessionLocal()
+    try:
+        MLService(db).update_all_models()
+    finally:
+        db.close()
+
+@app.on_event("startup")
+def start_background_workers():
+    scheduler.schedule("partition-maintenance", settings.PARTITION_MAINTENANCE_INTERVAL, run_partition_maintenance)
+    if settings.ML_TRAINING_INTERVAL > 0:
+        scheduler.schedule(
+            "ml-training", settings.ML_TRAINING_INTERVAL,
+            lambda: training_manager.submit_all(settings.ML_TRAINING_DAYS),
+            run_immediately=False
+        )
+    if settings.ML_UPDATE_INTERVAL > 0:
+        scheduler.schedule("ml-update", settings.ML_UPDATE_INTERVAL, run_model_updates, run_immediately=False)
+    if settings.MQTT_INGEST_ENABLED:
+        start_ingestion_worker()
+
+@app.on_event("shutdown")
+def stop_background_workers():
+    stop_ingestion_worker()
+    scheduler.stop_all()
+    training_manager.shutdown()
+
 @app.get("/")
 def read_root():
     return {"message": "Welcome to the Smart Home Energy Management System API"}
\ No newline at end of file
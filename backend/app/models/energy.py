@@ -1,16 +1,25 @@
-from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean
+from sqlalchemy import Column, Integer, Float, String, DateTime, Boolean, Index
 from database.connection import Base
 from datetime import datetime
 from pydantic import BaseModel
-from typing import Optional
+from typing import List, Optional
 
 class EnergyConsumption(Base):
     __tablename__ = 'energy_consumption'
 
-    id = Column(Integer, primary_key=True, index=True)
-    device_name = Column(String, index=True)
+    # Partitioned by timestamp, so it has to be part of the primary key
+    id = Column(Integer, primary_key=True, autoincrement=True, index=True)
+    device_name = Column(String)
     consumption = Column(Float)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+    timestamp = Column(DateTime, primary_key=True, default=datetime.utcnow)
+
+    __table_args__ = (
+        # Covers per-device range reads so they can be answered index-only
+        Index(
+            "idx_energy_device_timestamp", "device_name", "timestamp",
+            postgresql_include=["consumption", "id"]
+        ),
+    )
 
 class EnergyDevice(Base):
     __tablename__ = "devices"
@@ -21,6 +30,34 @@ class EnergyDevice(Base):
     status = Column(String, default="on", nullable=False)
     last_updated = Column(DateTime, default=datetime.utcnow)
 
+class RollupMixin:
+    """Per-device aggregate of the readings in one time bucket"""
+    bucket = Column(DateTime, primary_key=True)
+    device_name = Column(String, primary_key=True)
+    consumption_sum = Column(Float, nullable=False, default=0.0)
+    consumption_sum_sq = Column(Float, nullable=False, default=0.0)
+    consumption_min = Column(Float)
+    consumption_max = Column(Float)
+    reading_count = Column(Integer, nullable=False, default=0)
+
+class EnergyConsumptionFiveMinute(RollupMixin, Base):
+    __tablename__ = "energy_consumption_5min"
+    __table_args__ = (
+        Index("idx_energy_5min_device_bucket", "device_name", "bucket"),
+    )
+
+class EnergyConsumptionHourly(RollupMixin, Base):
+    __tablename__ = "energy_consumption_hourly"
+    __table_args__ = (
+        Index("idx_energy_hourly_device_bucket", "device_name", "bucket"),
+    )
+
+class EnergyConsumptionDaily(RollupMixin, Base):
+    __tablename__ = "energy_consumption_daily"
+    __table_args__ = (
+        Index("idx_energy_daily_device_bucket", "device_name", "bucket"),
+    )
+
 # Pydantic schemas
 class EnergyConsumptionSchema(BaseModel):
     device_name: str
@@ -36,4 +73,17 @@ class EnergyDeviceSchema(BaseModel):
     status: str
 
     class Config:
-        from_attributes = True
\ No newline at end of file
+        from_attributes = True
+
+class FlexibleLoadSchema(BaseModel):
+    device_name: str
+    duration_hours: int
+    energy_kwh: Optional[float] = None  # Energy of one run, default: the run found in the forecast
+    allowed_hours: List[int] = [0, 24]  # Local [start, end) hours, wraps past midnight
+    finish_by: Optional[int] = None  # Hours from now
+    interruptible: bool = False
+
+class LoadShiftRequestSchema(BaseModel):
+    loads: Optional[List[FlexibleLoadSchema]] = None  # Default: the built-in flexible devices
+    peak_cap_kw: Optional[float] = None  # Default: LOAD_SHIFT_PEAK_CAP_KW
+    hours: int = 24
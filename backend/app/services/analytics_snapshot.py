@@ -0,0 +1,195 @@
+"""
+Analytics Snapshot
+
+The efficiency score, efficiency insights, peak-hours analysis and
+recommendations all look at the same window of hourly rollups, grouped
+by device or by hour of day. A snapshot reads that window once into
+device x day x hour-of-day matrices and each consumer slices it with
+NumPy, so loading the analytics page scans the rollups once instead of
+once per endpoint.
+
+Snapshots are cached per window length for ANALYTICS_SNAPSHOT_TTL
+seconds and expired ones are dropped on the next build. Concurrent
+requests for the same window wait for one build, coordinated on the
+event loop rather than inside the database session.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import asyncio
+import logging
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import settings
+from services.tariff_service import tariffs
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class AnalyticsSnapshot:
+    """Hourly rollups of a window as (device, day, hour of day) matrices"""
+    start_time: datetime  # Window start, aligned down to the hour
+    devices: List[str]
+    days: List[datetime]
+    total: np.ndarray  # Consumption sum per cell
+    readings: np.ndarray  # Reading count per cell
+    peak: np.ndarray  # Largest reading per cell, -inf where empty
+    cost: np.ndarray  # Consumption cost per cell at time-of-use rates (tiers are billed monthly)
+    built_at: float = field(default_factory=time.monotonic)
+
+    def total_consumption(self) -> float:
+        return float(self.total.sum())
+
+    def device_totals(self) -> List[Dict]:
+        """Per-device totals, largest consumer first (as RollupService.device_totals)"""
+        totals = self.total.sum(axis=(1, 2))
+        readings = self.readings.sum(axis=(1, 2))
+        costs = self.cost.sum(axis=(1, 2))
+        peaks = self.peak.max(axis=(1, 2)) if self.devices else np.empty(0)
+        return [
+            {
+                "device_name": self.devices[index],
+                "total": float(totals[index]),
+                "readings": int(readings[index]),
+                "average": float(totals[index]) / int(readings[index]) if readings[index] else 0.0,
+                "peak": float(peaks[index]) if np.isfinite(peaks[index]) else 0.0,
+                "cost": float(costs[index]),
+            }
+            for index in np.argsort(-totals, kind='stable')
+        ]
+
+    def hour_of_day(self) -> Dict[int, Dict]:
+        """Consumption by hour of day for hours with data (as RollupService.hour_of_day)"""
+        totals = self.total.sum(axis=(0, 1))
+        readings = self.readings.sum(axis=(0, 1))
+        costs = self.cost.sum(axis=(0, 1))
+        return {
+            hour: {
+                "total": float(totals[hour]),
+                "readings": int(readings[hour]),
+                "average": float(totals[hour]) / int(readings[hour]),
+                "cost": float(costs[hour]),
+            }
+            for hour in range(24) if readings[hour]
+        }
+
+
+def build_snapshot(db: Session, days: int, now: Optional[datetime] = None) -> AnalyticsSnapshot:
+    """
+    Read the hourly rollups since `days` days ago in one query
+
+    Args:
+        db: Database session
+        days: Window length in days
+        now: Window end (default: now)
+    """
+    start_time = ((now or datetime.now()) - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    rows = db.execute(text("""
+        SELECT device_name, bucket, consumption_sum, reading_count, consumption_max
+        FROM energy_consumption_hourly
+        WHERE bucket >= :start_time
+    """), {"start_time": start_time}).fetchall()
+
+    first_day = np.datetime64(start_time.date(), 'D')
+    if rows:
+        names, buckets, sums, counts, peaks = zip(*rows)
+        devices, device_index = np.unique(np.array(names, dtype=object).astype(str), return_inverse=True)
+        buckets = np.array(buckets, dtype='datetime64[h]')
+        day_index = (buckets.astype('datetime64[D]') - first_day).astype(int)
+        hour_index = (buckets - buckets.astype('datetime64[D]')).astype(int)
+        n_days = int(day_index.max()) + 1
+    else:
+        devices, n_days = np.array([], dtype=str), days + 1
+
+    shape = (len(devices), n_days, 24)
+    total = np.zeros(shape)
+    readings = np.zeros(shape, dtype=np.int64)
+    peak = np.full(shape, -np.inf)
+    if rows:
+        # One rollup row per (device, hour), so plain assignment fills every cell
+        cells = (device_index, day_index, hour_index)
+        total[cells] = np.array(sums, dtype=float)
+        readings[cells] = np.array(counts, dtype=np.int64)
+        peak[cells] = np.array([-np.inf if value is None else value for value in peaks], dtype=float)
+
+    day_starts = [datetime.combine(start_time.date() + timedelta(days=offset), datetime.min.time())
+                  for offset in range(n_days)]
+    # One rate per (day, hour) cell, shared by every device
+    hours = np.array(day_starts, dtype='datetime64[h]')[:, None] + np.arange(24)
+    cost = total * tariffs.rates(hours)[None, :, :]
+    return AnalyticsSnapshot(start_time, [str(name) for name in devices], day_starts, total, readings, peak, cost)
+
+
+class SnapshotCache:
+    """TTL cache of snapshots keyed by window length"""
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._snapshots: Dict[int, AnalyticsSnapshot] = {}
+        self._lock = threading.Lock()  # Guards the dict and counters only, never held across a query
+        self._build_locks: Dict[int, asyncio.Lock] = {}
+        self.builds = 0
+        self.hits = 0
+
+    def _fresh(self, days: int) -> Optional[AnalyticsSnapshot]:
+        with self._lock:
+            snapshot = self._snapshots.get(days)
+            if snapshot is not None and time.monotonic() - snapshot.built_at < self.ttl:
+                self.hits += 1
+                return snapshot
+        return None
+
+    def _store(self, days: int, snapshot: AnalyticsSnapshot) -> AnalyticsSnapshot:
+        with self._lock:
+            # Expired windows are dropped with their idle build locks, so memory
+            # holds only the windows requested within the last TTL
+            now = time.monotonic()
+            for expired in [key for key, old in self._snapshots.items() if now - old.built_at >= self.ttl]:
+                del self._snapshots[expired]
+                build_lock = self._build_locks.get(expired)
+                if build_lock is not None and not build_lock.locked():
+                    del self._build_locks[expired]
+            self._snapshots[days] = snapshot
+            self.builds += 1
+        logger.debug(f"Built {days}-day analytics snapshot: {snapshot.total.shape}")
+        return snapshot
+
+    def get(self, db: Session, days: int) -> AnalyticsSnapshot:
+        """
+        Cached snapshot of the last `days` days, built on a miss
+
+        Concurrent misses each build; async endpoints use aget, which
+        builds once. No lock is held while building: inside
+        AsyncSession.run_sync the query yields to the event loop, and a
+        thread lock held across it would block every other request.
+        """
+        return self._fresh(days) or self._store(days, build_snapshot(db, days))
+
+    async def aget(self, db: AsyncSession, days: int) -> AnalyticsSnapshot:
+        """Cached snapshot of the last `days` days; concurrent requests wait for one build"""
+        snapshot = self._fresh(days)
+        if snapshot is not None:
+            return snapshot
+
+        build_lock = self._build_locks.setdefault(days, asyncio.Lock())
+        async with build_lock:
+            # Another request may have built it while this one waited
+            snapshot = self._fresh(days)
+            if snapshot is not None:
+                return snapshot
+            snapshot = await db.run_sync(lambda session: build_snapshot(session, days))
+            return self._store(days, snapshot)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"snapshots": len(self._snapshots), "builds": self.builds, "hits": self.hits}
+
+
+analytics_snapshots = SnapshotCache(settings.ANALYTICS_SNAPSHOT_TTL)
@@ -0,0 +1,217 @@
+"""
+Response Cache
+
+In-process cache for the analytics endpoints the dashboard polls. Entries
+are keyed by route and query parameters, expire after a per-endpoint TTL
+and are evicted least-recently-used once the cache is full.
+
+Every entry carries tags ("readings", "devices", "ml"); writers invalidate
+a tag when the underlying data changes. Readings arrive every few seconds,
+so their writers only drop entries computed more than
+READINGS_CACHE_MAX_STALENESS seconds ago: under a steady stream of
+readings each key is still computed at most once per staleness interval
+for all polling dashboards. Concurrent requests for the same key while it
+is being computed wait for that one computation instead of starting their
+own.
+"""
+import asyncio
+import functools
+import inspect
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+# Tags used by the routes and the writers that invalidate them
+READINGS = "readings"
+DEVICES = "devices"
+ML = "ml"
+
+
+class ResponseCache:
+    """Thread-safe TTL + LRU cache with tag invalidation and request coalescing"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        # key -> (expires_at, tags, value, computed_at), times from time.monotonic()
+        self._entries: "OrderedDict[Tuple, Tuple[float, Tuple[str, ...], Any, float]]" = OrderedDict()
+        # Bumped on every invalidation so results computed from stale data
+        # are not stored
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        # Only touched from the event loop
+        self._inflight: Dict[Tuple, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key: Tuple) -> Tuple[bool, Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False, None
+            expires_at, _, value, _ = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return False, None
+            self._entries.move_to_end(key)
+            return True, value
+
+    def set(self, key: Tuple, value: Any, ttl: float, tags: Iterable[str], generations: Optional[Tuple[int, ...]] = None,
+            computed_at: Optional[float] = None):
+        tags = tuple(tags)
+        with self._lock:
+            if generations is not None and generations != self._tag_generations(tags):
+                return
+            now = time.monotonic()
+            self._entries[key] = (now + ttl, tags, value, now if computed_at is None else computed_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, *tags: str, max_staleness: float = 0.0):
+        """
+        Drop entries carrying one of the tags (safe from any thread)
+
+        Args:
+            tags: Tags whose entries are dropped
+            max_staleness: Keep entries computed within this many seconds;
+                results being computed are then still stored
+        """
+        with self._lock:
+            if max_staleness <= 0:
+                for tag in tags:
+                    self._generations[tag] = self._generations.get(tag, 0) + 1
+            cutoff = time.monotonic() - max_staleness
+            stale = [key for key, (_, entry_tags, _, computed_at) in self._entries.items()
+                     if any(tag in entry_tags for tag in tags) and (max_staleness <= 0 or computed_at < cutoff)]
+            for key in stale:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _tag_generations(self, tags: Tuple[str, ...]) -> Tuple[int, ...]:
+        return tuple(self._generations.get(tag, 0) for tag in tags)
+
+    async def get_or_compute(self, key: Tuple, compute: Callable, ttl: float, tags: Iterable[str]):
+        """
+        Return the cached value for key, computing it at most once at a time
+
+        Args:
+            key: Cache key
+            compute: Coroutine function producing the value
+            ttl: Seconds the value stays valid
+            tags: Invalidation tags of the entry
+        """
+        found, value = self.get(key)
+        if found:
+            self.hits += 1
+            return value
+
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise
+                # The computing request was cancelled, not this one
+                return await self.get_or_compute(key, compute, ttl, tags)
+
+        self.misses += 1
+        tags = tuple(tags)
+        with self._lock:
+            generations = self._tag_generations(tags)
+        started = time.monotonic()
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Mark retrieved so an exception nobody waited for is not logged
+            future.exception()
+            raise
+        else:
+            self.set(key, value, ttl, tags, generations, computed_at=started)
+            future.set_result(value)
+            return value
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            entries = len(self._entries)
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight)
+        }
+
+
+response_cache = ResponseCache(settings.RESPONSE_CACHE_MAX_ENTRIES)
+
+
+def invalidate_readings():
+    """Called by reading writers; see READINGS_CACHE_MAX_STALENESS"""
+    response_cache.invalidate(READINGS, max_staleness=settings.READINGS_CACHE_MAX_STALENESS)
+
+
+def cached(ttl: float, tags: Iterable[str] = (READINGS,)):
+    """
+    Cache a route's response in response_cache
+
+    Works for async and plain def routes (the latter still run in the
+    threadpool). Database sessions are left out of the cache key, every
+    other argument (path and query parameters) is part of it.
+
+    Args:
+        ttl: Seconds a response stays valid
+        tags: Tags whose invalidation drops the response
+    """
+    tags = tuple(tags)
+
+    def decorator(func: Callable):
+        is_async = inspect.iscoroutinefunction(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not settings.RESPONSE_CACHE_ENABLED:
+                return await _call(func, is_async, args, kwargs)
+
+            key = (func.__module__, func.__qualname__) + tuple(
+                (name, repr(value)) for name, value in sorted(kwargs.items())
+                if not isinstance(value, (Session, AsyncSession))
+            )
+            return await response_cache.get_or_compute(
+                key, lambda: _call(func, is_async, args, kwargs), ttl, tags
+            )
+
+        return wrapper
+
+    return decorator
+
+
+async def _call(func: Callable, is_async: bool, args, kwargs):
+    if is_async:
+        return await func(*args, **kwargs)
+    return await run_in_threadpool(func, *args, **kwargs)
@@ -4,11 +4,11 @@ Calculates efficiency scores and provides recommendations
 """
 from datetime import datetime, timedelta
 from sqlalchemy.orm import Session
-from sqlalchemy import func
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 import logging
 
-from models.energy import EnergyConsumption
+from services.analytics_snapshot import AnalyticsSnapshot, analytics_snapshots
+from services.rollup_service import RollupService
 
 logger = logging.getLogger(__name__)
 
@@ -35,27 +35,21 @@ class EfficiencyService:
     def __init__(self, db: Session):
         self.db = db
     
-    def calculate_efficiency_score(self, days: int = 7) -> Dict:
+    def calculate_efficiency_score(self, days: int = 7, snapshot: Optional[AnalyticsSnapshot] = None) -> Dict:
         """
         Calculate energy efficiency score based on consumption patterns
         
         Args:
             days: Number of days to analyze (default 7)
+            snapshot: Analytics snapshot of the last `days` days (default: from the shared cache)
         
         Returns:
             Dictionary with score, grade, comparison, tips, and historical data
         """
         try:
-            # Get consumption data for the period
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=days)
-            
-            total_consumption = self.db.query(
-                func.sum(EnergyConsumption.consumption)
-            ).filter(
-                EnergyConsumption.timestamp >= start_date,
-                EnergyConsumption.timestamp <= end_date
-            ).scalar() or 0.0
+            # Get consumption data for the period (shared with the other analytics)
+            snapshot = snapshot or analytics_snapshots.get(self.db, days)
+            total_consumption = snapshot.total_consumption()
             
             # Get average daily consumption
             avg_daily = total_consumption / days if days > 0 else 0
@@ -90,8 +84,8 @@ class EfficiencyService:
             # Generate tips based on score
             tips = self._generate_tips(score, grade, avg_daily, benchmark)
             
-            # Get historical scores (last 7 days)
-            historical_scores = self._get_historical_scores(7)
+            # Get historical scores (last 7 days) and today's so far
+            historical_scores, today_score = self._get_historical_scores(7)
             
             return {
                 "score": round(score, 1),
@@ -102,6 +96,7 @@ class EfficiencyService:
                 "percentage_difference": round(percentage_diff, 1),
                 "tips": tips,
                 "historical_scores": historical_scores,
+                "today": today_score,
                 "period_days": days
             }
             
@@ -156,46 +151,61 @@ class EfficiencyService:
         
         return tips
     
-    def _get_historical_scores(self, days: int) -> List[Dict]:
-        """Get historical efficiency scores for trend analysis"""
+    def _get_historical_scores(self, days: int) -> Tuple[List[Dict], Optional[Dict]]:
+        """
+        Get historical efficiency scores for trend analysis
+        
+        All days come from one query on the daily rollups (closed days are
+        memoised, so usually only today's running total is read).
+        
+        Returns:
+            (scores of the last `days` closed days, score of today so far)
+        """
         historical = []
+        today = None
         
         try:
-            for i in range(days, 0, -1):
-                date = datetime.now() - timedelta(days=i)
-                day_start = date.replace(hour=0, minute=0, second=0, microsecond=0)
-                day_end = day_start + timedelta(days=1)
-                
-                daily_consumption = self.db.query(
-                    func.sum(EnergyConsumption.consumption)
-                ).filter(
-                    EnergyConsumption.timestamp >= day_start,
-                    EnergyConsumption.timestamp < day_end
-                ).scalar() or 0.0
-                
-                benchmark = AVERAGE_HOUSEHOLD_CONSUMPTION['24h']
-                percentage_diff = ((daily_consumption - benchmark) / benchmark) * 100 if benchmark > 0 else 0
-                score = max(0, min(100, 100 - max(0, percentage_diff)))
-                
-                historical.append({
-                    "date": day_start.strftime('%Y-%m-%d'),
-                    "score": round(score, 1),
-                    "consumption": round(daily_consumption, 2)
-                })
+            totals = RollupService(self.db).daily_totals(days)
+            benchmark = AVERAGE_HOUSEHOLD_CONSUMPTION['24h']
+            
+            for day_start, daily_consumption in totals[:-1]:
+                historical.append(self._day_score(day_start, daily_consumption, benchmark))
+            
+            # Today is compared with the share of the daily benchmark elapsed so far
+            day_start, daily_consumption = totals[-1]
+            elapsed = (datetime.utcnow() - day_start) / timedelta(days=1)
+            today = self._day_score(day_start, daily_consumption, benchmark * max(elapsed, 1 / 24))
+            today["partial"] = True
         
         except Exception as e:
             logger.error(f"Error getting historical scores: {e}")
         
-        return historical
+        return historical, today
+    
+    def _day_score(self, day_start: datetime, daily_consumption: float, benchmark: float) -> Dict:
+        percentage_diff = ((daily_consumption - benchmark) / benchmark) * 100 if benchmark > 0 else 0
+        score = max(0, min(100, 100 - max(0, percentage_diff)))
+        return {
+            "date": day_start.strftime('%Y-%m-%d'),
+            "score": round(score, 1),
+            "consumption": round(daily_consumption, 2)
+        }
     
-    def get_efficiency_insights(self) -> Dict:
-        """Get additional efficiency insights"""
+    def get_efficiency_insights(self, snapshot: Optional[AnalyticsSnapshot] = None) -> Dict:
+        """
+        Get additional efficiency insights
+        
+        Args:
+            snapshot: Analytics snapshot of the last 7 days (default: from the shared cache)
+        """
         try:
+            snapshot = snapshot or analytics_snapshots.get(self.db, 7)
+            
             # Get device-level efficiency
-            device_efficiency = self._analyze_device_efficiency()
+            device_efficiency = self._analyze_device_efficiency(snapshot)
             
             # Get time-based efficiency
-            time_efficiency = self._analyze_time_efficiency()
+            time_efficiency = self._analyze_time_efficiency(snapshot)
             
             return {
                 "device_efficiency": device_efficiency,
@@ -206,30 +216,18 @@ class EfficiencyService:
             logger.error(f"Error getting efficiency insights: {e}")
             return {}
     
-    def _analyze_device_efficiency(self) -> List[Dict]:
+    def _analyze_device_efficiency(self, snapshot: AnalyticsSnapshot) -> List[Dict]:
         """Analyze efficiency per device"""
         try:
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=7)
-            
-            device_data = self.db.query(
-                EnergyConsumption.device_name,
-                func.sum(EnergyConsumption.consumption).label('total'),
-                func.avg(EnergyConsumption.consumption).label('average'),
-                func.count(EnergyConsumption.id).label('count')
-            ).filter(
-                EnergyConsumption.timestamp >= start_date
-            ).group_by(
-                EnergyConsumption.device_name
-            ).all()
+            device_data = snapshot.device_totals()
             
             result = []
             for device in device_data:
                 result.append({
-                    "device": device.device_name,
-                    "total_consumption": round(device.total, 2),
-                    "average_consumption": round(device.average, 2),
-                    "reading_count": device.count
+                    "device": device["device_name"],
+                    "total_consumption": round(device["total"], 2),
+                    "average_consumption": round(device["average"], 2),
+                    "reading_count": device["readings"]
                 })
             
             return result
@@ -238,23 +236,13 @@ class EfficiencyService:
             logger.error(f"Error analyzing device efficiency: {e}")
             return []
     
-    def _analyze_time_efficiency(self) -> Dict:
+    def _analyze_time_efficiency(self, snapshot: AnalyticsSnapshot) -> Dict:
         """Analyze consumption by time of day"""
         try:
-            end_date = datetime.now()
-            start_date = end_date - timedelta(days=7)
-            
-            # Get hourly consumption
-            hourly_data = self.db.query(
-                func.extract('hour', EnergyConsumption.timestamp).label('hour'),
-                func.avg(EnergyConsumption.consumption).label('avg_consumption')
-            ).filter(
-                EnergyConsumption.timestamp >= start_date
-            ).group_by(
-                func.extract('hour', EnergyConsumption.timestamp)
-            ).order_by('hour').all()
+            # Get hourly consumption from the shared 7-day snapshot
+            hourly_data = snapshot.hour_of_day()
             
-            hourly_avg = {int(row.hour): round(row.avg_consumption, 2) for row in hourly_data}
+            hourly_avg = {hour: round(row["average"], 2) for hour, row in hourly_data.items()}
             
             # Identify peak and off-peak hours
             if hourly_avg:
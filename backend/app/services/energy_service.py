@@ -1,32 +1,217 @@
 from sqlalchemy.orm import Session
-from sqlalchemy import text
+from sqlalchemy import text, insert
 from models.energy import EnergyConsumption, EnergyDevice, EnergyConsumptionSchema
-from typing import List
+from services.rollup_service import RollupService, naive_utc
+from services.cache_service import invalidate_readings
+from services.load_shifting import DEFAULT_FLEXIBLE_LOADS, FlexibleLoad, LoadRequest, schedule_loads
+from datetime import datetime
+from numpy.lib.stride_tricks import sliding_window_view
+from typing import Dict, Iterator, List, Optional, Tuple
+import numpy as np
+import pandas as pd
+
+def _reading_dict(row) -> Dict:
+    return {
+        "id": row[0],
+        "device_name": row[1],
+        "consumption": row[2],
+        "timestamp": row[3].isoformat() if row[3] else None
+    }
 
 class EnergyService:
+    """
+    Energy data access on a synchronous Session
+
+    Async routes call these methods through AsyncSession.run_sync, so the
+    queries run on the async engine without blocking the event loop.
+    """
+
     def __init__(self, db: Session):
         self.db = db
 
-    async def record_consumption(self, consumption: EnergyConsumptionSchema):
+    def record_consumption(self, consumption: EnergyConsumptionSchema):
         db_consumption = EnergyConsumption(
             device_name=consumption.device_name,
             consumption=consumption.consumption,
-            timestamp=consumption.timestamp
+            timestamp=naive_utc(consumption.timestamp) or datetime.utcnow()
         )
         self.db.add(db_consumption)
+        RollupService(self.db).apply([{
+            "device_name": db_consumption.device_name,
+            "consumption": db_consumption.consumption,
+            "timestamp": db_consumption.timestamp
+        }])
         self.db.commit()
+        invalidate_readings()
         self.db.refresh(db_consumption)
         return db_consumption
 
-    async def get_consumption(self, device_name: str):
+    def record_consumptions(self, readings: List[EnergyConsumptionSchema]) -> Dict:
+        """
+        Record a batch of readings in a single transaction
+
+        Device status is resolved with one lookup for every device in the
+        batch, and all readings of devices that are ON are written with one
+        multi-row INSERT together with their rollup updates.
+
+        Args:
+            readings: Readings to record
+
+        Returns:
+            Summary counts and a per-row outcome
+            (recorded / device_off / unknown_device)
+        """
+        device_names = list({reading.device_name for reading in readings})
+        statuses = {}
+        if device_names:
+            result = self.db.execute(
+                text("SELECT name, status FROM devices WHERE name = ANY(:names)"),
+                {"names": device_names}
+            )
+            statuses = {row[0]: row[1] for row in result}
+
+        rows = []
+        results = []
+        counts = {"recorded": 0, "device_off": 0, "unknown_device": 0}
+        now = datetime.utcnow()
+
+        for index, reading in enumerate(readings):
+            device_status = statuses.get(reading.device_name)
+            if device_status is None:
+                outcome = "unknown_device"
+            elif device_status != "on":
+                outcome = "device_off"
+            else:
+                outcome = "recorded"
+                rows.append({
+                    "device_name": reading.device_name,
+                    "consumption": reading.consumption,
+                    "timestamp": naive_utc(reading.timestamp) or now
+                })
+            counts[outcome] += 1
+            results.append({
+                "index": index,
+                "device_name": reading.device_name,
+                "status": outcome
+            })
+
+        if rows:
+            self.db.execute(insert(EnergyConsumption.__table__), rows)
+            RollupService(self.db).apply(rows)
+            self.db.commit()
+            invalidate_readings()
+
+        return {
+            "received": len(readings),
+            **counts,
+            "results": results
+        }
+
+    def get_consumption(self, device_name: str):
+        """Latest reading of a device (a backward scan of idx_energy_device_timestamp)"""
         return self.db.query(EnergyConsumption).filter(
             EnergyConsumption.device_name == device_name
-        ).first()
+        ).order_by(EnergyConsumption.timestamp.desc()).first()
+
+    @staticmethod
+    def _consumption_filters(
+        device_name: Optional[str],
+        start_time: Optional[datetime],
+        end_time: Optional[datetime]
+    ) -> Tuple[List[str], Dict]:
+        conditions, params = [], {}
+        if device_name:
+            conditions.append("device_name = :device_name")
+            params["device_name"] = device_name
+        if start_time:
+            conditions.append("timestamp >= :start_time")
+            params["start_time"] = naive_utc(start_time)
+        if end_time:
+            conditions.append("timestamp < :end_time")
+            params["end_time"] = naive_utc(end_time)
+        return conditions, params
+
+    def page_consumptions(
+        self,
+        device_name: Optional[str] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        after_ts: Optional[datetime] = None,
+        after_id: Optional[int] = None,
+        limit: int = 100,
+        descending: bool = True
+    ) -> List[Dict]:
+        """
+        One page of raw readings ordered by (timestamp, id)
+
+        Keyset pagination: pass the timestamp and id of the last row of the
+        previous page as after_ts / after_id to get the next one. Each page
+        is an index range scan, however deep into the table it starts.
+
+        Args:
+            device_name: Only this device
+            start_time: Only readings at or after this time
+            end_time: Only readings before this time
+            after_ts: Timestamp of the last row already seen
+            after_id: Id of the last row already seen (tie-breaker for after_ts)
+            limit: Page size
+            descending: Newest first (default) or oldest first
 
-    async def list_consumptions(self) -> List[EnergyConsumption]:
-        return self.db.query(EnergyConsumption).all()
+        Returns:
+            List of reading dicts
+        """
+        conditions, params = self._consumption_filters(device_name, start_time, end_time)
+        direction = "DESC" if descending else "ASC"
+        if after_ts is not None:
+            comparison = "<" if descending else ">"
+            if after_id is not None:
+                conditions.append(f"(timestamp, id) {comparison} (:after_ts, :after_id)")
+                params["after_id"] = after_id
+            else:
+                conditions.append(f"timestamp {comparison} :after_ts")
+            params["after_ts"] = naive_utc(after_ts)
+        params["limit"] = limit
 
-    async def get_devices(self):
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        result = self.db.execute(text(f"""
+            SELECT id, device_name, consumption, timestamp
+            FROM energy_consumption
+            {where}
+            ORDER BY timestamp {direction}, id {direction}
+            LIMIT :limit
+        """), params)
+        return [_reading_dict(row) for row in result]
+
+    def iter_consumptions(
+        self,
+        device_name: Optional[str] = None,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        batch_size: int = 1000
+    ) -> Iterator[Dict]:
+        """
+        Stream raw readings oldest first through a server-side cursor
+
+        Only batch_size rows are held in memory at a time, so exports of any
+        size run in constant memory. The session must stay open while the
+        iterator is consumed.
+        """
+        conditions, params = self._consumption_filters(device_name, start_time, end_time)
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+        result = self.db.execute(
+            text(f"""
+                SELECT id, device_name, consumption, timestamp
+                FROM energy_consumption
+                {where}
+                ORDER BY timestamp ASC, id ASC
+            """),
+            params,
+            execution_options={"stream_results": True, "yield_per": batch_size}
+        )
+        for row in result:
+            yield _reading_dict(row)
+
+    def get_devices(self):
         """Get all devices from database"""
         query = text("SELECT id, name, type, status, last_updated FROM devices ORDER BY id")
         result = self.db.execute(query)
@@ -41,6 +226,104 @@ class EnergyService:
             })
         return devices
 
-    def optimize_energy_usage(self):
-        # Placeholder for optimization logic
-        pass
\ No newline at end of file
+    def optimize_energy_usage(
+        self,
+        loads: Optional[List[FlexibleLoad]] = None,
+        peak_cap_kw: Optional[float] = None,
+        hours: int = 24
+    ) -> Dict:
+        """
+        Plan when flexible devices should run over the next hours
+
+        A flexible device's unmanaged run is the heaviest window of its
+        run length in the ML forecast; the rest of the forecast is base
+        load. Runs are moved to the cheapest tariff hours that satisfy the
+        device constraints and the household peak cap.
+
+        Args:
+            loads: Flexible devices and their constraints (default: DEFAULT_FLEXIBLE_LOADS)
+            peak_cap_kw: Household cap on hourly load (default: LOAD_SHIFT_PEAK_CAP_KW, 0 = none)
+            hours: Planning horizon in hours
+
+        Returns:
+            Run hours and savings per device, hourly prices and load before/after
+        """
+        from config import settings
+        from services.ml_service import MLService
+        from services.tariff_service import tariffs
+
+        loads = DEFAULT_FLEXIBLE_LOADS if loads is None else loads
+        peak_cap = settings.LOAD_SHIFT_PEAK_CAP_KW if peak_cap_kw is None else peak_cap_kw
+
+        forecast = MLService(self.db).predict_all_devices(hours)["devices"]
+        if not forecast:
+            return {"success": False, "error": "No device forecasts available, train the models first"}
+
+        names = list(forecast)
+        times = pd.to_datetime([entry["timestamp"] for entry in forecast[names[0]]["hourly_predictions"]]).values
+        kwh = np.array([[entry["predicted_consumption"] for entry in forecast[name]["hourly_predictions"]]
+                        for name in names])
+        base_load = kwh.sum(axis=0)
+
+        requests, skipped = [], []
+        for load in loads:
+            duration = int(load.duration_hours)
+            if not 0 < duration <= len(times):
+                skipped.append({"device_name": load.device_name, "reason": "run longer than the horizon"})
+                continue
+            row = kwh[names.index(load.device_name)] if load.device_name in forecast else np.zeros(len(times))
+            start = int(np.argmax(sliding_window_view(row, duration).sum(axis=1)))
+            baseline = np.arange(start, start + duration)
+            if load.energy_kwh is not None:
+                profile = np.full(duration, load.energy_kwh / duration)
+            else:
+                profile = row[baseline].copy()
+            if profile.sum() <= 0:
+                skipped.append({"device_name": load.device_name, "reason": "no run in the forecast"})
+                continue
+            base_load[baseline] -= row[baseline]
+            requests.append(LoadRequest(load, profile, baseline))
+
+        plan = schedule_loads(base_load, tariffs.rates(times), requests, tariffs.local_hours(times), peak_cap)
+
+        def at(slot) -> str:
+            return pd.Timestamp(times[slot]).isoformat()
+
+        return {
+            "success": True,
+            "horizon_hours": len(times),
+            "tariff": tariffs.name,
+            "peak_cap_kw": peak_cap,
+            "schedule": [
+                {
+                    "device_name": scheduled.device_name,
+                    "start": at(scheduled.slots[0]),
+                    "hours": [at(slot) for slot in scheduled.slots],
+                    "baseline_start": at(scheduled.baseline_slots[0]),
+                    "energy_kwh": round(scheduled.energy_kwh, 4),
+                    "cost": round(scheduled.cost, 2),
+                    "baseline_cost": round(scheduled.baseline_cost, 2),
+                    "savings": round(scheduled.baseline_cost - scheduled.cost, 2),
+                    "within_peak_cap": scheduled.within_cap
+                }
+                for scheduled in plan.loads
+            ],
+            "unscheduled": skipped + [
+                {"device_name": device_name, "reason": reason} for device_name, reason in plan.unscheduled
+            ],
+            "baseline_cost": round(plan.baseline_cost, 2),
+            "optimized_cost": round(plan.cost, 2),
+            "savings": round(plan.savings, 2),
+            "baseline_peak_kw": round(float(plan.baseline_load.max()), 3),
+            "optimized_peak_kw": round(float(plan.load.max()), 3),
+            "hourly": [
+                {
+                    "timestamp": at(slot),
+                    "price": round(float(plan.prices[slot]), 4),
+                    "baseline_kwh": round(float(plan.baseline_load[slot]), 4),
+                    "optimized_kwh": round(float(plan.load[slot]), 4)
+                }
+                for slot in range(len(times))
+            ],
+            "timestamp": datetime.now().isoformat()
+        }
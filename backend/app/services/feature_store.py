@@ -0,0 +1,327 @@
+"""
+Feature Store
+
+Persists the hourly feature matrix of every device so training, prediction
+and model inspection read prepared features instead of recomputing the
+lag and rolling columns from the raw series each time.
+
+Each device has a directory per frequency holding row-major binary files
+(X.f64: features, y.f64: consumption, ts.i64: epoch seconds) that are
+opened memory-mapped, and a manifest.json with the row count and window
+end. Syncing recomputes the last REFRESH_HOURS stored hours, so readings
+that arrive late (batch ingest, buffered MQTT) reach the features, and the
+hours after the window end, using the stored hours before them as lag /
+rolling context. Older late readings need invalidate(). The manifest is
+replaced atomically after the data files are written, so a crash between
+the two leaves extra bytes that the next sync truncates. Compaction swaps
+in rewritten files; files shorter than the manifest (a compaction cut
+short) make the device rebuild.
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from urllib.parse import quote
+import json
+import logging
+import os
+import shutil
+import threading
+
+import numpy as np
+import pandas as pd
+
+from config import settings
+from services.forecasting import FEATURE_COLUMNS
+
+logger = logging.getLogger(__name__)
+
+FREQUENCY = "1h"
+# Stored hours re-read as context when appending (prepare_features needs 50 rows)
+CONTEXT_ROWS = 50
+# Trailing stored hours recomputed on every sync to pick up late readings
+REFRESH_HOURS = 48
+
+_DAYS_SINCE_START = FEATURE_COLUMNS.index('days_since_start')
+_SECONDS_PER_DAY = 24 * 3600
+# Data files and their row widths in bytes
+_FILES = (("X.f64", 8 * len(FEATURE_COLUMNS)), ("y.f64", 8), ("ts.i64", 8))
+
+
+@dataclass
+class FeatureWindow:
+    """Feature rows of one device in a time window"""
+    timestamps: pd.DatetimeIndex
+    X: np.ndarray
+    y: np.ndarray
+
+    def frame(self) -> pd.DataFrame:
+        """The underlying hourly series as timestamp / consumption"""
+        return pd.DataFrame({'timestamp': self.timestamps, 'consumption': self.y})
+
+
+class FeatureStore:
+    """Append-only, memory-mapped hourly feature matrices per device"""
+
+    def __init__(self, root: str, retention_days: int):
+        self.root = root
+        self.retention_days = retention_days
+        self._locks: Dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _dir(self, device_name: str) -> str:
+        return os.path.join(self.root, quote(device_name, safe=''), FREQUENCY)
+
+    def _lock(self, device_name: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(device_name, threading.Lock())
+
+    def manifest(self, device_name: str) -> Optional[Dict]:
+        try:
+            with open(os.path.join(self._dir(device_name), "manifest.json")) as f:
+                manifest = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+        if manifest.get("columns") != list(FEATURE_COLUMNS):
+            return None  # Written for another feature set, rebuild
+        if not self._complete(self._dir(device_name), manifest["rows"]):
+            logger.warning(f"Feature store of {device_name} is shorter than its manifest, rebuilding")
+            return None
+        return manifest
+
+    def _arrays(self, device_name: str, manifest: Dict):
+        directory, rows = self._dir(device_name), manifest["rows"]
+        X = np.memmap(os.path.join(directory, "X.f64"), dtype=np.float64, mode='r',
+                      shape=(rows, len(FEATURE_COLUMNS)))
+        y = np.memmap(os.path.join(directory, "y.f64"), dtype=np.float64, mode='r', shape=(rows,))
+        ts = np.memmap(os.path.join(directory, "ts.i64"), dtype=np.int64, mode='r', shape=(rows,))
+        return ts, X, y
+
+    def window(
+        self,
+        device_name: str,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        origin: Optional[datetime] = None
+    ) -> Optional[FeatureWindow]:
+        """
+        Stored feature rows with start_time <= timestamp < end_time
+
+        Args:
+            device_name: Name of the device
+            start_time: Window start (default: first stored hour)
+            end_time: Exclusive window end (default: after the last stored hour)
+            origin: Time days_since_start is measured from (default: the
+                first hour of the window, as prepare_features does)
+
+        Returns:
+            FeatureWindow, or None if the device has no stored features
+        """
+        # Held while reading so a concurrent compaction cannot shrink the files
+        with self._lock(device_name):
+            manifest = self.manifest(device_name)
+            if manifest is None or manifest["rows"] == 0:
+                return None
+
+            ts, X, y = self._arrays(device_name, manifest)
+            lo = int(np.searchsorted(ts, _epoch(start_time))) if start_time is not None else 0
+            hi = int(np.searchsorted(ts, _epoch(end_time))) if end_time is not None else len(ts)
+            if hi <= lo:
+                return FeatureWindow(pd.DatetimeIndex([]), np.empty((0, len(FEATURE_COLUMNS))), np.empty(0))
+
+            # Copy out of the map; only days_since_start depends on the window
+            features = np.array(X[lo:hi])
+            values = np.array(y[lo:hi])
+            first = int(ts[lo])
+            timestamps = pd.to_datetime(np.asarray(ts[lo:hi]), unit='s')
+
+        origin_seconds = _epoch(origin) if origin is not None else first
+        features[:, _DAYS_SINCE_START] += (manifest["origin"] - origin_seconds) / _SECONDS_PER_DAY
+        return FeatureWindow(timestamps, features, values)
+
+    def latest(self, device_name: str) -> Optional[Dict]:
+        """Window end, stored hours and the most recent feature row of a device"""
+        manifest = self.manifest(device_name)
+        if manifest is None or manifest["rows"] == 0:
+            return None
+        window = self.window(device_name, _from_epoch(manifest["end"]), origin=_from_epoch(manifest["origin"]))
+        if window is None or len(window.y) == 0:
+            return None
+        return {
+            "frequency": manifest["frequency"],
+            "window_end": window.timestamps[-1].isoformat(),
+            "stored_hours": manifest["rows"],
+            "features": {name: round(float(value), 4) for name, value in zip(FEATURE_COLUMNS, window.X[-1])}
+        }
+
+    def sync(self, ml_service, device_names: List[str]) -> Dict[str, int]:
+        """
+        Append the complete hours since each device's window end
+
+        The last REFRESH_HOURS stored hours are re-read with them and
+        rewritten if their consumption changed.
+
+        Devices without stored features are built from the last
+        FEATURE_STORE_DAYS days; all devices are fetched in one query.
+
+        Args:
+            ml_service: MLService providing get_hourly_series / prepare_features
+            device_names: Devices to bring up to date
+
+        Returns:
+            {device_name: rows written}
+        """
+        end_time = datetime.now().replace(minute=0, second=0, microsecond=0)
+        manifests = {device_name: self.manifest(device_name) for device_name in device_names}
+        stored = [device_name for device_name, manifest in manifests.items() if manifest]
+        missing = [device_name for device_name, manifest in manifests.items() if not manifest]
+
+        # One query for the tails of stored devices, one for devices to build
+        series = {}
+        if stored:
+            start = min(_refresh_start(manifests[device_name]) for device_name in stored)
+            series.update(ml_service.get_hourly_series(stored, _from_epoch(start), end_time))
+        if missing:
+            series.update(ml_service.get_hourly_series(
+                missing, end_time - timedelta(days=self.retention_days), end_time
+            ))
+
+        appended = {}
+        for device_name in device_names:
+            new = series.get(device_name)
+            with self._lock(device_name):
+                manifest = self.manifest(device_name)
+                if new is None:
+                    appended[device_name] = 0
+                elif manifest is None:
+                    appended[device_name] = self._build(ml_service, device_name, new)
+                else:
+                    appended[device_name] = self._extend(ml_service, device_name, manifest, new)
+        return appended
+
+    def _build(self, ml_service, device_name: str, df: pd.DataFrame) -> int:
+        X, y, _ = ml_service.prepare_features(df)
+        if len(X) == 0:
+            return 0  # Too short for prepare_features; retried on the next sync
+
+        timestamps = _epoch_array(df['timestamp'])
+        directory = self._dir(device_name)
+        shutil.rmtree(directory, ignore_errors=True)
+        os.makedirs(directory, exist_ok=True)
+        self._write(directory, X, y, timestamps, mode='wb')
+        self._write_manifest(directory, device_name, int(timestamps[0]), int(timestamps[-1]), len(X))
+        logger.info(f"Built feature store for {device_name}: {len(X)} hours")
+        return len(X)
+
+    def _extend(self, ml_service, device_name: str, manifest: Dict, new: pd.DataFrame) -> int:
+        refresh_start = _refresh_start(manifest)
+        new = new[_epoch_array(new['timestamp']) >= refresh_start]
+        if new.empty:
+            return 0
+
+        ts, _, y = self._arrays(device_name, manifest)
+        keep = int(np.searchsorted(ts, refresh_start))
+        # Nothing to rewrite unless new hours arrived or a stored hour changed
+        new_times = _epoch_array(new['timestamp'])
+        if np.array_equal(new_times, ts[keep:]) and np.array_equal(new['consumption'].values, y[keep:]):
+            return 0
+
+        context = pd.DataFrame({
+            'timestamp': pd.to_datetime(np.asarray(ts[max(keep - CONTEXT_ROWS, 0):keep]), unit='s'),
+            'consumption': np.asarray(y[max(keep - CONTEXT_ROWS, 0):keep])
+        })
+        from services.ml_service import fill_hourly_gaps
+        frame = fill_hourly_gaps(pd.concat([context, new], ignore_index=True))
+
+        X, values, _ = ml_service.prepare_features(frame)
+        if len(X) == 0:
+            return 0  # Too short for prepare_features; retried on the next sync
+        timestamps = _epoch_array(frame['timestamp'])
+        tail = timestamps >= refresh_start
+        X, values, timestamps = X[tail], values[tail], timestamps[tail]
+        X[:, _DAYS_SINCE_START] = (timestamps - manifest["origin"]) / _SECONDS_PER_DAY
+
+        directory = self._dir(device_name)
+        self._truncate(directory, keep)
+        self._write(directory, X, values, timestamps, mode='ab')
+        self._write_manifest(directory, device_name, manifest["origin"], int(timestamps[-1]), keep + len(X))
+
+        if manifest["origin"] < timestamps[-1] - (self.retention_days + 7) * _SECONDS_PER_DAY:
+            self._compact(device_name)
+        return len(X)
+
+    def _compact(self, device_name: str):
+        # Drop rows past retention by rewriting the (small) files
+        manifest = self.manifest(device_name)
+        ts, X, y = self._arrays(device_name, manifest)
+        keep = ts >= ts[-1] - self.retention_days * _SECONDS_PER_DAY
+        X, y, ts = np.array(X[keep]), np.array(y[keep]), np.array(ts[keep])
+        X[:, _DAYS_SINCE_START] -= (ts[0] - manifest["origin"]) / _SECONDS_PER_DAY
+
+        # Each file is swapped in whole; the manifest follows them
+        directory = self._dir(device_name)
+        self._write(directory, X, y, ts, mode='wb', suffix=".tmp")
+        for name, _ in _FILES:
+            os.replace(os.path.join(directory, name + ".tmp"), os.path.join(directory, name))
+        self._write_manifest(directory, device_name, int(ts[0]), int(ts[-1]), len(ts))
+
+    @staticmethod
+    def _write(directory: str, X: np.ndarray, y: np.ndarray, timestamps: np.ndarray, mode: str, suffix: str = ""):
+        for name, values, dtype in (("X.f64", X, np.float64), ("y.f64", y, np.float64), ("ts.i64", timestamps, np.int64)):
+            with open(os.path.join(directory, name + suffix), mode) as f:
+                f.write(np.ascontiguousarray(values, dtype=dtype).tobytes())
+
+    @staticmethod
+    def _truncate(directory: str, rows: int):
+        # Drop bytes past `rows`: rows being rewritten, or an append whose manifest update never happened
+        for name, width in _FILES:
+            with open(os.path.join(directory, name), 'r+b') as f:
+                f.truncate(rows * width)
+
+    @staticmethod
+    def _complete(directory: str, rows: int) -> bool:
+        # Extra bytes are fine (the next sync truncates them), missing ones are not
+        try:
+            return all(os.path.getsize(os.path.join(directory, name)) >= rows * width for name, width in _FILES)
+        except OSError:
+            return False
+
+    @staticmethod
+    def _write_manifest(directory: str, device_name: str, origin: int, end: int, rows: int):
+        manifest = {
+            "device_name": device_name,
+            "frequency": FREQUENCY,
+            "columns": list(FEATURE_COLUMNS),
+            "origin": origin,
+            "end": end,
+            "rows": rows,
+            "updated_at": datetime.now().isoformat()
+        }
+        path = os.path.join(directory, "manifest.json")
+        with open(path + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(path + ".tmp", path)
+
+    def invalidate(self, device_name: Optional[str] = None):
+        """Delete stored features (of one device, or all)"""
+        target = os.path.dirname(self._dir(device_name)) if device_name else self.root
+        shutil.rmtree(target, ignore_errors=True)
+
+
+def _refresh_start(manifest: Dict) -> int:
+    """First stored hour recomputed by a sync"""
+    return max(manifest["end"] - (REFRESH_HOURS - 1) * 3600, manifest["origin"])
+
+
+def _epoch(timestamp: datetime) -> int:
+    return int(pd.Timestamp(timestamp).value // 10**9)
+
+
+def _from_epoch(seconds: int) -> datetime:
+    return pd.Timestamp(seconds, unit='s').to_pydatetime()
+
+
+def _epoch_array(timestamps: pd.Series) -> np.ndarray:
+    return pd.to_datetime(timestamps).values.astype('datetime64[s]').astype(np.int64)
+
+
+feature_store = FeatureStore(settings.FEATURE_STORE_DIR, settings.FEATURE_STORE_DAYS)
@@ -0,0 +1,79 @@
+"""
+Global Forecasting Model
+
+One model for every device instead of one per device. The per-device
+feature rows of prepare_features are stacked with static device features
+(one-hot device type and the device's typical consumption level) and the
+consumption-derived columns and target are divided by that level, so
+devices of very different size share one scale-free model.
+
+A device only contributes a consumption level; it needs no model of its
+own, so devices with too little data for train_model (including ones with
+no readings yet) are forecast from their type's level.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from services.forecasting import FEATURE_COLUMNS
+
+# Artifact key of the global model in the model directory and registry
+GLOBAL_MODEL = "__global__"
+
+# Columns that are consumption values and get normalized per device
+CONSUMPTION_COLUMNS = [
+    'consumption_lag_1h', 'consumption_lag_2h', 'consumption_lag_24h',
+    'consumption_rolling_3h', 'consumption_rolling_6h', 'consumption_rolling_24h',
+    'consumption_rolling_std_6h', 'consumption_rolling_min_24h', 'consumption_rolling_max_24h'
+]
+_CONSUMPTION_INDEX = [FEATURE_COLUMNS.index(name) for name in CONSUMPTION_COLUMNS]
+
+# Floor for a device's consumption level (kWh) so idle devices do not blow up
+MIN_SCALE = 1e-3
+
+UNKNOWN_TYPE = "Unknown"
+
+
+def feature_names(device_types: List[str]) -> List[str]:
+    return list(FEATURE_COLUMNS) + [f"type_{device_type}" for device_type in device_types] + ['device_log_level']
+
+
+def consumption_level(values: np.ndarray) -> float:
+    """Typical consumption of a device, used as its normalization scale"""
+    if len(values) == 0:
+        return MIN_SCALE
+    return max(float(np.mean(values)), MIN_SCALE)
+
+
+def static_features(level: float, device_type: str, device_types: List[str]) -> np.ndarray:
+    """One-hot device type (all zero for types unseen in training) and log level"""
+    one_hot = np.array([1.0 if device_type == known else 0.0 for known in device_types])
+    return np.append(one_hot, np.log(level))
+
+
+def normalize(X: np.ndarray, level: float) -> np.ndarray:
+    """Divide the consumption-derived columns of feature rows by a device's level"""
+    X = np.array(X, dtype=float)
+    X[:, _CONSUMPTION_INDEX] /= level
+    return X
+
+
+def stack_device(X: np.ndarray, y: np.ndarray, level: float, static: np.ndarray):
+    """Normalized global feature rows and targets of one device"""
+    X_global = np.hstack([normalize(X, level), np.tile(static, (len(X), 1))])
+    return X_global, np.asarray(y, dtype=float) / level
+
+
+def resolve_level(device_name: str, device_type: str, metadata: Dict, recent: Optional[np.ndarray]) -> float:
+    """
+    Consumption level of a device at prediction time
+
+    Uses the level learned in training, else the device's recent readings,
+    else the typical level of its type (cold start), else of all devices.
+    """
+    level = metadata.get('device_levels', {}).get(device_name)
+    if level is not None:
+        return level
+    if recent is not None and len(recent):
+        return consumption_level(recent)
+    return metadata.get('type_levels', {}).get(device_type, metadata.get('default_level', 1.0))
@@ -0,0 +1,226 @@
+"""
+MQTT Ingestion Worker
+
+Subscribes to the telemetry topic inside the backend process and writes
+readings to energy_consumption in micro-batches, so telemetry no longer
+needs the Node-RED -> HTTP hop.
+
+Readings are buffered in a bounded queue and flushed when either the batch
+size or the flush interval is reached. When the queue is full the MQTT
+network thread blocks (up to a timeout) instead of growing memory, which
+pushes back on the broker. On shutdown the subscription is closed first
+and the queue is drained before the worker exits.
+"""
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+import paho.mqtt.client as mqtt
+from pydantic import ValidationError
+
+from config import settings
+from database.connection import SessionLocal
+from models.energy import EnergyConsumptionSchema
+from services.energy_service import EnergyService
+
+logger = logging.getLogger(__name__)
+
+
+class MQTTIngestionWorker:
+    """Buffers MQTT telemetry and writes it to the database in micro-batches"""
+
+    def __init__(
+        self,
+        broker_url: str,
+        topic: str,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        flush_interval: float = 1.0,
+        put_timeout: float = 5.0
+    ):
+        parsed = urlparse(broker_url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 1883
+        self.topic = topic
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+
+        self.queue: "queue.Queue[EnergyConsumptionSchema]" = queue.Queue(maxsize=queue_size)
+        self.client: Optional[mqtt.Client] = None
+        self._flush_thread: Optional[threading.Thread] = None
+        self._stopping = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "received": 0,
+            "invalid": 0,
+            "dropped": 0,
+            "recorded": 0,
+            "device_off": 0,
+            "unknown_device": 0,
+            "failed": 0,
+            "batches": 0
+        }
+
+    def start(self):
+        """Start the flush thread and subscribe to the telemetry topic"""
+        self._stopping.clear()
+        self._flush_thread = threading.Thread(
+            target=self._run, name="mqtt-ingestion-flush", daemon=True
+        )
+        self._flush_thread.start()
+
+        self.client = mqtt.Client(
+            client_id="smart_home_backend_ingest",
+            clean_session=True
+        )
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+
+        try:
+            self.client.connect(self.host, self.port, 60)
+            self.client.loop_start()
+            logger.info(f"MQTT ingestion subscribed to '{self.topic}' at {self.host}:{self.port}")
+        except Exception as e:
+            logger.error(f"MQTT ingestion failed to connect to {self.host}:{self.port}: {e}")
+
+    def stop(self, timeout: float = 30.0):
+        """
+        Stop consuming and drain buffered readings
+
+        Args:
+            timeout: Maximum seconds to wait for the queue to drain
+        """
+        if self.client is not None:
+            try:
+                self.client.unsubscribe(self.topic)
+                self.client.disconnect()
+                self.client.loop_stop()
+            except Exception as e:
+                logger.warning(f"Error closing MQTT ingestion client: {e}")
+
+        self._stopping.set()
+        if self._flush_thread is not None:
+            self._flush_thread.join(timeout)
+            if self._flush_thread.is_alive():
+                logger.warning(f"MQTT ingestion stopped with {self.queue.qsize()} readings still queued")
+
+        logger.info(f"MQTT ingestion stopped: {self.stats}")
+
+    def status(self) -> Dict:
+        """Current queue depth and counters"""
+        with self._stats_lock:
+            stats = dict(self.stats)
+        return {
+            "running": self._flush_thread is not None and self._flush_thread.is_alive(),
+            "topic": self.topic,
+            "queue_depth": self.queue.qsize(),
+            "queue_capacity": self.queue.maxsize,
+            "batch_size": self.batch_size,
+            "flush_interval": self.flush_interval,
+            "stats": stats
+        }
+
+    def _count(self, key: str, amount: int = 1):
+        with self._stats_lock:
+            self.stats[key] += amount
+
+    def _on_connect(self, client, userdata, flags, rc):
+        if rc == 0:
+            client.subscribe(self.topic, qos=1)
+            logger.info(f"MQTT ingestion connected, subscribed to '{self.topic}'")
+        else:
+            logger.error(f"MQTT ingestion connection failed with code {rc}")
+
+    def _on_message(self, client, userdata, msg):
+        self._count("received")
+        try:
+            reading = EnergyConsumptionSchema(**json.loads(msg.payload))
+        except (ValueError, TypeError, ValidationError) as e:
+            self._count("invalid")
+            logger.warning(f"Ignoring invalid telemetry on {msg.topic}: {e}")
+            return
+
+        # Blocking here stalls the MQTT network loop, which is the backpressure
+        # signal to the broker while the database catches up.
+        try:
+            self.queue.put(reading, timeout=self.put_timeout)
+        except queue.Full:
+            self._count("dropped")
+            logger.warning(f"Ingestion queue full for {self.put_timeout}s, dropping reading for {reading.device_name}")
+
+    def _run(self):
+        while True:
+            batch = self._collect_batch()
+            if batch:
+                self._flush(batch)
+            elif self._stopping.is_set():
+                return
+
+    def _collect_batch(self) -> List[EnergyConsumptionSchema]:
+        """Wait for up to batch_size readings or until flush_interval elapses"""
+        try:
+            first = self.queue.get(timeout=self.flush_interval)
+        except queue.Empty:
+            return []
+
+        batch = [first]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            # Past the deadline (or while draining) only take what is already queued
+            remaining = 0 if self._stopping.is_set() else deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    batch.append(self.queue.get(timeout=remaining))
+                else:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _flush(self, batch: List[EnergyConsumptionSchema]):
+        db = SessionLocal()
+        try:
+            result = EnergyService(db).record_consumptions(batch)
+            with self._stats_lock:
+                self.stats["batches"] += 1
+                self.stats["recorded"] += result["recorded"]
+                self.stats["device_off"] += result["device_off"]
+                self.stats["unknown_device"] += result["unknown_device"]
+        except Exception as e:
+            db.rollback()
+            self._count("failed", len(batch))
+            logger.error(f"Failed to write batch of {len(batch)} readings: {e}")
+        finally:
+            db.close()
+
+
+ingestion_worker: Optional[MQTTIngestionWorker] = None
+
+
+def start_ingestion_worker() -> MQTTIngestionWorker:
+    """Create and start the process-wide ingestion worker"""
+    global ingestion_worker
+    if ingestion_worker is None:
+        ingestion_worker = MQTTIngestionWorker(
+            broker_url=settings.MQTT_BROKER_URL,
+            topic=settings.MQTT_TOPIC,
+            queue_size=settings.MQTT_INGEST_QUEUE_SIZE,
+            batch_size=settings.MQTT_INGEST_BATCH_SIZE,
+            flush_interval=settings.MQTT_INGEST_FLUSH_INTERVAL,
+            put_timeout=settings.MQTT_INGEST_PUT_TIMEOUT
+        )
+        ingestion_worker.start()
+    return ingestion_worker
+
+
+def stop_ingestion_worker():
+    """Stop the ingestion worker and drain its queue"""
+    global ingestion_worker
+    if ingestion_worker is not None:
+        ingestion_worker.stop(settings.MQTT_INGEST_DRAIN_TIMEOUT)
+        ingestion_worker = None
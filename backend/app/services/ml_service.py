@@ -16,22 +16,48 @@ Features:
 
 from sqlalchemy.orm import Session
 from sqlalchemy import text
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.linear_model import LinearRegression, Ridge
 from sklearn.preprocessing import StandardScaler
-from sklearn.model_selection import train_test_split, cross_val_score
+from sklearn.model_selection import train_test_split
 from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
 import pandas as pd
 import numpy as np
 from datetime import datetime, timedelta
-import joblib
+import copy
 import os
-from typing import Dict, List, Optional, Tuple
+from typing import Callable, Dict, List, Optional, Tuple
 import logging
 
+from services.feature_store import feature_store
+from services.forecasting import (
+    FEATURE_COLUMNS, HISTORY_WINDOW, RecursiveInput, forecast_hourly_averages, forecast_recursive,
+    prepare_for_inference
+)
+from services.global_model import (
+    GLOBAL_MODEL, UNKNOWN_TYPE, consumption_level, resolve_level, stack_device, static_features,
+    feature_names as global_feature_names
+)
+from services.model_registry import model_registry
+from services.online_learning import (
+    apply_update, hourly_totals, merge_hourly, moments, supports_update
+)
+from services.parallel_training import Selection, select_models
+
 logger = logging.getLogger(__name__)
 
+def fill_hourly_gaps(df: pd.DataFrame) -> pd.DataFrame:
+    """Reindex an hourly series to every hour in its range, interpolating gaps"""
+    df = df.copy()
+    df['timestamp'] = pd.to_datetime(df['timestamp'])
+    if len(df) < 2:
+        return df.reset_index(drop=True)
+    
+    hours = pd.date_range(df['timestamp'].iloc[0], df['timestamp'].iloc[-1], freq=pd.Timedelta(hours=1))
+    consumption = df.set_index('timestamp')['consumption'].astype(float).reindex(hours).interpolate()
+    return pd.DataFrame({'timestamp': hours, 'consumption': consumption.values})
+
 class MLService:
+    MODEL_DIR = "app/services/models"
+
     def __init__(self, db: Session):
         self.db = db
         self.models = {}
@@ -39,9 +65,53 @@ class MLService:
         self.training_start_times = {}
         self.model_metadata = {}
         self.feature_importances = {}
-        self.model_dir = "app/services/models"
+        self.model_dir = self.MODEL_DIR
         os.makedirs(self.model_dir, exist_ok=True)
     
+    def get_hourly_series(
+        self,
+        device_names: Optional[List[str]],
+        start_time: datetime,
+        end_time: Optional[datetime] = None
+    ) -> Dict[str, pd.DataFrame]:
+        """
+        Regular hourly consumption series, the input of the feature pipeline
+        
+        Readings are averaged per hour by the hourly rollups, so one row is
+        read per device and hour however often devices report, and lag /
+        rolling features count hours. Hours without readings between two
+        that have them are filled by linear interpolation.
+        
+        Args:
+            device_names: Devices to fetch (None for every device)
+            start_time: First hour (truncated to the hour)
+            end_time: Exclusive end (default: up to and including the current hour)
+        
+        Returns:
+            {device_name: DataFrame with timestamp and consumption}, oldest first
+        """
+        conditions = ["bucket >= :start_time", "reading_count > 0"]
+        params = {"start_time": start_time.replace(minute=0, second=0, microsecond=0)}
+        if device_names is not None:
+            conditions.append("device_name = ANY(:device_names)")
+            params["device_names"] = list(device_names)
+        if end_time is not None:
+            conditions.append("bucket < :end_time")
+            params["end_time"] = end_time
+        
+        result = self.db.execute(text(f"""
+            SELECT device_name, bucket, consumption_sum / reading_count
+            FROM energy_consumption_hourly
+            WHERE {' AND '.join(conditions)}
+            ORDER BY device_name, bucket ASC
+        """), params)
+        df = pd.DataFrame(result.fetchall(), columns=['device_name', 'timestamp', 'consumption'])
+        
+        return {
+            device_name: fill_hourly_gaps(group[['timestamp', 'consumption']])
+            for device_name, group in df.groupby('device_name', sort=False)
+        }
+    
     def get_historical_data(self, device_name: str, days: int = 30) -> pd.DataFrame:
         """
         Fetch historical consumption data for a device
@@ -51,28 +121,18 @@ class MLService:
             days: Number of days of historical data to fetch (default: 30 for better patterns)
         
         Returns:
-            DataFrame with timestamp and consumption columns
-        """
-        # Use proper PostgreSQL interval syntax with string formatting
-        query = text(f"""
-            SELECT 
-                timestamp,
-                consumption
-            FROM energy_consumption
-            WHERE device_name = :device_name
-            AND timestamp >= NOW() - INTERVAL '{days} days'
-            ORDER BY timestamp ASC
-        """)
-        
-        result = self.db.execute(query, {"device_name": device_name})
-        data = result.fetchall()
-        
-        if not data:
+            DataFrame with one row per complete hour (timestamp, consumption)
+        """
+        # The current hour is still filling up; train on complete hours only
+        end_time = datetime.now().replace(minute=0, second=0, microsecond=0)
+        series = self.get_hourly_series([device_name], datetime.now() - timedelta(days=days), end_time)
+        df = series.get(device_name)
+        
+        if df is None:
             logger.warning(f"No historical data found for {device_name}")
             return pd.DataFrame()
         
-        df = pd.DataFrame(data, columns=['timestamp', 'consumption'])
-        logger.info(f"Fetched {len(df)} records for {device_name} ({days} days)")
+        logger.info(f"Fetched {len(df)} hourly records for {device_name} ({days} days)")
         return df
     
     def prepare_features(self, df: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, List[str]]:
@@ -135,18 +195,10 @@ class MLService:
         df['hour_weekend_interaction'] = df['hour'] * df['is_weekend']
         
         # Fill NaN values from lag/rolling operations
-        df = df.fillna(method='bfill').fillna(method='ffill').fillna(0)
+        df = df.bfill().ffill().fillna(0)
         
         # Select all feature columns
-        feature_columns = [
-            'hour', 'day_of_week', 'is_weekend', 'month',
-            'hour_sin', 'hour_cos', 'day_sin', 'day_cos',
-            'days_since_start',
-            'consumption_lag_1h', 'consumption_lag_2h', 'consumption_lag_24h',
-            'consumption_rolling_3h', 'consumption_rolling_6h', 'consumption_rolling_24h',
-            'consumption_rolling_std_6h', 'consumption_rolling_min_24h', 'consumption_rolling_max_24h',
-            'hour_weekend_interaction'
-        ]
+        feature_columns = list(FEATURE_COLUMNS)
         
         X = df[feature_columns].values
         y = df['consumption'].values
@@ -155,44 +207,27 @@ class MLService:
         
         return X, y, feature_columns
     
-    def train_model(self, device_name: str, days: int = 30) -> Dict:
+    def _training_set(self, device_name: str, days: int) -> Dict:
         """
-        Train an advanced prediction model for a specific device
-        
-        Uses Random Forest for non-linear pattern capture with proper validation
-        
-        Args:
-            device_name: Name of the device
-            days: Number of days of historical data to use (default: 30)
+        Load, featurize, split and scale the training data of a device
         
         Returns:
-            Dictionary with training results including metrics
+            Dictionary with the scaled splits, the fitted scaler and the raw
+            data, or {"error": ...} if there is not enough data
         """
-        logger.info(f"Training advanced model for {device_name} with {days} days of data...")
+        # Prepared features of the window, appended to the store as hours complete
+        feature_store.sync(self, [device_name])
+        start_time = (datetime.now() - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+        window = feature_store.window(device_name, start_time)
+        samples = len(window.y) if window is not None else 0
         
-        # Get historical data
-        df = self.get_historical_data(device_name, days)
-        
-        if df.empty or len(df) < 100:
-            return {
-                "success": False,
-                "error": f"Insufficient data for training (need 100+ samples, got {len(df)})",
-                "device_name": device_name
-            }
+        if samples < 100:
+            return {"error": f"Insufficient data for training (need 100+ samples, got {samples})"}
         
         # Store the training data start time
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
+        df = window.frame()
         self.training_start_times[device_name] = df['timestamp'].min()
-        
-        # Prepare advanced features
-        X, y, feature_names = self.prepare_features(df)
-        
-        if len(X) == 0:
-            return {
-                "success": False,
-                "error": "Feature preparation failed",
-                "device_name": device_name
-            }
+        X, y, feature_names = window.X, window.y, list(FEATURE_COLUMNS)
         
         # Train/test split for proper validation
         X_train, X_test, y_train, y_test = train_test_split(
@@ -201,67 +236,57 @@ class MLService:
         
         # Scale features
         scaler = StandardScaler()
-        X_train_scaled = scaler.fit_transform(X_train)
-        X_test_scaled = scaler.transform(X_test)
-        
-        # Try multiple algorithms and select best
-        models_to_try = {
-            'RandomForest': RandomForestRegressor(
-                n_estimators=100,
-                max_depth=10,
-                min_samples_split=5,
-                min_samples_leaf=2,
-                random_state=42,
-                n_jobs=-1
-            ),
-            'GradientBoosting': GradientBoostingRegressor(
-                n_estimators=100,
-                max_depth=5,
-                learning_rate=0.1,
-                random_state=42
-            ),
-            'Ridge': Ridge(alpha=1.0)
+        return {
+            "df": df,
+            "y": y,
+            "feature_names": feature_names,
+            "scaler": scaler,
+            "X_train_raw": X_train,
+            "X_train": scaler.fit_transform(X_train),
+            "X_test": scaler.transform(X_test),
+            "y_train": y_train,
+            "y_test": y_test
         }
+    
+    def train_model(self, device_name: str, days: int = 30) -> Dict:
+        """
+        Train an advanced prediction model for a specific device
         
-        best_model = None
-        best_score = -float('inf')
-        best_model_name = None
-        all_results = {}
-        
-        for model_name, model in models_to_try.items():
-            try:
-                # Train model
-                model.fit(X_train_scaled, y_train)
-                
-                # Evaluate on test set
-                y_pred_test = model.predict(X_test_scaled)
-                test_r2 = r2_score(y_test, y_pred_test)
-                test_mae = mean_absolute_error(y_test, y_pred_test)
-                test_rmse = np.sqrt(mean_squared_error(y_test, y_pred_test))
-                
-                # Cross-validation score
-                cv_scores = cross_val_score(model, X_train_scaled, y_train, cv=5, scoring='r2')
-                cv_mean = np.mean(cv_scores)
-                
-                all_results[model_name] = {
-                    'test_r2': test_r2,
-                    'test_mae': test_mae,
-                    'test_rmse': test_rmse,
-                    'cv_r2_mean': cv_mean
-                }
-                
-                logger.info(f"{model_name}: R²={test_r2:.4f}, MAE={test_mae:.4f}, CV-R²={cv_mean:.4f}")
-                
-                # Select best based on test R²
-                if test_r2 > best_score:
-                    best_score = test_r2
-                    best_model = model
-                    best_model_name = model_name
-                    
-            except Exception as e:
-                logger.error(f"Error training {model_name} for {device_name}: {e}")
-                continue
+        Uses Random Forest for non-linear pattern capture with proper validation.
+        Runs the same selection as train_devices, with the fits one after
+        another in this process.
         
+        Args:
+            device_name: Name of the device
+            days: Number of days of historical data to use (default: 30)
+        
+        Returns:
+            Dictionary with training results including metrics
+        """
+        logger.info(f"Training advanced model for {device_name} with {days} days of data...")
+        return self.train_devices([device_name], days, workers=1)[0]
+    
+    def _save_best_model(self, device_name: str, data: Dict, selection: Selection) -> Dict:
+        """
+        Persist and publish the candidate chosen by cross-validation
+        
+        Args:
+            device_name: Name of the device
+            data: Training set from _training_set
+            selection: Result of select_models for the device
+        
+        Returns:
+            Dictionary with training results including metrics
+        """
+        X_train_scaled, X_test_scaled = data["X_train"], data["X_test"]
+        y_train, y_test = data["y_train"], data["y_test"]
+        df, y, feature_names, scaler = data["df"], data["y"], data["feature_names"], data["scaler"]
+        
+        all_results = selection.results
+        for model_name, results in all_results.items():
+            logger.info(f"{model_name}: CV-R²={results['cv_r2_mean']:.4f} over {results['cv_folds']} fold(s)")
+        
+        best_model, best_model_name = selection.model, selection.algorithm
         if best_model is None:
             return {
                 "success": False,
@@ -290,27 +315,23 @@ class MLService:
         use_simple_model = test_r2 < 0.3  # Threshold raised to 0.3
         
         # Save model, scaler, and metadata
-        self.models[device_name] = best_model
+        self.models[device_name] = prepare_for_inference(best_model)
         self.scalers[device_name] = scaler
         
-        # Persist to disk
-        model_path = os.path.join(self.model_dir, f"{device_name}_model.pkl")
-        scaler_path = os.path.join(self.model_dir, f"{device_name}_scaler.pkl")
-        metadata_path = os.path.join(self.model_dir, f"{device_name}_metadata.pkl")
-        
-        joblib.dump(best_model, model_path)
-        joblib.dump(scaler, scaler_path)
-        
         # Calculate hourly averages for fallback
         df_with_features = df.copy()
         df_with_features['hour'] = df_with_features['timestamp'].dt.hour
         hourly_avg = df_with_features.groupby('hour')['consumption'].mean().to_dict()
         overall_avg = float(y.mean())
+        # The online state covers the training split only; the checkpoint sits at
+        # its end, so the first update folds the held-out rows in as well
+        train_rows = df.iloc[:len(y_train)]
+        hourly_sums, hourly_counts = hourly_totals(train_rows['timestamp'], train_rows['consumption'].values)
         
         metadata = {
             'training_start_time': self.training_start_times[device_name],
-            'training_samples': len(X_train),
-            'test_samples': len(X_test),
+            'training_samples': len(X_train_scaled),
+            'test_samples': len(X_test_scaled),
             'train_r2_score': float(train_r2),
             'test_r2_score': float(test_r2),
             'test_mae': float(test_mae),
@@ -320,25 +341,143 @@ class MLService:
             'overall_average': overall_avg,
             'feature_names': feature_names,
             'feature_importance': {k: float(v) for k, v in feature_importance.items()} if feature_importance else None,
-            'all_model_results': all_results
+            'all_model_results': all_results,
+            'selection': selection.summary(),
+            # State for update_model: checkpoint, running hourly totals and
+            # the moments of the rows the model was fitted on
+            'last_timestamp': train_rows['timestamp'].max().to_pydatetime(),
+            'hourly_sums': hourly_sums,
+            'hourly_counts': hourly_counts,
+            'online_stats': moments(data["X_train_raw"], y_train),
+            'online_updates': 0
         }
         
-        joblib.dump(metadata, metadata_path)
+        # Persist as a new artifact version and swap it in
+        version = model_registry.save(self.model_dir, device_name, best_model, scaler, metadata)
         self.model_metadata[device_name] = metadata
         
-        logger.info(f"✓ Model trained for {device_name}: {best_model_name}, Test R²={test_r2:.4f}, MAE={test_mae:.4f}")
+        logger.info(f"✓ Model trained for {device_name}: {best_model_name}, Test R²={test_r2:.4f}, MAE={test_mae:.4f} "
+                    f"(selection: {selection.stopped}, {selection.fit_seconds:.1f}s fitting)")
         
         return {
             "success": True,
             "device_name": device_name,
             "algorithm": best_model_name,
+            "version": version,
             "train_r2_score": round(float(train_r2), 4),
             "test_r2_score": round(float(test_r2), 4),
             "test_mae": round(float(test_mae), 4),
-            "training_samples": len(X_train),
-            "test_samples": len(X_test),
+            "training_samples": len(X_train_scaled),
+            "test_samples": len(X_test_scaled),
             "use_simple_model": bool(use_simple_model),
-            "message": f"Model trained with {len(X_train)} samples, test R²={test_r2:.4f}"
+            "selection": selection.summary(),
+            "message": f"Model trained with {len(X_train_scaled)} samples, test R²={test_r2:.4f}"
+        }
+    
+    def update_model(self, device_name: str) -> Dict:
+        """
+        Incrementally update a trained model with the readings since its last update
+        
+        Only new rows (plus a short context window for the lag features)
+        are fetched. Ridge and partial_fit models, the scaler statistics
+        and the hourly fallback averages are updated in place; tree models
+        keep their fit until the next full retrain.
+        
+        Args:
+            device_name: Name of the device
+        
+        Returns:
+            Dictionary with the number of new rows and what was updated
+        """
+        artifacts = model_registry.get(self.model_dir, device_name)
+        if artifacts is None:
+            return {"success": False, "error": "No trained model", "device_name": device_name}
+        
+        metadata = dict(artifacts.metadata)
+        since = metadata.get('last_timestamp')
+        if since is None or 'hourly_sums' not in metadata:
+            return {
+                "success": False,
+                "error": "Model predates incremental updates, full retrain required",
+                "device_name": device_name
+            }
+        
+        # Features of the hours after the checkpoint, with the trend measured
+        # from the model's training start
+        feature_store.sync(self, [device_name])
+        window = feature_store.window(
+            device_name, since + timedelta(seconds=1), origin=metadata['training_start_time']
+        )
+        new_rows = len(window.y) if window is not None else 0
+        
+        if new_rows == 0:
+            return {"success": True, "device_name": device_name, "new_samples": 0, "model_updated": False}
+        
+        X_new, y_new = window.X, window.y
+        new_times = pd.Series(window.timestamps)
+        
+        sums, counts = merge_hourly(metadata['hourly_sums'], metadata['hourly_counts'], *hourly_totals(new_times, y_new))
+        metadata['hourly_sums'], metadata['hourly_counts'] = sums, counts
+        metadata['hourly_averages'] = {hour: sums[hour] / counts[hour] for hour in sorted(sums)}
+        metadata['overall_average'] = float(sum(sums.values()) / sum(counts.values()))
+        
+        # Update copies: the registry's objects may be in use by predictions
+        model, scaler = artifacts.model, artifacts.scaler
+        model_updated = supports_update(model) and (hasattr(model, 'partial_fit') or 'online_stats' in metadata)
+        if model_updated:
+            model, scaler = copy.deepcopy(model), copy.deepcopy(scaler)
+            stats = apply_update(model, scaler, metadata.get('online_stats'), X_new, y_new)
+            if stats is not None:
+                metadata['online_stats'] = stats
+            metadata['training_samples'] = metadata.get('training_samples', 0) + new_rows
+        
+        metadata['last_timestamp'] = new_times.max().to_pydatetime()
+        metadata['online_updates'] = metadata.get('online_updates', 0) + 1
+        metadata['updated_at'] = datetime.now()
+        
+        # A retrain that finished meanwhile already covers these rows; it must not be overwritten
+        version = model_registry.save(self.model_dir, device_name, model, scaler, metadata,
+                                      expected_version=artifacts.version)
+        if version is None:
+            logger.info(f"Dropped update of {device_name}: the model was retrained meanwhile")
+            return {
+                "success": False,
+                "error": "Model was retrained during the update",
+                "device_name": device_name
+            }
+        
+        logger.info(f"Updated {device_name} with {new_rows} new samples (model {'updated' if model_updated else 'unchanged'})")
+        
+        return {
+            "success": True,
+            "device_name": device_name,
+            "algorithm": metadata.get('algorithm'),
+            "version": version,
+            "new_samples": new_rows,
+            "model_updated": model_updated,
+            "training_samples": metadata.get('training_samples')
+        }
+    
+    def update_all_models(self) -> Dict:
+        """
+        Incrementally update the models of all devices
+        
+        Returns:
+            Summary of update results
+        """
+        result = self.db.execute(text("SELECT DISTINCT name FROM devices"))
+        devices = [row[0] for row in result.fetchall()]
+        
+        results = [self.update_model(device_name) for device_name in devices]
+        updated = sum(1 for update in results if update.get("success"))
+        
+        return {
+            "success": True,
+            "total_devices": len(devices),
+            "updated": updated,
+            "new_samples": sum(update.get("new_samples", 0) for update in results),
+            "results": results,
+            "timestamp": datetime.now().isoformat()
         }
     
     def load_model(self, device_name: str) -> bool:
@@ -351,28 +490,45 @@ class MLService:
         Returns:
             True if loaded successfully, False otherwise
         """
-        model_path = os.path.join(self.model_dir, f"{device_name}_model.pkl")
-        scaler_path = os.path.join(self.model_dir, f"{device_name}_scaler.pkl")
-        metadata_path = os.path.join(self.model_dir, f"{device_name}_metadata.pkl")
-        
-        if not os.path.exists(model_path) or not os.path.exists(scaler_path):
+        # Served from the process-wide registry; only the first request (or
+        # one after retraining) actually reads the artifact files
+        artifacts = model_registry.get(self.model_dir, device_name)
+        if artifacts is None:
             return False
         
-        try:
-            self.models[device_name] = joblib.load(model_path)
-            self.scalers[device_name] = joblib.load(scaler_path)
-            
-            # Load metadata if it exists
-            if os.path.exists(metadata_path):
-                metadata = joblib.load(metadata_path)
-                self.training_start_times[device_name] = metadata.get('training_start_time')
-                self.model_metadata[device_name] = metadata
-            
-            return True
-        except Exception as e:
-            logger.error(f"Error loading model for {device_name}: {e}")
-            return False
+        self.models[device_name] = artifacts.model
+        self.scalers[device_name] = artifacts.scaler
+        if artifacts.metadata:
+            self.training_start_times[device_name] = artifacts.metadata.get('training_start_time')
+            self.model_metadata[device_name] = artifacts.metadata
+        return True
     
+    def get_recent_history(self, device_names: List[str], days: int = 2) -> Dict[str, pd.DataFrame]:
+        """
+        Recent hourly consumption of several devices
+
+        Args:
+            device_names: Devices to fetch
+            days: Number of days of history
+
+        Returns:
+            {device_name: DataFrame with timestamp and consumption}, oldest first
+        """
+        # Complete hours come from the feature store; devices too new to
+        # have stored features are read from the rollups
+        feature_store.sync(self, device_names)
+        start_time = datetime.now() - timedelta(days=days)
+        history = {}
+        for device_name in device_names:
+            window = feature_store.window(device_name, start_time)
+            if window is not None and len(window.y):
+                history[device_name] = window.frame()
+        
+        missing = [device_name for device_name in device_names if device_name not in history]
+        if missing:
+            history.update(self.get_hourly_series(missing, start_time))
+        return history
+
     def predict_next_hours(self, device_name: str, hours: int = 24) -> Dict:
         """
         Predict consumption for the next N hours using advanced features
@@ -384,129 +540,143 @@ class MLService:
         Returns:
             Dictionary with predictions
         """
-        # Load or train model
-        if device_name not in self.models:
-            if not self.load_model(device_name):
-                train_result = self.train_model(device_name)
-                if not train_result["success"]:
-                    return train_result
-        
-        model = self.models[device_name]
-        scaler = self.scalers[device_name]
-        metadata = self.model_metadata.get(device_name, {})
-        
-        # Check if we should use simple model
-        use_simple_model = metadata.get('use_simple_model', False)
-        
+        return self.predict_devices([device_name], hours)[device_name]
+
+    def predict_devices(self, device_names: List[str], hours: int = 24) -> Dict[str, Dict]:
+        """
+        Predict the next N hours for several devices together
+
+        Devices on the ML model are forecast in lockstep by
+        forecasting.forecast_recursive (one predict call per model and step);
+        devices on the simple model or without enough recent history get the
+        per-hour averages for all horizons at once.
+
+        Args:
+            device_names: Devices to predict
+            hours: Number of hours to predict
+
+        Returns:
+            {device_name: prediction result}
+        """
+        from config import settings
+        from services.training_jobs import training_manager
+
+        global_mode = settings.ML_MODEL_MODE == "global"
+        results = {}
+        ready = []
+        shared = []
+        for device_name in device_names:
+            if not global_mode and (device_name in self.models or self.load_model(device_name)):
+                ready.append(device_name)
+            else:
+                shared.append(device_name)
+
+        # Devices without a model of their own (all of them in global mode)
+        # are forecast by the global model
+        global_artifacts = model_registry.get(self.model_dir, GLOBAL_MODEL) if shared else None
+
+        # Never train inside a prediction; queue a background job instead
+        if shared and not global_mode:
+            training_manager.ensure_trained(shared, settings.ML_TRAINING_DAYS)
+        elif shared and global_artifacts is None:
+            training_manager.ensure_trained([GLOBAL_MODEL], settings.ML_TRAINING_DAYS)
+
+        if global_artifacts is None:
+            for device_name in shared:
+                results[device_name] = {
+                    "success": False,
+                    "device_name": device_name,
+                    "error": "No trained model yet, training has been scheduled"
+                }
+            shared = []
+
         # Generate future timestamps
         now = datetime.now()
         future_times = [now + timedelta(hours=i) for i in range(hours)]
-        
-        if use_simple_model:
-            # Use hourly averages for better predictions when R² is low
-            logger.info(f"Using simple averaging model for {device_name} (low R² score)")
-            hourly_avg = metadata.get('hourly_averages', {})
-            overall_avg = metadata.get('overall_average', 1.0)
-            
-            predictions = np.array([
-                hourly_avg.get(t.hour, overall_avg) 
-                for t in future_times
-            ])
-        else:
-            # Use advanced ML model - need historical data for lag/rolling features
-            logger.info(f"Using advanced ML model for {device_name}")
-            
-            # Fetch recent historical data (24 hours) for lag and rolling features
-            historical_df = self.get_historical_data(device_name, days=2)  # Get 2 days to be safe
-            
-            if historical_df.empty or len(historical_df) < 50:
+
+        predictions = {}
+        recursive_inputs = []
+        advanced = [name for name in ready
+                    if not self.model_metadata.get(name, {}).get('use_simple_model', False)]
+        history = self.get_recent_history(advanced, days=2) if advanced else {}
+
+        for device_name in ready:
+            metadata = self.model_metadata.get(device_name, {})
+            historical_df = history.get(device_name)
+
+            if device_name not in advanced:
+                # Use hourly averages for better predictions when R² is low
+                logger.info(f"Using simple averaging model for {device_name} (low R² score)")
+            elif historical_df is None or len(historical_df) < HISTORY_WINDOW:
                 logger.warning(f"Insufficient historical data for {device_name}, using averages")
-                hourly_avg = metadata.get('hourly_averages', {})
-                overall_avg = metadata.get('overall_average', 1.0)
-                predictions = np.array([hourly_avg.get(t.hour, overall_avg) for t in future_times])
             else:
-                # Prepare historical data with features
-                historical_df['timestamp'] = pd.to_datetime(historical_df['timestamp'])
-                historical_df = historical_df.sort_values('timestamp').reset_index(drop=True)
-                
-                # Create future dataframe
-                future_df = pd.DataFrame({
-                    'timestamp': pd.to_datetime(future_times),
-                    'consumption': np.nan  # We'll fill this iteratively
-                })
-                
-                # Combine historical and future
-                combined_df = pd.concat([historical_df, future_df], ignore_index=True)
-                combined_df = combined_df.sort_values('timestamp').reset_index(drop=True)
-                
-                # Find where future starts
-                future_start_idx = len(historical_df)
-                
-                # Prepare all features on combined dataframe
-                training_start_time = self.training_start_times.get(device_name, combined_df['timestamp'].min())
-                
-                # Basic time features
-                combined_df['hour'] = combined_df['timestamp'].dt.hour
-                combined_df['day_of_week'] = combined_df['timestamp'].dt.dayofweek
-                combined_df['is_weekend'] = (combined_df['day_of_week'] >= 5).astype(int)
-                combined_df['month'] = combined_df['timestamp'].dt.month
-                
-                # Cyclical encoding
-                combined_df['hour_sin'] = np.sin(2 * np.pi * combined_df['hour'] / 24)
-                combined_df['hour_cos'] = np.cos(2 * np.pi * combined_df['hour'] / 24)
-                combined_df['day_sin'] = np.sin(2 * np.pi * combined_df['day_of_week'] / 7)
-                combined_df['day_cos'] = np.cos(2 * np.pi * combined_df['day_of_week'] / 7)
-                
-                # Trend
-                combined_df['days_since_start'] = (combined_df['timestamp'] - training_start_time).dt.total_seconds() / (24 * 3600)
-                
-                # Now predict iteratively to build up lag features
-                predictions = []
-                
-                feature_columns = [
-                    'hour', 'day_of_week', 'is_weekend', 'month',
-                    'hour_sin', 'hour_cos', 'day_sin', 'day_cos',
-                    'days_since_start',
-                    'consumption_lag_1h', 'consumption_lag_2h', 'consumption_lag_24h',
-                    'consumption_rolling_3h', 'consumption_rolling_6h', 'consumption_rolling_24h',
-                    'consumption_rolling_std_6h', 'consumption_rolling_min_24h', 'consumption_rolling_max_24h',
-                    'hour_weekend_interaction'
-                ]
-                
-                for i in range(future_start_idx, len(combined_df)):
-                    # Calculate lag and rolling features up to current point
-                    combined_df.loc[i, 'consumption_lag_1h'] = combined_df.loc[i-1, 'consumption'] if i >= 1 else 0
-                    combined_df.loc[i, 'consumption_lag_2h'] = combined_df.loc[i-2, 'consumption'] if i >= 2 else 0
-                    combined_df.loc[i, 'consumption_lag_24h'] = combined_df.loc[i-24, 'consumption'] if i >= 24 else combined_df.loc[max(0, i-24):i, 'consumption'].mean()
-                    
-                    # Rolling averages
-                    combined_df.loc[i, 'consumption_rolling_3h'] = combined_df.loc[max(0, i-3):i, 'consumption'].mean()
-                    combined_df.loc[i, 'consumption_rolling_6h'] = combined_df.loc[max(0, i-6):i, 'consumption'].mean()
-                    combined_df.loc[i, 'consumption_rolling_24h'] = combined_df.loc[max(0, i-24):i, 'consumption'].mean()
-                    
-                    # Rolling statistics
-                    combined_df.loc[i, 'consumption_rolling_std_6h'] = combined_df.loc[max(0, i-6):i, 'consumption'].std() if i >= 6 else 0
-                    combined_df.loc[i, 'consumption_rolling_min_24h'] = combined_df.loc[max(0, i-24):i, 'consumption'].min()
-                    combined_df.loc[i, 'consumption_rolling_max_24h'] = combined_df.loc[max(0, i-24):i, 'consumption'].max()
-                    
-                    # Interaction
-                    combined_df.loc[i, 'hour_weekend_interaction'] = combined_df.loc[i, 'hour'] * combined_df.loc[i, 'is_weekend']
-                    
-                    # Get features for this timestep
-                    X_current = combined_df.loc[i:i, feature_columns].values
-                    X_current = np.nan_to_num(X_current, 0)  # Replace any NaN with 0
-                    
-                    # Scale and predict
-                    X_scaled = scaler.transform(X_current)
-                    pred = model.predict(X_scaled)[0]
-                    pred = max(pred, 0)  # Ensure non-negative
-                    
-                    # Store prediction back into dataframe for next iteration's lag features
-                    combined_df.loc[i, 'consumption'] = pred
-                    predictions.append(pred)
-                
-                predictions = np.array(predictions)
-        
+                logger.info(f"Using advanced ML model for {device_name}")
+                recursive_inputs.append(RecursiveInput(
+                    key=device_name,
+                    model=self.models[device_name],
+                    scaler=self.scalers[device_name],
+                    history=historical_df['consumption'].to_numpy(dtype=float),
+                    training_start_time=self.training_start_times.get(device_name) or historical_df['timestamp'].iloc[0]
+                ))
+                continue
+
+            predictions[device_name] = forecast_hourly_averages(
+                metadata.get('hourly_averages', {}),
+                metadata.get('overall_average', 1.0),
+                future_times
+            )
+
+        predictions.update(forecast_recursive(recursive_inputs, future_times))
+        if shared:
+            predictions.update(self._predict_global(shared, future_times, global_artifacts))
+
+        for device_name in ready + shared:
+            results[device_name] = self._format_prediction(device_name, predictions[device_name], future_times)
+        for device_name in shared:
+            results[device_name]["model"] = "global"
+        return results
+
+    def _predict_global(self, device_names: List[str], future_times: List[datetime], artifacts) -> Dict[str, np.ndarray]:
+        """
+        Forecast devices with the global model, all in one recursive batch
+
+        Devices with less than a day of recent readings (or none) have their
+        lag window padded at their consumption level, so new devices get a
+        forecast shaped by their type and the time of day.
+        """
+        metadata = artifacts.metadata
+        known_types = metadata.get('device_type_map', {})
+        unknown = [name for name in device_names if name not in known_types]
+        types = dict(self.db.execute(
+            text("SELECT name, type FROM devices WHERE name = ANY(:names)"), {"names": unknown}
+        ).fetchall()) if unknown else {}
+        history = self.get_recent_history(device_names, days=2)
+
+        inputs = []
+        for device_name in device_names:
+            device_type = known_types.get(device_name) or types.get(device_name, UNKNOWN_TYPE)
+            recent_df = history.get(device_name)
+            recent = recent_df['consumption'].to_numpy(dtype=float) if recent_df is not None else np.empty(0)
+            level = resolve_level(device_name, device_type, metadata, recent)
+
+            padding = max(HISTORY_WINDOW - len(recent), 0)
+            padded = np.concatenate([np.full(padding, recent.mean() if len(recent) else level), recent])
+            start_time = metadata.get('device_start_times', {}).get(device_name)
+            if start_time is None:
+                start_time = recent_df['timestamp'].iloc[0] if recent_df is not None else future_times[0]
+
+            inputs.append(RecursiveInput(
+                key=device_name,
+                model=artifacts.model,
+                scaler=artifacts.scaler,
+                history=padded,
+                training_start_time=start_time,
+                static=static_features(level, device_type, metadata['device_types']),
+                level=level
+            ))
+        return forecast_recursive(inputs, future_times)
+
+    def _format_prediction(self, device_name: str, predictions: np.ndarray, future_times: List[datetime]) -> Dict:
         # Ensure non-negative and reasonable predictions
         predictions = np.maximum(predictions, 0)
         
@@ -534,7 +704,7 @@ class MLService:
         return {
             "success": True,
             "device_name": device_name,
-            "prediction_period_hours": hours,
+            "prediction_period_hours": len(future_times),
             "total_predicted_kwh": round(total_predicted, 4),
             "average_predicted_kwh": round(avg_predicted, 4),
             "hourly_predictions": hourly_predictions
@@ -557,8 +727,7 @@ class MLService:
         predictions = {}
         total_predicted = 0
         
-        for device_name in devices:
-            device_prediction = self.predict_next_hours(device_name, hours)
+        for device_name, device_prediction in self.predict_devices(devices, hours).items():
             if device_prediction.get("success"):
                 predictions[device_name] = device_prediction
                 total_predicted += device_prediction["total_predicted_kwh"]
@@ -586,31 +755,38 @@ class MLService:
         if not all_predictions.get("success"):
             return all_predictions
         
-        # Get electricity rate from config
-        try:
-            from config import settings
-            electricity_rate = settings.ELECTRICITY_RATE
-        except:
-            logger.warning("Could not load electricity rate from config, using default 0.12")
-            electricity_rate = 0.12
-        
+        # Price every device's hourly forecast under the tariff in one vectorised pass
+        from services.rollup_service import RollupService
+        from services.tariff_service import tariffs
+
+        devices = list(all_predictions["devices"].items())
         total_kwh = all_predictions["total_predicted_kwh"]
-        total_cost = total_kwh * electricity_rate
+        device_costs = np.zeros(len(devices))
+        if devices:
+            times = pd.to_datetime([entry["timestamp"] for entry in devices[0][1]["hourly_predictions"]]).values
+            kwh = np.array([[entry["predicted_consumption"] for entry in prediction["hourly_predictions"]]
+                            for _, prediction in devices])
+            month_to_date = 0.0
+            if tariffs.has_tiers:
+                month_to_date = RollupService(self.db).summary(tariffs.billing_month_start(datetime.now()))["total"]
+            device_costs = tariffs.cost(np.broadcast_to(times, kwh.shape), kwh, month_to_date).sum(axis=1)
+        total_cost = float(device_costs.sum())
+        electricity_rate = total_cost / total_kwh if total_kwh > 0 else float(tariffs.rates([datetime.now()])[0])
         
         # Calculate daily and monthly projections
         daily_kwh = total_kwh * (24 / hours) if hours > 0 else total_kwh
+        daily_cost = total_cost * (24 / hours) if hours > 0 else total_cost
         monthly_kwh = daily_kwh * 30
-        monthly_cost = monthly_kwh * electricity_rate
+        monthly_cost = daily_cost * 30
         
         # Get device breakdown
         device_breakdown = []
-        for device_name, prediction in all_predictions["devices"].items():
+        for (device_name, prediction), device_cost in zip(devices, device_costs):
             device_kwh = prediction["total_predicted_kwh"]
-            device_cost = device_kwh * electricity_rate
             device_breakdown.append({
                 "device_name": device_name,
                 "predicted_kwh": round(device_kwh, 4),
-                "predicted_cost": round(device_cost, 2),
+                "predicted_cost": round(float(device_cost), 2),
                 "percentage": round((device_kwh / total_kwh * 100) if total_kwh > 0 else 0, 2)
             })
         
@@ -626,23 +802,213 @@ class MLService:
             },
             "projected_daily": {
                 "total_kwh": round(daily_kwh, 4),
-                "total_cost": round(daily_kwh * electricity_rate, 2)
+                "total_cost": round(daily_cost, 2)
             },
             "projected_monthly": {
                 "total_kwh": round(monthly_kwh, 4),
                 "total_cost": round(monthly_cost, 2)
             },
             "device_breakdown": device_breakdown,
-            "electricity_rate_per_kwh": electricity_rate,
+            "electricity_rate_per_kwh": round(electricity_rate, 4),
+            "tariff": tariffs.name,
             "timestamp": datetime.now().isoformat()
         }
     
-    def train_all_models(self, days: int = 30) -> Dict:
+    def train_devices(
+        self,
+        device_names: List[str],
+        days: int = 30,
+        workers: Optional[int] = None,
+        on_result: Optional[Callable[[str, Dict], None]] = None
+    ) -> List[Dict]:
+        """
+        Train models for several devices in parallel
+        
+        Data loading and feature preparation happen here; every (device,
+        algorithm, CV fold) fit runs as a separate task on a process pool
+        and candidates are chosen by time-series cross-validation with
+        successive halving (see services.parallel_training).
+        
+        Args:
+            device_names: Devices to train
+            days: Number of days of historical data to use (default: 30)
+            workers: Worker processes (default: ML_TRAINING_WORKERS, 0 = one per CPU core)
+            on_result: Called with (device_name, result) as each device finishes
+        
+        Returns:
+            Training result of every device, in the order given
+        """
+        from config import settings
+        
+        workers = settings.ML_TRAINING_WORKERS if workers is None else workers
+        results = {}
+        
+        def finish(device_name: str, result: Dict):
+            results[device_name] = result
+            if on_result is not None:
+                on_result(device_name, result)
+        
+        training_sets = {}
+        for device_name in device_names:
+            if device_name == GLOBAL_MODEL:
+                continue
+            logger.info(f"Preparing training data for {device_name} ({days} days)...")
+            data = self._training_set(device_name, days)
+            if "error" in data:
+                finish(device_name, {"success": False, "error": data["error"], "device_name": device_name})
+            else:
+                training_sets[device_name] = data
+        
+        def save(device_name: str, selection: Selection):
+            data = training_sets.pop(device_name)
+            finish(device_name, self._save_best_model(device_name, data, selection))
+        
+        if training_sets:
+            select_models(training_sets, workers or -1, settings.ML_SELECTION_BUDGET, on_device=save)
+        if GLOBAL_MODEL in device_names:
+            finish(GLOBAL_MODEL, self.train_global_model(days, workers))
+        
+        return [results[device_name] for device_name in device_names]
+    
+    def train_global_model(self, days: int = 30, workers: Optional[int] = None) -> Dict:
+        """
+        Train one model on the stacked, level-normalized features of all devices
+        
+        Every device with at least 50 readings contributes its chronological
+        80/20 split; candidates are cross-validated on the pooled training
+        rows in hour order and the winner is reported on the pooled test rows.
+        
+        Args:
+            days: Number of days of historical data to use (default: 30)
+            workers: Worker processes (default: ML_TRAINING_WORKERS, 0 = one per CPU core)
+        
+        Returns:
+            Dictionary with training results including metrics
+        """
+        from config import settings
+        
+        workers = settings.ML_TRAINING_WORKERS if workers is None else workers
+        logger.info(f"Training global model with {days} days of data...")
+        
+        device_type_of = dict(self.db.execute(text("SELECT name, type FROM devices")).fetchall())
+        start_time = (datetime.now() - timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+        device_names = [row[0] for row in self.db.execute(text("""
+            SELECT DISTINCT device_name FROM energy_consumption_hourly WHERE bucket >= :start_time
+        """), {"start_time": start_time})]
+        feature_store.sync(self, device_names)
+        windows = {device_name: feature_store.window(device_name, start_time) for device_name in device_names}
+        windows = {device_name: window for device_name, window in windows.items()
+                   if window is not None and len(window.y) >= 50}
+        
+        device_types = sorted({device_type_of.get(name, UNKNOWN_TYPE) for name in windows})
+        parts = {"X_train": [], "y_train": [], "X_test": [], "y_test": [], "levels_train": [], "levels_test": [],
+                 "hours_train": []}
+        device_levels, device_start_times, device_type_map = {}, {}, {}
+        
+        for device_name, window in windows.items():
+            X, y = window.X, window.y
+            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, shuffle=False)
+            level = consumption_level(y_train)
+            device_type = device_type_of.get(device_name, UNKNOWN_TYPE)
+            static = static_features(level, device_type, device_types)
+            
+            for split, X_part, y_part in (("train", X_train, y_train), ("test", X_test, y_test)):
+                X_global, y_global = stack_device(X_part, y_part, level, static)
+                parts[f"X_{split}"].append(X_global)
+                parts[f"y_{split}"].append(y_global)
+                parts[f"levels_{split}"].append(np.full(len(y_part), level))
+            parts["hours_train"].append(window.timestamps.values[:len(y_train)])
+            
+            device_levels[device_name] = level
+            device_start_times[device_name] = window.timestamps[0].to_pydatetime()
+            device_type_map[device_name] = device_type
+        
+        if not device_levels:
+            return {
+                "success": False,
+                "error": "Insufficient data for training (no device has 50+ samples)",
+                "device_name": GLOBAL_MODEL
+            }
+        
+        stacked = {name: np.concatenate(values) for name, values in parts.items()}
+        # Interleave devices by hour so the time-series CV folds stay chronological
+        order = np.argsort(stacked.pop("hours_train"), kind='stable')
+        for name in ("X_train", "y_train", "levels_train"):
+            stacked[name] = stacked[name][order]
+        scaler = StandardScaler()
+        training_set = {
+            "X_train": scaler.fit_transform(stacked["X_train"]),
+            "X_test": scaler.transform(stacked["X_test"]),
+            "y_train": stacked["y_train"],
+            "y_test": stacked["y_test"]
+        }
+        selection = select_models({GLOBAL_MODEL: training_set}, workers or -1, settings.ML_SELECTION_BUDGET)[GLOBAL_MODEL]
+        all_results = selection.results
+        for model_name, results in all_results.items():
+            logger.info(f"Global {model_name}: CV-R²={results['cv_r2_mean']:.4f} (normalized) "
+                        f"over {results['cv_folds']} fold(s)")
+        if selection.model is None:
+            return {"success": False, "error": "All models failed to train", "device_name": GLOBAL_MODEL}
+        best_model, best_model_name = selection.model, selection.algorithm
+        
+        # Report metrics in kWh
+        y_train_kwh = stacked["y_train"] * stacked["levels_train"]
+        y_test_kwh = stacked["y_test"] * stacked["levels_test"]
+        train_r2 = r2_score(y_train_kwh, best_model.predict(training_set["X_train"]) * stacked["levels_train"])
+        y_pred_test = best_model.predict(training_set["X_test"]) * stacked["levels_test"]
+        test_r2 = r2_score(y_test_kwh, y_pred_test)
+        test_mae = mean_absolute_error(y_test_kwh, y_pred_test)
+        
+        levels_by_type = {}
+        for device_name, level in device_levels.items():
+            levels_by_type.setdefault(device_type_map[device_name], []).append(level)
+        
+        metadata = {
+            'training_start_time': min(device_start_times.values()),
+            'training_samples': len(y_train_kwh),
+            'test_samples': len(y_test_kwh),
+            'train_r2_score': float(train_r2),
+            'test_r2_score': float(test_r2),
+            'test_mae': float(test_mae),
+            'algorithm': best_model_name,
+            'feature_names': global_feature_names(device_types),
+            'all_model_results': all_results,
+            'selection': selection.summary(),
+            'device_types': device_types,
+            'device_type_map': device_type_map,
+            'device_levels': device_levels,
+            'device_start_times': device_start_times,
+            'type_levels': {device_type: float(np.median(levels)) for device_type, levels in levels_by_type.items()},
+            'default_level': float(np.median(list(device_levels.values())))
+        }
+        
+        version = model_registry.save(self.model_dir, GLOBAL_MODEL, best_model, scaler, metadata)
+        
+        logger.info(f"✓ Global model trained on {len(device_levels)} devices: {best_model_name}, "
+                    f"Test R²={test_r2:.4f}, MAE={test_mae:.4f}")
+        
+        return {
+            "success": True,
+            "device_name": GLOBAL_MODEL,
+            "algorithm": best_model_name,
+            "version": version,
+            "devices": len(device_levels),
+            "train_r2_score": round(float(train_r2), 4),
+            "test_r2_score": round(float(test_r2), 4),
+            "test_mae": round(float(test_mae), 4),
+            "training_samples": len(y_train_kwh),
+            "test_samples": len(y_test_kwh),
+            "selection": selection.summary(),
+            "message": f"Global model trained on {len(device_levels)} devices, test R²={test_r2:.4f}"
+        }
+    
+    def train_all_models(self, days: int = 30, workers: Optional[int] = None) -> Dict:
         """
         Train models for all devices with advanced ML
         
         Args:
             days: Number of days of historical data to use (default: 30)
+            workers: Worker processes (default: ML_TRAINING_WORKERS, 0 = one per CPU core)
         
         Returns:
             Summary of training results
@@ -650,20 +1016,11 @@ class MLService:
         result = self.db.execute(text("SELECT DISTINCT name FROM devices"))
         devices = [row[0] for row in result.fetchall()]
         
-        results = []
-        successful = 0
-        failed = 0
-        
         logger.info(f"Starting training for {len(devices)} devices with {days} days of data...")
         
-        for device_name in devices:
-            train_result = self.train_model(device_name, days)
-            results.append(train_result)
-            
-            if train_result.get("success"):
-                successful += 1
-            else:
-                failed += 1
+        results = self.train_devices(devices, days, workers)
+        successful = sum(1 for train_result in results if train_result.get("success"))
+        failed = len(results) - successful
         
         logger.info(f"Training complete: {successful} successful, {failed} failed")
         
@@ -0,0 +1,368 @@
+"""
+Model Artifact Format
+
+Each save of a model creates a new version directory
+
+    <model_dir>/<device>/v000042/manifest.json
+                                 *.npy
+
+and then points <model_dir>/<device>/CURRENT at it, so readers never see
+a half-written model. The manifest is a small JSON document holding the
+training metadata (metrics, feature names, importances, ...) and a
+description of the model and scaler; their weights are numpy arrays that
+are opened memory-mapped. Random forests and gradient boosting are stored
+as the concatenated node arrays of their trees and rebuilt as a
+TreeEnsemble, linear models as their coefficients, so loading does not
+unpickle an object graph. Other estimators fall back to a joblib pickle
+inside the version directory.
+
+Tree node arrays and pickles follow scikit-learn's private layouts, which
+change between releases, so they are only loaded by the release recorded
+in the manifest; after an upgrade such a model is reported stale and the
+device is retrained. Linear models and scalers are plain arrays and load
+under any release.
+
+Listing models only needs the manifests. The older flat
+<device>_model.pkl / _scaler.pkl / _metadata.pkl pickles are still read
+and are converted to a version on first load.
+"""
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import quote
+import importlib
+import json
+import logging
+import os
+import shutil
+import threading
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST = "manifest.json"
+CURRENT = "CURRENT"
+
+# Linear models whose predictions only need coef_ and intercept_
+_LINEAR_MODELS = {
+    "sklearn.linear_model.Ridge": ("sklearn.linear_model", "Ridge"),
+    "sklearn.linear_model.LinearRegression": ("sklearn.linear_model", "LinearRegression"),
+}
+
+# Model and scaler kinds stored in scikit-learn's private layouts
+_VERSION_BOUND_KINDS = ("forest", "boosting", "pickle")
+
+_write_lock = threading.Lock()
+
+
+class StaleModelError(Exception):
+    """Artifact written by a scikit-learn release other than the installed one"""
+
+
+class TreeEnsemble:
+    """
+    Trees of a random forest or gradient boosting model rebuilt for prediction
+
+    Predicts like the fitted estimator: the mean of the trees for a forest,
+    base + learning_rate * sum of the trees for boosting.
+    """
+
+    def __init__(self, kind: str, algorithm: str, n_features: int, nodes: np.ndarray,
+                 values: np.ndarray, trees: np.ndarray, base: float = 0.0, learning_rate: float = 1.0):
+        from sklearn.tree._tree import Tree
+
+        self.kind = kind
+        self.algorithm = algorithm
+        self.n_features_in_ = n_features
+        self.nodes, self.values, self.trees = nodes, values, trees
+        self.base = base
+        self.learning_rate = learning_rate
+
+        self.estimators = []
+        offset = 0
+        for node_count, max_depth in trees:
+            tree = Tree(n_features, np.array([1], dtype=np.intp), 1)
+            tree.__setstate__({
+                "max_depth": int(max_depth),
+                "node_count": int(node_count),
+                "nodes": nodes[offset:offset + node_count],
+                "values": values[offset:offset + node_count]
+            })
+            self.estimators.append(tree)
+            offset += node_count
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        X32 = np.ascontiguousarray(X, dtype=np.float32)
+        total = np.zeros(len(X32))
+        for tree in self.estimators:
+            total += tree.predict(X32).reshape(len(X32), -1)[:, 0]
+        if self.kind == "forest":
+            return total / len(self.estimators)
+        return self.base + self.learning_rate * total
+
+
+def _device_dir(model_dir: str, device_name: str) -> str:
+    return os.path.join(model_dir, quote(device_name, safe=''))
+
+
+def legacy_paths(model_dir: str, device_name: str) -> Tuple[str, str, str]:
+    return (
+        os.path.join(model_dir, f"{device_name}_model.pkl"),
+        os.path.join(model_dir, f"{device_name}_scaler.pkl"),
+        os.path.join(model_dir, f"{device_name}_metadata.pkl"),
+    )
+
+
+def current_version(model_dir: str, device_name: str) -> Optional[str]:
+    """Name of the version CURRENT points at, None if the device has none"""
+    try:
+        with open(os.path.join(_device_dir(model_dir, device_name), CURRENT)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def read_manifest(model_dir: str, device_name: str) -> Optional[Dict]:
+    """
+    Manifest of a device's current version, with its metadata decoded
+
+    Returns:
+        Manifest dict ("version", "metadata", "size_bytes", ...), or None
+    """
+    device_dir = _device_dir(model_dir, device_name)
+    try:
+        with open(os.path.join(device_dir, CURRENT)) as f:
+            version_dir = os.path.join(device_dir, f.read().strip())
+        with open(os.path.join(version_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if manifest.get("format") != FORMAT_VERSION:
+        return None
+    manifest["path"] = version_dir
+    manifest["metadata"] = _decode(manifest["metadata"], version_dir)
+    return manifest
+
+
+def load_version(manifest: Dict):
+    """
+    Model and scaler of a manifest from read_manifest
+
+    Returns:
+        (model, scaler)
+
+    Raises:
+        StaleModelError: The artifact needs the scikit-learn release that wrote it
+    """
+    written_by = manifest.get("sklearn_version")
+    kinds = (manifest["model"]["kind"], manifest["scaler"]["kind"])
+    if written_by != sklearn.__version__ and any(kind in _VERSION_BOUND_KINDS for kind in kinds):
+        raise StaleModelError(f"written by scikit-learn {written_by}, {sklearn.__version__} is installed")
+    version_dir = manifest["path"]
+    return _load_model(manifest["model"], version_dir), _load_scaler(manifest["scaler"], version_dir)
+
+
+def save_version(model_dir: str, device_name: str, model, scaler, metadata: Dict,
+                 expected_version: Optional[str] = None) -> Optional[str]:
+    """
+    Write a new version of a device's model and make it current
+
+    Keeps the last MODEL_VERSIONS_KEPT versions.
+
+    Args:
+        expected_version: Only write if this is still the current version
+            (an update derived from it), None to write unconditionally
+
+    Returns:
+        Name of the new version, or None if expected_version is no longer current
+    """
+    device_dir = _device_dir(model_dir, device_name)
+    with _write_lock:
+        if expected_version is not None and current_version(model_dir, device_name) != expected_version:
+            return None
+        os.makedirs(device_dir, exist_ok=True)
+        versions = _versions(device_dir)
+        version = f"v{(int(versions[-1][1:]) + 1 if versions else 1):06d}"
+        staging = os.path.join(device_dir, f".{version}.tmp")
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+
+        arrays: Dict[str, np.ndarray] = {}
+        manifest = {
+            "format": FORMAT_VERSION,
+            "device_name": device_name,
+            "version": version,
+            "created_at": datetime.now().isoformat(),
+            "sklearn_version": sklearn.__version__,
+            "model": _encode_model(model, arrays, staging),
+            "scaler": _encode_scaler(scaler, arrays, staging),
+            "metadata": _encode(metadata, arrays),
+        }
+        for name, values in arrays.items():
+            np.save(os.path.join(staging, f"{name}.npy"), np.ascontiguousarray(values))
+        manifest["size_bytes"] = sum(
+            os.path.getsize(os.path.join(staging, name)) for name in os.listdir(staging)
+        )
+        with open(os.path.join(staging, MANIFEST), "w") as f:
+            json.dump(manifest, f)
+
+        os.rename(staging, os.path.join(device_dir, version))
+        pointer = os.path.join(device_dir, CURRENT)
+        with open(pointer + ".tmp", "w") as f:
+            f.write(version)
+        os.replace(pointer + ".tmp", pointer)
+
+        for old in _versions(device_dir)[:-max(settings.MODEL_VERSIONS_KEPT, 1)]:
+            shutil.rmtree(os.path.join(device_dir, old), ignore_errors=True)
+    return version
+
+
+def migrate_legacy(model_dir: str, device_name: str) -> Optional[str]:
+    """Convert a device's flat pickles to a version, None if there are none"""
+    model_path, scaler_path, metadata_path = legacy_paths(model_dir, device_name)
+    if not (os.path.exists(model_path) and os.path.exists(scaler_path)):
+        return None
+    try:
+        model = joblib.load(model_path)
+        scaler = joblib.load(scaler_path)
+        metadata = joblib.load(metadata_path) if os.path.exists(metadata_path) else {}
+        version = save_version(model_dir, device_name, model, scaler, metadata)
+    except Exception as e:
+        logger.error(f"Error converting model pickles for {device_name}: {e}")
+        return None
+    logger.info(f"Converted model pickles for {device_name} to {version}")
+    return version
+
+
+def _versions(device_dir: str) -> List[str]:
+    return sorted(name for name in os.listdir(device_dir) if name.startswith("v") and name[1:].isdigit())
+
+
+def _class_path(obj) -> str:
+    return f"{type(obj).__module__.split('._')[0]}.{type(obj).__name__}"
+
+
+def _encode_model(model, arrays: Dict, directory: str) -> Dict:
+    from sklearn.dummy import DummyRegressor
+    from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+
+    if isinstance(model, TreeEnsemble):
+        arrays.update(tree_nodes=model.nodes, tree_values=model.values, trees=model.trees)
+        return {"kind": model.kind, "algorithm": model.algorithm, "n_features": model.n_features_in_,
+                "base": model.base, "learning_rate": model.learning_rate}
+
+    if isinstance(model, RandomForestRegressor) and model.n_outputs_ == 1:
+        _encode_trees([estimator.tree_ for estimator in model.estimators_], arrays)
+        return {"kind": "forest", "algorithm": type(model).__name__, "n_features": int(model.n_features_in_),
+                "base": 0.0, "learning_rate": 1.0}
+
+    init = getattr(model, "init_", None)
+    if (isinstance(model, GradientBoostingRegressor)
+            and (init == "zero" or (isinstance(init, DummyRegressor) and np.size(init.constant_) == 1))):
+        _encode_trees([estimator.tree_ for estimator in model.estimators_[:, 0]], arrays)
+        base = 0.0 if init == "zero" else float(np.ravel(init.constant_)[0])
+        return {"kind": "boosting", "algorithm": type(model).__name__, "n_features": int(model.n_features_in_),
+                "base": base, "learning_rate": float(model.learning_rate)}
+
+    if _class_path(model) in _LINEAR_MODELS and np.ndim(model.coef_) == 1:
+        arrays["coef"] = np.asarray(model.coef_, dtype=float)
+        return {"kind": "linear", "class": _class_path(model), "params": _encode(model.get_params(), arrays),
+                "intercept": float(model.intercept_), "n_features": int(model.n_features_in_)}
+
+    joblib.dump(model, os.path.join(directory, "model.joblib"))
+    return {"kind": "pickle", "class": _class_path(model)}
+
+
+def _encode_trees(trees, arrays: Dict):
+    states = [tree.__getstate__() for tree in trees]
+    arrays["tree_nodes"] = np.concatenate([state["nodes"] for state in states])
+    arrays["tree_values"] = np.concatenate([state["values"] for state in states])
+    arrays["trees"] = np.array([[state["node_count"], state["max_depth"]] for state in states], dtype=np.int64)
+
+
+def _load_model(spec: Dict, directory: str):
+    kind = spec["kind"]
+    if kind in ("forest", "boosting"):
+        def load(name):
+            return np.load(os.path.join(directory, f"{name}.npy"), mmap_mode='r')
+        return TreeEnsemble(kind, spec["algorithm"], spec["n_features"], load("tree_nodes"),
+                            load("tree_values"), load("trees"), spec["base"], spec["learning_rate"])
+
+    if kind == "linear":
+        module, name = _LINEAR_MODELS[spec["class"]]
+        model = getattr(importlib.import_module(module), name)(**_decode(spec["params"], directory))
+        model.coef_ = np.load(os.path.join(directory, "coef.npy"), mmap_mode='r')
+        model.intercept_ = spec["intercept"]
+        model.n_features_in_ = spec["n_features"]
+        return model
+
+    return joblib.load(os.path.join(directory, "model.joblib"))
+
+
+def _encode_scaler(scaler, arrays: Dict, directory: str) -> Dict:
+    from sklearn.preprocessing import StandardScaler
+
+    if type(scaler) is StandardScaler and np.ndim(scaler.n_samples_seen_) == 0:
+        for name in ("mean_", "var_", "scale_"):
+            if getattr(scaler, name, None) is not None:
+                arrays[f"scaler_{name.rstrip('_')}"] = np.asarray(getattr(scaler, name), dtype=float)
+        return {"kind": "standard", "params": scaler.get_params(),
+                "n_samples_seen": int(scaler.n_samples_seen_), "n_features": int(scaler.n_features_in_)}
+
+    joblib.dump(scaler, os.path.join(directory, "scaler.joblib"))
+    return {"kind": "pickle", "class": _class_path(scaler)}
+
+
+def _load_scaler(spec: Dict, directory: str):
+    from sklearn.preprocessing import StandardScaler
+
+    if spec["kind"] != "standard":
+        return joblib.load(os.path.join(directory, "scaler.joblib"))
+
+    scaler = StandardScaler(**spec["params"])
+    for name in ("mean_", "var_", "scale_"):
+        path = os.path.join(directory, f"scaler_{name.rstrip('_')}.npy")
+        setattr(scaler, name, np.load(path, mmap_mode='r') if os.path.exists(path) else None)
+    scaler.n_samples_seen_ = np.int64(spec["n_samples_seen"])
+    scaler.n_features_in_ = spec["n_features"]
+    return scaler
+
+
+def _encode(value, arrays: Dict):
+    """JSON form of metadata; arrays are stored as .npy files next to the manifest"""
+    if isinstance(value, (datetime, pd.Timestamp)):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, np.ndarray):
+        name = f"meta_{len([key for key in arrays if key.startswith('meta_')])}"
+        arrays[name] = value
+        return {"__array__": name}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, dict):
+        if all(isinstance(key, str) for key in value):
+            return {key: _encode(item, arrays) for key, item in value.items()}
+        # Non-string keys (e.g. hour of day) would become strings in JSON
+        return {"__items__": [[_encode(key, arrays), _encode(item, arrays)] for key, item in value.items()]}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item, arrays) for item in value]
+    return value
+
+
+def _decode(value, directory: str):
+    if isinstance(value, dict):
+        if "__datetime__" in value:
+            return datetime.fromisoformat(value["__datetime__"])
+        if "__array__" in value:
+            return np.load(os.path.join(directory, f"{value['__array__']}.npy"), mmap_mode='r')
+        if "__items__" in value:
+            return {_decode(key, directory): _decode(item, directory) for key, item in value["__items__"]}
+        return {key: _decode(item, directory) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_decode(item, directory) for item in value]
+    return value
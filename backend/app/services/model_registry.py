@@ -0,0 +1,196 @@
+"""
+Model Registry
+
+Process-wide cache of trained model artifacts (model, scaler, metadata).
+Each device's current version is loaded once and shared by every MLService
+instance, so prediction requests do not hit the disk in steady state.
+Manifests are cached separately, so listing models never loads a model.
+
+Artifacts are hot-swapped after retraining: MLService saves a freshly
+trained model through the registry, and versions written by other
+processes are picked up by re-reading the device's CURRENT pointer at most
+every MODEL_REGISTRY_CHECK_INTERVAL seconds. Memory is bounded by
+MODEL_REGISTRY_MAX_BYTES (estimated from the artifact sizes) with
+least-recently-used eviction.
+"""
+from dataclasses import dataclass, field
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import logging
+import os
+import threading
+import time
+
+from config import settings
+from services.forecasting import prepare_for_inference
+from services.model_artifacts import (
+    StaleModelError, current_version, load_version, migrate_legacy, read_manifest, save_version
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ModelArtifacts:
+    """Loaded artifacts of one device"""
+    model: object
+    scaler: object
+    metadata: Dict
+    version: str  # Artifact version these were loaded from
+    size_bytes: int
+    checked_at: float = field(default_factory=time.monotonic)
+
+
+class ModelRegistry:
+    """Thread-safe LRU cache of ModelArtifacts keyed by model directory and device"""
+
+    def __init__(self, max_bytes: int, check_interval: float):
+        self.max_bytes = max_bytes
+        self.check_interval = check_interval
+        self._entries: "OrderedDict[Tuple[str, str], ModelArtifacts]" = OrderedDict()
+        # (manifest, checked_at); manifests are small, so all of them are kept
+        self._manifests: Dict[Tuple[str, str], Tuple[Dict, float]] = {}
+        self._lock = threading.Lock()
+        # One lock per key so a device is loaded once even under concurrent requests
+        self._load_locks: Dict[Tuple[str, str], threading.RLock] = {}
+        self.loads = 0
+        self.hits = 0
+        self.evictions = 0
+
+    def manifest(self, model_dir: str, device_name: str) -> Optional[Dict]:
+        """
+        Manifest of a device's current model version (metrics, feature names, ...)
+
+        Returns:
+            Manifest dict with decoded "metadata", or None if no trained model exists
+        """
+        key = (os.path.abspath(model_dir), device_name)
+        with self._lock:
+            cached = self._manifests.get(key)
+            if cached is not None and time.monotonic() - cached[1] < self.check_interval:
+                return cached[0]
+            load_lock = self._load_locks.setdefault(key, threading.RLock())
+
+        with load_lock:
+            version = current_version(key[0], device_name)
+            if version is None:
+                version = migrate_legacy(key[0], device_name)
+            if version is None:
+                with self._lock:
+                    self._manifests.pop(key, None)
+                return None
+            if cached is not None and cached[0]["version"] == version:
+                manifest = cached[0]
+            else:
+                manifest = read_manifest(key[0], device_name)
+                if manifest is None:
+                    return None
+            with self._lock:
+                self._manifests[key] = (manifest, time.monotonic())
+            return manifest
+
+    def get(self, model_dir: str, device_name: str) -> Optional[ModelArtifacts]:
+        """
+        Artifacts of a device, loading them on first use or after a new version was saved
+
+        Returns:
+            ModelArtifacts, or None if no trained model exists
+        """
+        key = (os.path.abspath(model_dir), device_name)
+        with self._lock:
+            artifacts = self._entries.get(key)
+            if artifacts is not None and time.monotonic() - artifacts.checked_at < self.check_interval:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return artifacts
+            load_lock = self._load_locks.setdefault(key, threading.RLock())
+
+        with load_lock:
+            manifest = self.manifest(key[0], device_name)
+            with self._lock:
+                current = self._entries.get(key)
+                if manifest is None:
+                    self._entries.pop(key, None)
+                    return None
+                if current is not None and current.version == manifest["version"]:
+                    current.checked_at = time.monotonic()
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return current
+
+            try:
+                model, scaler = load_version(manifest)
+            except StaleModelError as e:
+                # Treated as missing, so predictions queue a retrain
+                logger.warning(f"Model {device_name} {manifest['version']} is stale ({e}), retraining required")
+                return None
+            except Exception as e:
+                logger.error(f"Error loading model for {device_name}: {e}")
+                return None
+
+            artifacts = ModelArtifacts(prepare_for_inference(model), scaler, manifest["metadata"],
+                                       manifest["version"], manifest["size_bytes"])
+            with self._lock:
+                self.loads += 1
+                self._store(key, artifacts)
+            logger.info(f"Loaded model {device_name} {manifest['version']} ({manifest['size_bytes'] / 1e6:.1f} MB)")
+            return artifacts
+
+    def save(self, model_dir: str, device_name: str, model, scaler, metadata: Dict,
+             expected_version: Optional[str] = None) -> Optional[str]:
+        """
+        Write a new model version to model_dir and swap it in
+
+        Args:
+            expected_version: Only save if this is still the current version
+                (see save_version), None to save unconditionally
+
+        Returns:
+            Name of the new version, or None if expected_version is no longer current
+        """
+        key = (os.path.abspath(model_dir), device_name)
+        version = save_version(key[0], device_name, model, scaler, metadata, expected_version)
+        if version is None:
+            return None
+        manifest = read_manifest(key[0], device_name)
+        with self._lock:
+            self._manifests[key] = (manifest, time.monotonic())
+            self._store(key, ModelArtifacts(prepare_for_inference(model), scaler, metadata,
+                                            version, manifest["size_bytes"]))
+        return version
+
+    def invalidate(self, model_dir: Optional[str] = None, device_name: Optional[str] = None):
+        """Drop cached artifacts and manifests (all, one directory, or one device)"""
+        with self._lock:
+            for cache in (self._entries, self._manifests):
+                for key in list(cache):
+                    if model_dir is not None and key[0] != os.path.abspath(model_dir):
+                        continue
+                    if device_name is not None and key[1] != device_name:
+                        continue
+                    del cache[key]
+
+    def _store(self, key: Tuple[str, str], artifacts: ModelArtifacts):
+        # Caller holds self._lock
+        self._entries[key] = artifacts
+        self._entries.move_to_end(key)
+        total = sum(entry.size_bytes for entry in self._entries.values())
+        while total > self.max_bytes and len(self._entries) > 1:
+            evicted_key, evicted = self._entries.popitem(last=False)
+            total -= evicted.size_bytes
+            self.evictions += 1
+            logger.info(f"Evicted model artifacts for {evicted_key[1]} (registry over {self.max_bytes / 1e6:.0f} MB)")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "models": [key[1] for key in self._entries],
+                "size_bytes": sum(entry.size_bytes for entry in self._entries.values()),
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "hits": self.hits,
+                "evictions": self.evictions
+            }
+
+
+model_registry = ModelRegistry(settings.MODEL_REGISTRY_MAX_BYTES, settings.MODEL_REGISTRY_CHECK_INTERVAL)
@@ -0,0 +1,107 @@
+"""
+Online Model Updates
+
+Keeps trained models current from the readings that arrived since they
+were last updated, without refetching the training window.
+
+Ridge models are updated exactly: the metadata carries the count, means
+and centered co-moment matrix of the raw [features, target] rows the model
+was fitted on. New rows are merged in with the parallel (Chan et al.)
+update and the ridge system is re-solved in the scaled feature space,
+which gives the same coefficients as refitting on all rows seen so far.
+Models with partial_fit (SGD, passive-aggressive) are updated with it.
+Hourly fallback averages are maintained from running sums and counts.
+"""
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+def moments(X: np.ndarray, y: np.ndarray) -> Dict:
+    """Count, mean and centered co-moment matrix of the rows [X, y]"""
+    data = np.column_stack([np.asarray(X, dtype=float), np.asarray(y, dtype=float)])
+    mean = data.mean(axis=0)
+    centered = data - mean
+    return {"n": len(data), "mean": mean, "comoment": centered.T @ centered}
+
+
+def merge_moments(a: Dict, b: Dict) -> Dict:
+    """Moments of the union of two row sets"""
+    n = a["n"] + b["n"]
+    if not a["n"] or not b["n"]:
+        return dict(a if a["n"] else b)
+    delta = b["mean"] - a["mean"]
+    return {
+        "n": n,
+        "mean": a["mean"] + delta * (b["n"] / n),
+        "comoment": a["comoment"] + b["comoment"] + np.outer(delta, delta) * (a["n"] * b["n"] / n),
+    }
+
+
+def ridge_from_moments(stats: Dict, scaler, alpha: float) -> Tuple[np.ndarray, float]:
+    """
+    Ridge coefficients and intercept for features scaled by scaler
+
+    Solves (Zc'Zc + alpha I) w = Zc'yc for Z = (X - mean_) / scale_, which
+    is what Ridge(fit_intercept=True).fit(Z, y) computes.
+    """
+    scale = np.asarray(scaler.scale_, dtype=float)
+    comoment = stats["comoment"]
+    gram = comoment[:-1, :-1] / np.outer(scale, scale)
+    target = comoment[:-1, -1] / scale
+    coef = np.linalg.solve(gram + alpha * np.eye(len(scale)), target)
+
+    mean_z = (stats["mean"][:-1] - np.asarray(scaler.mean_, dtype=float)) / scale
+    intercept = float(stats["mean"][-1] - mean_z @ coef)
+    return coef, intercept
+
+
+def supports_update(model) -> bool:
+    from sklearn.linear_model import Ridge
+
+    return type(model) is Ridge or hasattr(model, "partial_fit")
+
+
+def apply_update(model, scaler, stats: Optional[Dict], X_new: np.ndarray, y_new: np.ndarray) -> Optional[Dict]:
+    """
+    Fold new raw feature rows into scaler and model in place
+
+    Args:
+        model: Fitted Ridge, or an estimator with partial_fit
+        scaler: Fitted StandardScaler the model's inputs are scaled with
+        stats: Moments of the rows the model was fitted on (required for Ridge)
+        X_new, y_new: New rows, unscaled
+
+    Returns:
+        Updated moments (None when the model does not use them)
+    """
+    scaler.partial_fit(X_new)
+
+    if hasattr(model, "partial_fit"):
+        model.partial_fit(scaler.transform(X_new), y_new)
+        return None
+
+    stats = merge_moments(stats, moments(X_new, y_new))
+    coef, intercept = ridge_from_moments(stats, scaler, model.alpha)
+    model.coef_ = coef
+    model.intercept_ = intercept
+    return stats
+
+
+def hourly_totals(timestamps: pd.Series, values: np.ndarray) -> Tuple[Dict[int, float], Dict[int, int]]:
+    """Per-hour-of-day sums and counts of consumption values"""
+    grouped = pd.Series(np.asarray(values, dtype=float)).groupby(pd.to_datetime(timestamps).dt.hour.values)
+    return (
+        {int(hour): float(total) for hour, total in grouped.sum().items()},
+        {int(hour): int(count) for hour, count in grouped.count().items()},
+    )
+
+
+def merge_hourly(sums: Dict[int, float], counts: Dict[int, int],
+                 new_sums: Dict[int, float], new_counts: Dict[int, int]) -> Tuple[Dict[int, float], Dict[int, int]]:
+    sums, counts = dict(sums), dict(counts)
+    for hour, total in new_sums.items():
+        sums[hour] = sums.get(hour, 0.0) + total
+        counts[hour] = counts.get(hour, 0) + new_counts[hour]
+    return sums, counts
@@ -0,0 +1,309 @@
+"""
+Parallel Model Training
+
+Selects and fits each device's model over a process pool. Every (device,
+algorithm, CV fold) combination is an independent task, as is the final
+fit of the selected algorithm, so retraining all devices keeps every core
+busy instead of fitting one model after another.
+
+Selection is time-series cross-validation with successive halving:
+candidates are scored on TimeSeriesSplit folds (each fold validates on
+hours after the ones it trains on), FOLDS_PER_RUNG folds at a time, and
+after each rung only the better half by mean CV R² goes on. The test
+split is never used for selection; it only reports the winner's metrics.
+A device stops early once its fits have used ML_SELECTION_BUDGET seconds.
+
+The scaled train/test arrays of each device are written once to .npy files
+in a temporary directory; tasks only receive the file paths and open them
+memory-mapped, so all candidates and folds share one copy in the page
+cache. Fold scores are cached per data version (a hash of the training
+arrays), so retraining on unchanged data skips cross-validation.
+"""
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+import hashlib
+import logging
+import math
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
+from sklearn.linear_model import Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import TimeSeriesSplit
+
+logger = logging.getLogger(__name__)
+
+CV_FOLDS = 5
+# Folds scored by every remaining candidate before the worse half is dropped
+FOLDS_PER_RUNG = 2
+# Fold index of the task that fits on the whole training split
+FULL_FIT = -1
+# Cached (data version, algorithm, fold) scores kept in process
+SCORE_CACHE_SIZE = 4096
+
+_score_cache: "OrderedDict[Tuple[str, str, int], float]" = OrderedDict()
+_score_cache_lock = threading.Lock()
+
+
+def candidate_models(n_jobs: int = -1) -> Dict:
+    """Algorithms compared for every device, in order of preference on ties"""
+    return {
+        'RandomForest': RandomForestRegressor(
+            n_estimators=100,
+            max_depth=10,
+            min_samples_split=5,
+            min_samples_leaf=2,
+            random_state=42,
+            n_jobs=n_jobs
+        ),
+        'GradientBoosting': GradientBoostingRegressor(
+            n_estimators=100,
+            max_depth=5,
+            learning_rate=0.1,
+            random_state=42
+        ),
+        'Ridge': Ridge(alpha=1.0)
+    }
+
+
+@dataclass
+class Selection:
+    """Outcome of model selection for one device"""
+    algorithm: Optional[str]
+    model: Any
+    # {algorithm: {"cv_r2_mean", "cv_folds"}}, plus test metrics for the winner
+    results: Dict[str, Dict]
+    stopped: str  # "halving", "folds", "budget" or "error" (nothing trained)
+    fit_seconds: float = 0.0
+    cached_scores: int = 0
+
+    def summary(self) -> Dict:
+        return {
+            "stopped": self.stopped,
+            "fit_seconds": round(self.fit_seconds, 3),
+            "cached_scores": self.cached_scores
+        }
+
+
+@dataclass
+class _Candidates:
+    # Selection state of one device between rungs
+    device_name: str
+    paths: Dict[str, str]
+    version: str
+    alive: List[str]
+    scores: Dict[str, Dict[int, float]] = field(default_factory=dict)
+    next_fold: int = 0
+    fit_seconds: float = 0.0
+    cached_scores: int = 0
+    stopped: Optional[str] = None
+
+    def mean_score(self, algorithm: str) -> float:
+        return float(np.mean(list(self.scores[algorithm].values())))
+
+
+def data_version(arrays: Dict) -> str:
+    """Hash of a device's training arrays; scores are only reused for identical data"""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{CV_FOLDS}".encode())
+    for name in ("X_train", "y_train"):
+        values = np.ascontiguousarray(arrays[name], dtype=float)
+        digest.update(str(values.shape).encode())
+        digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def _cached_score(key: Tuple[str, str, int]) -> Optional[float]:
+    with _score_cache_lock:
+        score = _score_cache.get(key)
+        if score is not None:
+            _score_cache.move_to_end(key)
+        return score
+
+
+def _cache_score(key: Tuple[str, str, int], score: float):
+    with _score_cache_lock:
+        _score_cache[key] = score
+        _score_cache.move_to_end(key)
+        while len(_score_cache) > SCORE_CACHE_SIZE:
+            _score_cache.popitem(last=False)
+
+
+def _array_paths(directory: str, index: int) -> Dict[str, str]:
+    # Files are named by position, device names are not safe as file names
+    return {name: os.path.join(directory, f"{index}.{name}.npy")
+            for name in ("X_train", "y_train", "X_test", "y_test")}
+
+
+def _fit_task(paths: Dict[str, str], algorithm: str, fold: int) -> Dict:
+    """
+    Pool task: one CV fold, or the full fit plus test metrics, of one algorithm
+
+    Returns:
+        {"r2", "seconds"} for a CV fold, {"model", "metrics", "seconds"} for
+        the full fit, {"error", "seconds"} if fitting failed
+    """
+    started = time.perf_counter()
+    try:
+        X_train = np.load(paths["X_train"], mmap_mode='r')
+        y_train = np.load(paths["y_train"], mmap_mode='r')
+        # Workers already run one task per core
+        model = clone(candidate_models(n_jobs=1)[algorithm])
+
+        if fold != FULL_FIT:
+            # Expanding window: train on the hours before the validation block
+            train_index, val_index = list(TimeSeriesSplit(n_splits=CV_FOLDS).split(X_train))[fold]
+            model.fit(X_train[train_index], y_train[train_index])
+            score = r2_score(y_train[val_index], model.predict(X_train[val_index]))
+            return {"r2": float(score), "seconds": time.perf_counter() - started}
+
+        X_test = np.load(paths["X_test"], mmap_mode='r')
+        y_test = np.load(paths["y_test"], mmap_mode='r')
+        model.fit(X_train, y_train)
+        y_pred_test = model.predict(X_test)
+        return {
+            "model": model,
+            "metrics": {
+                'test_r2': r2_score(y_test, y_pred_test),
+                'test_mae': mean_absolute_error(y_test, y_pred_test),
+                'test_rmse': np.sqrt(mean_squared_error(y_test, y_pred_test))
+            },
+            "seconds": time.perf_counter() - started
+        }
+    except Exception as e:
+        return {"error": str(e), "seconds": time.perf_counter() - started}
+
+
+def _rung_tasks(state: _Candidates) -> List[Tuple[_Candidates, str, int]]:
+    """Uncached fold fits of a device's next rung; cached folds are filled in directly"""
+    if state.stopped:
+        return []
+    tasks = []
+    for fold in range(state.next_fold, min(state.next_fold + FOLDS_PER_RUNG, CV_FOLDS)):
+        for algorithm in state.alive:
+            score = _cached_score((state.version, algorithm, fold))
+            if score is None:
+                tasks.append((state, algorithm, fold))
+            else:
+                state.scores.setdefault(algorithm, {})[fold] = score
+                state.cached_scores += 1
+    return tasks
+
+
+def _end_rung(state: _Candidates, budget: float):
+    """Keep the better half of the candidates, or stop the device"""
+    state.next_fold = min(state.next_fold + FOLDS_PER_RUNG, CV_FOLDS)
+    state.alive = [algorithm for algorithm in state.alive if algorithm in state.scores]
+    if not state.alive:
+        state.stopped = "error"
+        return
+
+    # Stable sort: ties keep candidate_models order
+    ranked = sorted(state.alive, key=lambda algorithm: -state.mean_score(algorithm))
+    if budget and state.fit_seconds >= budget:
+        state.alive, state.stopped = ranked[:1], "budget"
+    elif state.next_fold >= CV_FOLDS:
+        state.alive, state.stopped = ranked[:1], "folds"
+    else:
+        state.alive = ranked[:math.ceil(len(ranked) / 2)]
+        if len(state.alive) == 1:
+            state.stopped = "halving"
+
+
+def _selection(state: _Candidates, output: Optional[Dict]) -> Selection:
+    results = {
+        algorithm: {'cv_r2_mean': state.mean_score(algorithm), 'cv_folds': len(scores)}
+        for algorithm, scores in state.scores.items()
+    }
+    algorithm, model = None, None
+    if output is not None:
+        state.fit_seconds += output["seconds"]
+        if "error" in output:
+            logger.error(f"Error training {state.alive[0]} for {state.device_name}: {output['error']}")
+        else:
+            algorithm, model = state.alive[0], output["model"]
+            results[algorithm].update(output["metrics"])
+    return Selection(algorithm, model, results, state.stopped, state.fit_seconds, state.cached_scores)
+
+
+def select_models(
+    training_sets: Dict[str, Dict],
+    workers: int = -1,
+    budget: float = 0.0,
+    on_device: Optional[Callable[[str, Selection], None]] = None
+) -> Dict[str, Selection]:
+    """
+    Select and fit the best candidate algorithm for several devices
+
+    Args:
+        training_sets: {device: {"X_train", "y_train", "X_test", "y_test"}}
+            (scaled, training rows in chronological order)
+        workers: Worker processes, -1 for one per CPU core
+        budget: Seconds of fitting per device before selection stops with
+            the folds scored so far, 0 for no limit
+        on_device: Called with (device, selection) as soon as a device's
+            selected model has been fitted
+
+    Returns:
+        {device: Selection}; algorithm and model are None if every
+        candidate failed to train
+    """
+    algorithms = list(candidate_models())
+    selected: Dict[str, Selection] = {}
+
+    with tempfile.TemporaryDirectory(prefix="ml-training-") as directory:
+        states = []
+        for index, (device_name, arrays) in enumerate(training_sets.items()):
+            paths = _array_paths(directory, index)
+            for name, path in paths.items():
+                np.save(path, np.ascontiguousarray(arrays[name], dtype=float))
+            states.append(_Candidates(device_name, paths, data_version(arrays), list(algorithms)))
+
+        # One rung of every device per round, so the pool stays full
+        while any(not state.stopped for state in states):
+            tasks = [task for state in states for task in _rung_tasks(state)]
+            if tasks:
+                logger.info(f"Scoring {len(tasks)} CV fold(s) on {workers} worker(s)")
+                outputs = Parallel(n_jobs=workers)(
+                    delayed(_fit_task)(state.paths, algorithm, fold) for state, algorithm, fold in tasks
+                )
+                for (state, algorithm, fold), output in zip(tasks, outputs):
+                    state.fit_seconds += output["seconds"]
+                    if algorithm not in state.alive:
+                        continue  # Dropped after an error on another fold
+                    if "error" in output:
+                        logger.error(f"Error training {algorithm} for {state.device_name}: {output['error']}")
+                        state.alive.remove(algorithm)
+                        state.scores.pop(algorithm, None)
+                        continue
+                    state.scores.setdefault(algorithm, {})[fold] = output["r2"]
+                    _cache_score((state.version, algorithm, fold), output["r2"])
+            for state in states:
+                if not state.stopped:
+                    _end_rung(state, budget)
+
+        for state in states:
+            if state.stopped == "error":
+                selected[state.device_name] = _selection(state, None)
+                if on_device is not None:
+                    on_device(state.device_name, selected[state.device_name])
+        finals = [state for state in states if state.stopped != "error"]
+
+        # Results arrive in order, so a device can be saved while later
+        # ones are still fitting
+        outputs = Parallel(n_jobs=workers, return_as="generator")(
+            delayed(_fit_task)(state.paths, state.alive[0], FULL_FIT) for state in finals
+        )
+        for state, output in zip(finals, outputs):
+            selected[state.device_name] = _selection(state, output)
+            if on_device is not None:
+                on_device(state.device_name, selected[state.device_name])
+
+    return selected
@@ -0,0 +1,207 @@
+"""
+Partition Maintenance Service
+
+energy_consumption is range-partitioned by timestamp (see postgres/init.sql).
+This service creates partitions ahead of time and applies the raw-data
+retention policy: once a partition is older than RAW_RETENTION_DAYS and its
+rows are fully represented in the hourly rollups, it is dropped or moved to
+the archive schema.
+"""
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import logging
+import re
+
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from config import settings
+from services.rollup_service import RollupService
+
+logger = logging.getLogger(__name__)
+
+PARENT_TABLE = "energy_consumption"
+DEFAULT_PARTITION = "energy_consumption_default"
+ARCHIVE_SCHEMA = "archive"
+
+_BOUND_PATTERN = re.compile(r"FROM \('([^']+)'\) TO \('([^']+)'\)")
+
+
+def _period_start(day: date, interval: str) -> date:
+    if interval == "week":
+        return day - timedelta(days=day.weekday())
+    return day.replace(day=1)
+
+
+def _next_period(start: date, interval: str) -> date:
+    if interval == "week":
+        return start + timedelta(days=7)
+    return (start.replace(day=28) + timedelta(days=4)).replace(day=1)
+
+
+def partition_name(start: date) -> str:
+    return f"{PARENT_TABLE}_p{start.strftime('%Y%m%d')}"
+
+
+class PartitionService:
+    """Creates and retires energy_consumption partitions"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def is_partitioned(self) -> bool:
+        return self.db.execute(text("""
+            SELECT 1
+            FROM pg_partitioned_table pt
+            JOIN pg_class c ON c.oid = pt.partrelid
+            WHERE c.relname = :table
+        """), {"table": PARENT_TABLE}).first() is not None
+
+    def list_partitions(self) -> List[Dict]:
+        """Range partitions of energy_consumption, oldest first"""
+        rows = self.db.execute(text("""
+            SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)
+            FROM pg_inherits
+            JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+            JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+            WHERE parent.relname = :table
+        """), {"table": PARENT_TABLE}).fetchall()
+
+        partitions = []
+        for name, bound in rows:
+            match = _BOUND_PATTERN.search(bound or "")
+            if not match:
+                continue  # DEFAULT partition
+            partitions.append({
+                "name": name,
+                "start": datetime.fromisoformat(match.group(1)),
+                "end": datetime.fromisoformat(match.group(2)),
+            })
+        return sorted(partitions, key=lambda p: p["start"])
+
+    def ensure_partitions(self, interval: Optional[str] = None, ahead: Optional[int] = None) -> List[str]:
+        """
+        Create partitions for the current period and `ahead` future periods
+
+        Rows that already landed in the default partition for a new range
+        are moved into the new partition before it is attached.
+
+        Returns:
+            Names of the partitions that were created
+        """
+        interval = interval or settings.PARTITION_INTERVAL
+        ahead = settings.PARTITION_PREMAKE if ahead is None else ahead
+        existing = [(p["start"].date(), p["end"].date()) for p in self.list_partitions()]
+
+        created = []
+        start = _period_start(datetime.utcnow().date(), interval)
+        for _ in range(ahead + 1):
+            end = _next_period(start, interval)
+            # Skip ranges already (partly) covered, e.g. after switching interval
+            if not any(lower < end and upper > start for lower, upper in existing):
+                self._create_partition(start, end)
+                created.append(partition_name(start))
+            start = end
+
+        if created:
+            logger.info(f"Created partitions: {', '.join(created)}")
+        return created
+
+    def _create_partition(self, start: date, end: date):
+        name = partition_name(start)
+        bounds = {"start": datetime.combine(start, datetime.min.time()),
+                  "end": datetime.combine(end, datetime.min.time())}
+        bound_sql = f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+
+        has_default_rows = self.db.execute(text(f"""
+            SELECT 1 FROM {DEFAULT_PARTITION}
+            WHERE timestamp >= :start AND timestamp < :end
+            LIMIT 1
+        """), bounds).first() is not None
+
+        if not has_default_rows:
+            self.db.execute(text(f"CREATE TABLE {name} PARTITION OF {PARENT_TABLE} {bound_sql}"))
+        else:
+            # Attaching would fail while the default partition holds rows of
+            # this range, so move them over first
+            self.db.execute(text(f"CREATE TABLE {name} (LIKE {PARENT_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+            self.db.execute(text(f"""
+                WITH moved AS (
+                    DELETE FROM {DEFAULT_PARTITION}
+                    WHERE timestamp >= :start AND timestamp < :end
+                    RETURNING *
+                )
+                INSERT INTO {name} SELECT * FROM moved
+            """), bounds)
+            self.db.execute(text(f"ALTER TABLE {PARENT_TABLE} ATTACH PARTITION {name} {bound_sql}"))
+        self.db.commit()
+
+    def _rollups_cover(self, partition: Dict) -> Tuple[int, int]:
+        """Raw row count of a partition and reading count of its hourly rollups"""
+        raw = self.db.execute(text(f"SELECT COUNT(*) FROM {partition['name']}")).scalar()
+        rolled = self.db.execute(text("""
+            SELECT COALESCE(SUM(reading_count), 0)
+            FROM energy_consumption_hourly
+            WHERE bucket >= :start AND bucket < :end
+        """), {"start": partition["start"], "end": partition["end"]}).scalar()
+        return int(raw), int(rolled)
+
+    def apply_retention(self, retention_days: Optional[int] = None, action: Optional[str] = None) -> List[str]:
+        """
+        Drop or archive raw partitions that ended more than retention_days ago
+
+        A partition is only retired when its hourly rollups account for every
+        raw row; otherwise the rollups for its range are rebuilt first.
+
+        Args:
+            retention_days: Raw data retention, 0 keeps everything
+            action: "drop" or "archive" (detach into the archive schema)
+
+        Returns:
+            Names of the partitions that were retired
+        """
+        retention_days = settings.RAW_RETENTION_DAYS if retention_days is None else retention_days
+        action = action or settings.RETENTION_ACTION
+        if retention_days <= 0:
+            return []
+
+        # Partition bounds are naive UTC, like the timestamps they hold
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        retired = []
+        for partition in self.list_partitions():
+            if partition["end"] > cutoff:
+                break
+
+            raw, rolled = self._rollups_cover(partition)
+            if raw != rolled:
+                logger.warning(f"Rollups for {partition['name']} are incomplete ({rolled}/{raw}), rebuilding")
+                RollupService(self.db).rebuild(partition["start"], partition["end"])
+                raw, rolled = self._rollups_cover(partition)
+                if raw != rolled:
+                    logger.error(f"Keeping {partition['name']}: rollups still incomplete ({rolled}/{raw})")
+                    continue
+
+            if action == "archive":
+                self.db.execute(text(f"CREATE SCHEMA IF NOT EXISTS {ARCHIVE_SCHEMA}"))
+                self.db.execute(text(f"ALTER TABLE {PARENT_TABLE} DETACH PARTITION {partition['name']}"))
+                self.db.execute(text(f"ALTER TABLE {partition['name']} SET SCHEMA {ARCHIVE_SCHEMA}"))
+            else:
+                self.db.execute(text(f"DROP TABLE {partition['name']}"))
+            self.db.commit()
+            retired.append(partition["name"])
+
+        if retired:
+            logger.info(f"Retention ({action}, {retention_days} days): {', '.join(retired)}")
+        return retired
+
+    def run_maintenance(self) -> Dict:
+        """Create upcoming partitions and apply the retention policy"""
+        if not self.is_partitioned():
+            logger.info("energy_consumption is not partitioned, skipping partition maintenance")
+            return {"partitioned": False, "created": [], "retired": []}
+
+        return {
+            "partitioned": True,
+            "created": self.ensure_partitions(),
+            "retired": self.apply_retention()
+        }
@@ -0,0 +1,182 @@
+"""
+Peak Demand
+
+Demand charges bill on the household's highest coincident load over a
+short interval (typically 15 or 30 minutes), which hour-of-day averages
+cannot show. The 5-minute rollups of every device in a window are read
+with one range query and laid out as a device x bin matrix; rolling
+household sums over each window length are differences of one cumulative
+sum. A month of 10-second readings is a month of 5-minute buckets per
+device, so the analysis never touches raw rows.
+
+Peaks are reported per billing month (in the tariff's timezone) as the
+top-N non-overlapping windows with each device's share, together with
+the demand charge of the tariff in effect.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+import logging
+
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from services.rollup_service import naive_utc
+from services.tariff_service import tariffs
+
+logger = logging.getLogger(__name__)
+
+BIN_MINUTES = 5  # Bucket width of energy_consumption_5min, the step of the rolling windows
+WINDOW_MINUTES = (15, 30)  # Rolling windows reported for every billing month
+EPOCH = datetime(1970, 1, 1)
+
+
+def rolling_sums(load: np.ndarray, width: int) -> np.ndarray:
+    """Sum of every run of `width` consecutive bins (last axis)"""
+    if load.shape[-1] < width:
+        return np.zeros(load.shape[:-1] + (0,))
+    totals = np.cumsum(load, axis=-1)
+    totals = np.concatenate([np.zeros(load.shape[:-1] + (1,)), totals], axis=-1)
+    return totals[..., width:] - totals[..., :-width]
+
+
+def top_windows(sums: np.ndarray, candidates: np.ndarray, width: int, top_n: int) -> List[int]:
+    """Start bins of the largest non-overlapping windows among candidate starts"""
+    peaks = []
+    for start in candidates[np.argsort(-sums[candidates], kind='stable')]:
+        if sums[start] <= 0 or len(peaks) == top_n:
+            break
+        # A window within `width` bins of a chosen one is the same load event
+        if all(abs(start - peak) >= width for peak in peaks):
+            peaks.append(int(start))
+    return peaks
+
+
+class PeakDemandService:
+    """Coincident household peaks from the 5-minute rollups"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    def load_matrix(self, start_time: datetime, end_time: datetime) -> Tuple[List[str], np.ndarray, np.ndarray]:
+        """
+        Consumption per device and 5-minute bin, from the 5-minute rollups
+
+        Args:
+            start_time: Window start (naive UTC)
+            end_time: Window end (naive UTC)
+
+        Returns:
+            (device names, bin start times as datetime64[s], kWh matrix of shape (device, bin))
+        """
+        bin_seconds = BIN_MINUTES * 60
+        first_bin = int((start_time - EPOCH).total_seconds() // bin_seconds)
+        window_start = EPOCH + timedelta(seconds=first_bin * bin_seconds)
+        n_bins = int(np.ceil((end_time - window_start).total_seconds() / bin_seconds))
+        # Bin offsets are computed server side; converting datetimes in Python dominates otherwise
+        rows = self.db.execute(text("""
+            SELECT
+                device_name,
+                (EXTRACT(EPOCH FROM bucket - :start_time) / :bin_seconds)::integer,
+                consumption_sum
+            FROM energy_consumption_5min
+            WHERE bucket >= :start_time AND bucket < :end_time
+        """), {"start_time": window_start, "end_time": end_time, "bin_seconds": bin_seconds}).fetchall()
+
+        devices, device_index, bin_index, sums = [], [], np.empty(0, dtype=np.int64), []
+        if rows:
+            names, bin_numbers, sums = zip(*rows)
+            devices, device_index = np.unique(np.array(names, dtype=object).astype(str), return_inverse=True)
+            bin_index = np.array(bin_numbers, dtype=np.int64)
+            n_bins = max(n_bins, int(bin_index.max()) + 1)
+
+        bins = np.datetime64(EPOCH, 's') + (first_bin + np.arange(n_bins)) * np.timedelta64(bin_seconds, 's')
+        matrix = np.zeros((len(devices), n_bins))
+        matrix[device_index, bin_index] = np.array(sums, dtype=float)
+        return [str(name) for name in devices], bins, matrix
+
+    def analyze(self, start_time: datetime, end_time: Optional[datetime] = None, top_n: int = 3) -> Dict:
+        """
+        Top coincident peaks and demand charge per billing month
+
+        Args:
+            start_time: Window start
+            end_time: Window end (default: now)
+            top_n: Peaks reported per billing month and window length
+
+        Returns:
+            Billing periods with their top peaks (kWh, average kW, device shares) and demand charge
+        """
+        start_time = naive_utc(start_time)
+        end_time = naive_utc(end_time) or datetime.utcnow()
+        devices, bins, matrix = self.load_matrix(start_time, end_time)
+        logger.debug(f"Peak analysis over {matrix.shape[1]} bins of {len(devices)} devices")
+        household = matrix.sum(axis=0)
+        bin_step = np.timedelta64(BIN_MINUTES * 60, 's')
+
+        window_sums = {}
+
+        def rolling(minutes: int) -> Tuple[int, np.ndarray]:
+            width = int(np.ceil(minutes / BIN_MINUTES))
+            if width not in window_sums:
+                window_sums[width] = rolling_sums(household, width)
+            return width, window_sums[width]
+
+        def iso(value) -> str:
+            return value.astype(datetime).isoformat()
+
+        def peak(start: int, width: int, sums: np.ndarray) -> Dict:
+            device_kwh = matrix[:, start:start + width].sum(axis=1)
+            return {
+                "start": iso(bins[start]),
+                "end": iso(bins[start] + width * bin_step),
+                "kwh": round(float(sums[start]), 4),
+                "kw": round(float(sums[start]) * 60 / (width * BIN_MINUTES), 3),
+                "devices": [
+                    {
+                        "device_name": devices[index],
+                        "kwh": round(float(device_kwh[index]), 4),
+                        "share": round(float(device_kwh[index] / sums[start]) * 100, 1)
+                    }
+                    for index in np.argsort(-device_kwh, kind='stable') if device_kwh[index] > 0
+                ]
+            }
+
+        # Windows belong to the billing month they start in
+        months = tariffs.billing_months(bins)
+        periods = []
+        for month in np.unique(months):
+            in_month = months == month
+            first, last = np.flatnonzero(in_month)[[0, -1]]
+            period = {
+                "billing_month": str(month),
+                "start": iso(bins[first]),
+                "end": iso(bins[last] + bin_step),
+                "peaks": {}
+            }
+            for minutes in WINDOW_MINUTES:
+                width, sums = rolling(minutes)
+                starts = np.flatnonzero(in_month[:len(sums)])
+                period["peaks"][f"{minutes}min"] = [peak(start, width, sums)
+                                                    for start in top_windows(sums, starts, width, top_n)]
+
+            rate, minutes = tariffs.demand_terms(bins[first].astype(datetime))
+            width, sums = rolling(minutes)
+            starts = np.flatnonzero(in_month[:len(sums)])
+            peak_kw = float(sums[starts].max()) * 60 / (width * BIN_MINUTES) if len(starts) else 0.0
+            period["demand_charge"] = {
+                "window_minutes": minutes,
+                "peak_kw": round(peak_kw, 3),
+                "rate_per_kw": rate,
+                "charge": round(peak_kw * rate, 2)
+            }
+            periods.append(period)
+
+        return {
+            "start": start_time.isoformat(),
+            "end": end_time.isoformat(),
+            "bin_minutes": BIN_MINUTES,
+            "tariff": tariffs.name,
+            "devices": devices,
+            "periods": periods
+        }
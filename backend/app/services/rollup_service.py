@@ -0,0 +1,606 @@
+"""
+Energy Rollup Service
+
+Maintains per-device 5-minute, hourly and daily aggregates of
+energy_consumption (sum, count, min, max and sum of squares) and answers
+analytics queries from them instead of rescanning raw readings.
+
+The rollups are updated in the same transaction as every insert made
+through EnergyService, so the still-open current bucket is always up to
+date and the query layer never has to fall back to raw rows.
+
+Totals (and, in the tariff service, costs) of closed days are memoised in
+process; a write into a closed day forgets that day once its transaction
+commits.
+"""
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+import logging
+import threading
+
+from sqlalchemy import event, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from config import settings
+from models.energy import EnergyConsumptionDaily, EnergyConsumptionFiveMinute, EnergyConsumptionHourly
+
+logger = logging.getLogger(__name__)
+
+# Rollup tables by bucket width
+ROLLUP_TABLES = {
+    "5min": EnergyConsumptionFiveMinute,
+    "hour": EnergyConsumptionHourly,
+    "day": EnergyConsumptionDaily,
+}
+
+# Bucket widths accepted by the series queries (PostgreSQL DATE_TRUNC fields)
+SERIES_GRAINS = ("hour", "day", "week", "month")
+
+
+def naive_utc(timestamp: Optional[datetime]) -> Optional[datetime]:
+    """Timestamps are stored as naive UTC; convert aware values accordingly"""
+    if timestamp is not None and timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return timestamp
+
+
+# Bucket width of each rollup table
+BUCKET_WIDTHS = {
+    "5min": timedelta(minutes=5),
+    "hour": timedelta(hours=1),
+    "day": timedelta(days=1),
+}
+
+# Columns of a rollup row, and the same for a single raw reading
+ROLLUP_COLUMNS = (
+    "bucket, device_name, consumption_sum, consumption_sum_sq, "
+    "consumption_min, consumption_max, reading_count"
+)
+READING_COLUMNS = (
+    "timestamp AS bucket, device_name, consumption AS consumption_sum, "
+    "consumption * consumption AS consumption_sum_sq, consumption AS consumption_min, "
+    "consumption AS consumption_max, 1 AS reading_count"
+)
+
+
+def _truncate(timestamp: datetime, grain: str) -> datetime:
+    if grain == "5min":
+        return timestamp.replace(minute=timestamp.minute - timestamp.minute % 5, second=0, microsecond=0)
+    if grain == "hour":
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _ceil(timestamp: datetime, grain: str) -> datetime:
+    truncated = _truncate(timestamp, grain)
+    return truncated if truncated == timestamp else truncated + BUCKET_WIDTHS[grain]
+
+
+def _window_pieces(
+    start_time: Optional[datetime],
+    end_time: Optional[datetime],
+    grain: str
+) -> List[Tuple[str, Optional[datetime], Optional[datetime]]]:
+    """
+    Split [start_time, end_time) into whole buckets of the coarsest source
+
+    The whole `grain` buckets in the middle are read from their rollup
+    table, the whole 5-minute buckets at either edge from the 5-minute
+    table and what is left of a 5-minute bucket at either end from the raw
+    readings.
+
+    Returns:
+        [(source, piece start, piece end)]; source is a ROLLUP_TABLES key
+        or "raw", and a missing bound is open
+    """
+    head = _ceil(start_time, "5min") if start_time is not None else None
+    tail = _truncate(end_time, "5min") if end_time is not None else None
+    if head is not None and tail is not None:
+        if head > tail:
+            # Both ends fall in the same 5-minute bucket
+            return [("raw", start_time, end_time)]
+        if _ceil(head, grain) >= _truncate(tail, grain):
+            pieces = [("raw", start_time, head), ("5min", head, tail), ("raw", tail, end_time)]
+            return [piece for piece in pieces if piece[1] < piece[2]]
+
+    pieces = [(grain, head and _ceil(head, grain), tail and _truncate(tail, grain))]
+    if start_time is not None:
+        pieces[:0] = [("raw", start_time, head), ("5min", head, pieces[0][1])]
+    if end_time is not None:
+        pieces += [("5min", pieces[-1][2], tail), ("raw", tail, end_time)]
+    return [piece for piece in pieces if piece[1] is None or piece[2] is None or piece[1] < piece[2]]
+
+
+class ClosedDayTotals:
+    """Thread-safe memo of total consumption per closed (UTC) day"""
+
+    def __init__(self):
+        self._totals: Dict[datetime, float] = {}
+        # Bumped on every forget so a read that raced with a write is not stored
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def lookup(self, days: Iterable[datetime]) -> Tuple[Dict[datetime, float], int]:
+        with self._lock:
+            return {day: self._totals[day] for day in days if day in self._totals}, self._generation
+
+    def store(self, totals: Dict[datetime, float], generation: int):
+        with self._lock:
+            if generation == self._generation:
+                self._totals.update(totals)
+
+    def forget(self, days: Optional[Iterable[datetime]] = None):
+        """Drop memoised days (all of them by default)"""
+        with self._lock:
+            self._generation += 1
+            if days is None:
+                self._totals.clear()
+            for day in days or ():
+                self._totals.pop(day, None)
+
+
+closed_day_totals = ClosedDayTotals()
+# Every per-closed-day memo; services memoising other per-day values register theirs
+closed_day_memos: List[ClosedDayTotals] = [closed_day_totals]
+
+
+def forget_closed_days(days: Optional[Iterable[datetime]] = None):
+    """Drop days (all by default) from every closed-day memo"""
+    days = None if days is None else set(days)
+    for memo in closed_day_memos:
+        memo.forget(days)
+
+
+@event.listens_for(Session, "after_commit")
+def _forget_written_days(session: Session):
+    # Closed days written in the transaction, recorded by RollupService.apply
+    days = session.info.pop("rollup_closed_days", None)
+    if days:
+        forget_closed_days(days)
+
+
+class RollupService:
+    """Incremental maintenance and querying of the consumption rollups"""
+
+    def __init__(self, db: Session):
+        self.db = db
+
+    # ------------------------------------------------------------------
+    # Maintenance
+    # ------------------------------------------------------------------
+
+    def apply(self, rows: List[Dict]):
+        """
+        Fold newly inserted readings into the 5-minute, hourly and daily rollups
+
+        Runs inside the caller's transaction and does not commit, so raw rows
+        and rollups become visible together.
+
+        Args:
+            rows: Dicts with device_name, consumption and timestamp
+        """
+        for grain, model in ROLLUP_TABLES.items():
+            buckets = defaultdict(lambda: [0.0, 0.0, None, None, 0])
+            for row in rows:
+                value = float(row["consumption"])
+                agg = buckets[(_truncate(row["timestamp"], grain), row["device_name"])]
+                agg[0] += value
+                agg[1] += value * value
+                agg[2] = value if agg[2] is None else min(agg[2], value)
+                agg[3] = value if agg[3] is None else max(agg[3], value)
+                agg[4] += 1
+
+            if not buckets:
+                return
+
+            if grain == "day":
+                today = _truncate(datetime.utcnow(), "day")
+                closed = {bucket for bucket, _ in buckets if bucket < today}
+                if closed:
+                    forget_closed_days(closed)
+                    self.db.info.setdefault("rollup_closed_days", set()).update(closed)
+
+            # Sorted keys give concurrent writers the same lock order
+            values = [
+                {
+                    "bucket": bucket,
+                    "device_name": device_name,
+                    "consumption_sum": agg[0],
+                    "consumption_sum_sq": agg[1],
+                    "consumption_min": agg[2],
+                    "consumption_max": agg[3],
+                    "reading_count": agg[4],
+                }
+                for (bucket, device_name), agg in sorted(buckets.items())
+            ]
+
+            table = model.__table__
+            stmt = pg_insert(table).values(values)
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[table.c.bucket, table.c.device_name],
+                set_={
+                    "consumption_sum": table.c.consumption_sum + stmt.excluded.consumption_sum,
+                    "consumption_sum_sq": table.c.consumption_sum_sq + stmt.excluded.consumption_sum_sq,
+                    "consumption_min": text(f"LEAST({table.name}.consumption_min, excluded.consumption_min)"),
+                    "consumption_max": text(f"GREATEST({table.name}.consumption_max, excluded.consumption_max)"),
+                    "reading_count": table.c.reading_count + stmt.excluded.reading_count,
+                }
+            )
+            self.db.execute(stmt)
+
+    def rebuild(self, start_time: Optional[datetime] = None, end_time: Optional[datetime] = None) -> int:
+        """
+        Recompute the rollups from raw readings
+
+        Used to backfill after upgrading an existing database or after rows
+        were written without going through EnergyService.
+
+        Args:
+            start_time: Only rebuild buckets from this time on (default: all)
+            end_time: Only rebuild buckets before this time (default: all)
+
+        Returns:
+            Number of hourly buckets written
+        """
+        conditions, params = [], {}
+        if start_time:
+            conditions.append("{column} >= :start_time")
+            params["start_time"] = _truncate(start_time, "day")
+        if end_time:
+            conditions.append("{column} < :end_time")
+            # Whole days only, so no daily bucket is rebuilt from a partial day
+            params["end_time"] = _truncate(end_time - timedelta(microseconds=1), "day") + timedelta(days=1)
+        where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
+
+        self.db.execute(text(f"""
+            INSERT INTO energy_consumption_5min
+                (bucket, device_name, consumption_sum, consumption_sum_sq,
+                 consumption_min, consumption_max, reading_count)
+            SELECT
+                DATE_BIN('5 minutes', timestamp, TIMESTAMP '2000-01-01'),
+                device_name,
+                SUM(consumption),
+                SUM(consumption * consumption),
+                MIN(consumption),
+                MAX(consumption),
+                COUNT(*)
+            FROM energy_consumption
+            {where.format(column="timestamp")}
+            GROUP BY 1, 2
+            ON CONFLICT (bucket, device_name) DO UPDATE SET
+                consumption_sum = EXCLUDED.consumption_sum,
+                consumption_sum_sq = EXCLUDED.consumption_sum_sq,
+                consumption_min = EXCLUDED.consumption_min,
+                consumption_max = EXCLUDED.consumption_max,
+                reading_count = EXCLUDED.reading_count
+        """), params)
+
+        hourly = self.db.execute(text(f"""
+            INSERT INTO energy_consumption_hourly
+                (bucket, device_name, consumption_sum, consumption_sum_sq,
+                 consumption_min, consumption_max, reading_count)
+            SELECT
+                DATE_TRUNC('hour', bucket),
+                device_name,
+                SUM(consumption_sum),
+                SUM(consumption_sum_sq),
+                MIN(consumption_min),
+                MAX(consumption_max),
+                SUM(reading_count)
+            FROM energy_consumption_5min
+            {where.format(column="bucket")}
+            GROUP BY 1, 2
+            ON CONFLICT (bucket, device_name) DO UPDATE SET
+                consumption_sum = EXCLUDED.consumption_sum,
+                consumption_sum_sq = EXCLUDED.consumption_sum_sq,
+                consumption_min = EXCLUDED.consumption_min,
+                consumption_max = EXCLUDED.consumption_max,
+                reading_count = EXCLUDED.reading_count
+        """), params)
+
+        self.db.execute(text(f"""
+            INSERT INTO energy_consumption_daily
+                (bucket, device_name, consumption_sum, consumption_sum_sq,
+                 consumption_min, consumption_max, reading_count)
+            SELECT
+                DATE_TRUNC('day', bucket),
+                device_name,
+                SUM(consumption_sum),
+                SUM(consumption_sum_sq),
+                MIN(consumption_min),
+                MAX(consumption_max),
+                SUM(reading_count)
+            FROM energy_consumption_hourly
+            {where.format(column="bucket")}
+            GROUP BY 1, 2
+            ON CONFLICT (bucket, device_name) DO UPDATE SET
+                consumption_sum = EXCLUDED.consumption_sum,
+                consumption_sum_sq = EXCLUDED.consumption_sum_sq,
+                consumption_min = EXCLUDED.consumption_min,
+                consumption_max = EXCLUDED.consumption_max,
+                reading_count = EXCLUDED.reading_count
+        """), params)
+        self.db.commit()
+        forget_closed_days()
+
+        logger.info(f"Rebuilt {hourly.rowcount} hourly rollup buckets")
+        return hourly.rowcount
+
+    def backfill_if_empty(self) -> int:
+        """Build the rollups once when upgrading a database that has raw data"""
+        # The 5-minute table is the newest, so databases from before it get a full rebuild
+        has_rollups = self.db.execute(text("SELECT 1 FROM energy_consumption_5min LIMIT 1")).first()
+        has_readings = self.db.execute(text("SELECT 1 FROM energy_consumption LIMIT 1")).first()
+        if has_rollups or not has_readings:
+            return 0
+        return self.rebuild()
+
+    # ------------------------------------------------------------------
+    # Query layer
+    # ------------------------------------------------------------------
+
+    def _source(
+        self,
+        start_time: Optional[datetime],
+        end_time: Optional[datetime],
+        grain: Optional[str] = None
+    ):
+        """
+        Pick the rows that cover a window exactly
+
+        Short windows read hourly buckets; long and open-ended windows read
+        daily buckets. Where a window edge does not fall on a bucket
+        boundary, the partial bucket is made up of 5-minute buckets and raw
+        readings (see _window_pieces), so the window is counted to the
+        reading.
+
+        Args:
+            start_time: Window start (default: all data)
+            end_time: Window end (default: open)
+            grain: Coarsest bucket width to read (default: by window length)
+
+        Returns:
+            (FROM item, grain, WHERE condition, parameters); the FROM item has
+            the rollup columns, and `bucket` of a raw reading is its timestamp
+        """
+        start_time, end_time = naive_utc(start_time), naive_utc(end_time)
+        if grain is None:
+            if start_time is None:
+                grain = "day"
+            else:
+                span = (end_time or datetime.utcnow()) - start_time
+                grain = "day" if span > timedelta(days=settings.ROLLUP_DAILY_SOURCE_DAYS) else "hour"
+
+        selects, params = [], {}
+        for index, (source, piece_start, piece_end) in enumerate(_window_pieces(start_time, end_time, grain)):
+            if source == "raw":
+                table, column, columns = "energy_consumption", "timestamp", READING_COLUMNS
+            else:
+                table, column, columns = ROLLUP_TABLES[source].__tablename__, "bucket", ROLLUP_COLUMNS
+            conditions = []
+            if piece_start is not None:
+                conditions.append(f"{column} >= :start_{index}")
+                params[f"start_{index}"] = piece_start
+            if piece_end is not None:
+                conditions.append(f"{column} < :end_{index}")
+                params[f"end_{index}"] = piece_end
+            selects.append((table, columns, " AND ".join(conditions) or "TRUE"))
+
+        if not selects:
+            # Empty window
+            return ROLLUP_TABLES[grain].__tablename__, grain, "FALSE", params
+        if len(selects) == 1 and selects[0][1] == ROLLUP_COLUMNS:
+            table, _, where = selects[0]
+            return table, grain, where, params
+        union = " UNION ALL ".join(f"SELECT {columns} FROM {table} WHERE {where}" for table, columns, where in selects)
+        return f"({union}) AS window_rows", grain, "TRUE", params
+
+    def summary(
+        self,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None,
+        device_name: Optional[str] = None
+    ) -> Dict:
+        """
+        Total, reading count, average, peak and minimum over a window
+
+        Without start_time the summary covers all data, read from the daily
+        rollups, so its cost does not depend on the number of raw readings.
+        """
+        table, _, where, params = self._source(start_time, end_time)
+        if device_name:
+            where += " AND device_name = :device_name"
+            params["device_name"] = device_name
+
+        row = self.db.execute(text(f"""
+            SELECT
+                SUM(consumption_sum),
+                SUM(reading_count),
+                MAX(consumption_max),
+                MIN(consumption_min)
+            FROM {table}
+            WHERE {where}
+        """), params).fetchone()
+
+        total = float(row[0]) if row[0] is not None else 0.0
+        readings = int(row[1]) if row[1] is not None else 0
+        return {
+            "total": total,
+            "readings": readings,
+            "average": total / readings if readings else 0.0,
+            "peak": float(row[2]) if row[2] is not None else 0.0,
+            "minimum": float(row[3]) if row[3] is not None else 0.0,
+        }
+
+    def device_totals(self, start_time: datetime, end_time: Optional[datetime] = None) -> List[Dict]:
+        """Per-device totals over a window, largest consumer first"""
+        table, _, where, params = self._source(start_time, end_time)
+        rows = self.db.execute(text(f"""
+            SELECT
+                device_name,
+                SUM(consumption_sum) AS total,
+                SUM(reading_count) AS readings,
+                MAX(consumption_max) AS peak
+            FROM {table}
+            WHERE {where}
+            GROUP BY device_name
+            ORDER BY total DESC
+        """), params).fetchall()
+
+        return [
+            {
+                "device_name": row[0],
+                "total": float(row[1]),
+                "readings": int(row[2]),
+                "average": float(row[1]) / int(row[2]) if row[2] else 0.0,
+                "peak": float(row[3]) if row[3] is not None else 0.0,
+            }
+            for row in rows
+        ]
+
+    def hourly_rows(
+        self,
+        start_time: Optional[datetime] = None,
+        end_time: Optional[datetime] = None
+    ) -> List[Tuple[str, datetime, float]]:
+        """
+        Per-device hourly consumption over a window, oldest hour first
+
+        The window is cut like the other window queries, so costs computed
+        from these rows add up to their totals.
+
+        Returns:
+            [(device name, hour bucket, consumption)]
+        """
+        table, _, where, params = self._source(start_time, end_time, "hour")
+        rows = self.db.execute(text(f"""
+            SELECT device_name, DATE_TRUNC('hour', bucket) AS hour, SUM(consumption_sum)
+            FROM {table}
+            WHERE {where}
+            GROUP BY hour, device_name
+            ORDER BY hour, device_name
+        """), params).fetchall()
+        return [(row[0], row[1], float(row[2])) for row in rows]
+
+    def series(
+        self,
+        start_time: datetime,
+        grain: str,
+        by_device: bool = False,
+        end_time: Optional[datetime] = None
+    ) -> List[Dict]:
+        """
+        Consumption per time bucket, oldest first
+
+        Args:
+            start_time: Window start
+            grain: Output bucket width (hour, day, week or month)
+            by_device: Also split every bucket by device
+            end_time: Window end (default: now)
+        """
+        if grain not in SERIES_GRAINS:
+            raise ValueError(f"Unsupported grain '{grain}'")
+
+        # Hourly resolution is only available from the hourly table
+        table, _, where, params = self._source(start_time, end_time, "hour" if grain == "hour" else None)
+
+        device_column = "device_name," if by_device else ""
+        rows = self.db.execute(text(f"""
+            SELECT
+                {device_column}
+                DATE_TRUNC('{grain}', bucket) AS period,
+                SUM(consumption_sum) AS total,
+                SUM(reading_count) AS readings,
+                MAX(consumption_max) AS peak
+            FROM {table}
+            WHERE {where}
+            GROUP BY {device_column} period
+            ORDER BY {device_column} period ASC
+        """), params).fetchall()
+
+        offset = 1 if by_device else 0
+        series = []
+        for row in rows:
+            total = float(row[offset + 1])
+            readings = int(row[offset + 2])
+            entry = {
+                "period": row[offset],
+                "total": total,
+                "readings": readings,
+                "average": total / readings if readings else 0.0,
+                "peak": float(row[offset + 3]) if row[offset + 3] is not None else 0.0,
+            }
+            if by_device:
+                entry["device_name"] = row[0]
+            series.append(entry)
+        return series
+
+    def daily_totals(self, days: int) -> List[Tuple[datetime, float]]:
+        """
+        Total consumption of the last `days` closed (UTC) days and of today so far
+
+        Closed days come from the memo; the ones not memoised yet and
+        today's running bucket are read from the daily rollups in one
+        grouped query. Days without readings count as 0.
+
+        Returns:
+            [(day start, total)] oldest first; the last entry is today
+        """
+        today = _truncate(datetime.utcnow(), "day")
+        closed = [today - timedelta(days=offset) for offset in range(days, 0, -1)]
+        totals, generation = closed_day_totals.lookup(closed)
+        missing = [day for day in closed if day not in totals]
+
+        rows = self.db.execute(text("""
+            SELECT bucket, SUM(consumption_sum)
+            FROM energy_consumption_daily
+            WHERE bucket >= :start_time AND bucket <= :today
+            GROUP BY bucket
+        """), {"start_time": missing[0] if missing else today, "today": today}).fetchall()
+        fetched = {row[0]: float(row[1]) for row in rows if row[1] is not None}
+
+        filled = {day: fetched.get(day, 0.0) for day in missing}
+        closed_day_totals.store(filled, generation)
+        totals.update(filled)
+        return [(day, totals[day]) for day in closed] + [(today, fetched.get(today, 0.0))]
+
+    def hour_of_day(
+        self,
+        start_time: datetime,
+        end_time: Optional[datetime] = None,
+        device_name: Optional[str] = None
+    ) -> Dict[int, Dict]:
+        """
+        Consumption by hour of day (0-23) over a window
+
+        Always reads hourly buckets, since daily buckets carry no hour.
+
+        Returns:
+            {hour: {"total", "readings", "average"}} for hours with data
+        """
+        table, _, where, params = self._source(start_time, end_time, "hour")
+        if device_name:
+            where += " AND device_name = :device_name"
+            params["device_name"] = device_name
+
+        rows = self.db.execute(text(f"""
+            SELECT
+                EXTRACT(hour FROM bucket) AS hour,
+                SUM(consumption_sum) AS total,
+                SUM(reading_count) AS readings
+            FROM {table}
+            WHERE {where}
+            GROUP BY hour
+            ORDER BY hour
+        """), params).fetchall()
+
+        return {
+            int(row[0]): {
+                "total": float(row[1]),
+                "readings": int(row[2]),
+                "average": float(row[1]) / int(row[2]) if row[2] else 0.0,
+            }
+            for row in rows
+        }
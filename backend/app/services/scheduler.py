@@ -0,0 +1,62 @@
+"""
+Periodic Background Tasks
+
+Small thread-based scheduler for maintenance jobs that run inside the
+backend process (partition maintenance, retention, ...).
+"""
+import logging
+import threading
+from typing import Callable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Runs a function every `interval` seconds on a daemon thread"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], object], run_immediately: bool = True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_immediately = run_immediately
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"periodic-{self.name}", daemon=True)
+        self._thread.start()
+        logger.info(f"Scheduled '{self.name}' every {self.interval:.0f}s")
+
+    def stop(self, timeout: float = 10.0):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self):
+        if not self.run_immediately and self._stop.wait(self.interval):
+            return
+        while True:
+            try:
+                self.func()
+            except Exception as e:
+                logger.error(f"Periodic task '{self.name}' failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+
+_tasks: List[PeriodicTask] = []
+
+
+def schedule(name: str, interval: float, func: Callable[[], object], run_immediately: bool = True) -> PeriodicTask:
+    """Start a periodic task that is stopped by stop_all()"""
+    task = PeriodicTask(name, interval, func, run_immediately)
+    task.start()
+    _tasks.append(task)
+    return task
+
+
+def stop_all():
+    """Stop every task started through schedule()"""
+    while _tasks:
+        _tasks.pop().stop()
@@ -0,0 +1,404 @@
+"""
+Tariff Service
+
+Turns kWh into money. Tariff definitions (time-of-use bands by hour,
+weekday and month, consumption tiers and effective dates) are read once
+from TARIFF_FILE and compiled into a rate table indexed by tariff version,
+month and hour of the week (168 slots). Costing a vector of hourly
+consumption is then one gather of each hour's slot and one multiply, so a
+year of hourly rollups for every device is costed in milliseconds.
+
+Without TARIFF_FILE the schedule is the flat ELECTRICITY_RATE.
+
+Tariff file (JSON):
+
+    {
+      "name": "Residential TOU",
+      "currency": "USD",
+      "timezone": "Europe/Istanbul",
+      "tariffs": [
+        {
+          "effective_from": "2026-01-01",
+          "base_rate": 0.12,
+          "bands": [
+            {"name": "night", "rate": 0.07, "hours": [23, 7]},
+            {"name": "summer peak", "rate": 0.30, "hours": [17, 22],
+             "weekdays": [0, 1, 2, 3, 4], "months": [6, 7, 8, 9]}
+          ],
+          "tiers": [
+            {"up_to_kwh": 300, "adder": 0.0},
+            {"adder": 0.04}
+          ],
+          "demand_charge_per_kw": 8.5,
+          "demand_window_minutes": 15
+        }
+      ]
+    }
+
+Bands cover the local hours [start, end), wrapping past midnight when
+start > end; weekdays are 0 = Monday, months 1-12, and an omitted field
+means all of them. A later band overrides an earlier one where they
+overlap. Tier adders are charged on top of the band rate once the
+household's consumption in the (calendar) billing month passes the
+previous tier's up_to_kwh; the last tier is unbounded. The optional
+demand charge bills the billing month's highest average kW over
+demand_window_minutes (see services/peak_demand.py).
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import json
+import logging
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from config import settings
+from services.rollup_service import ClosedDayTotals, RollupService, closed_day_memos, naive_utc
+
+logger = logging.getLogger(__name__)
+
+SLOTS_PER_WEEK = 7 * 24
+
+
+@dataclass
+class Band:
+    """Rate for a set of local hours, weekdays and months"""
+    name: str
+    rate: float
+    hours: Tuple[int, int] = (0, 24)
+    weekdays: Tuple[int, ...] = tuple(range(7))
+    months: Tuple[int, ...] = tuple(range(1, 13))
+
+    def mask(self) -> np.ndarray:
+        """(month, hour of week) cells the band applies to"""
+        start, end = self.hours
+        hours = np.arange(24)
+        if start < end:
+            in_hours = (hours >= start) & (hours < end)
+        else:
+            in_hours = (hours >= start) | (hours < end)
+        slots = np.arange(SLOTS_PER_WEEK)
+        in_week = np.isin(slots // 24, self.weekdays) & in_hours[slots % 24]
+        return np.isin(np.arange(1, 13), self.months)[:, None] & in_week[None, :]
+
+
+@dataclass
+class Tier:
+    """Adder per kWh for monthly consumption up to up_to_kwh (None = unbounded)"""
+    adder: float
+    up_to_kwh: Optional[float] = None
+
+
+@dataclass
+class Tariff:
+    """One version of the tariff, in effect from effective_from (local time)"""
+    effective_from: datetime
+    base_rate: float
+    bands: List[Band] = field(default_factory=list)
+    tiers: List[Tier] = field(default_factory=list)
+    demand_rate: float = 0.0  # Per kW of the billing month's peak
+    demand_window_minutes: int = 15
+
+    def rate_table(self) -> np.ndarray:
+        """Rate per (month, hour of week)"""
+        table = np.full((12, SLOTS_PER_WEEK), float(self.base_rate))
+        for band in self.bands:
+            table[band.mask()] = band.rate
+        return table
+
+
+class TariffSchedule:
+    """Compiled tariff versions; costs consumption at naive UTC hour timestamps"""
+
+    def __init__(self, tariffs: List[Tariff], name: str = "Flat rate",
+                 currency: str = "USD", timezone: str = "UTC"):
+        if not tariffs:
+            raise ValueError("A tariff schedule needs at least one tariff")
+        self.tariffs = sorted(tariffs, key=lambda tariff: tariff.effective_from)
+        self.name = name
+        self.currency = currency
+        self.timezone = timezone
+
+        self.effective_from = np.array([tariff.effective_from for tariff in self.tariffs], dtype='datetime64[s]')
+        self.rate_table = np.stack([tariff.rate_table() for tariff in self.tariffs])  # (version, month, hour of week)
+
+        # Tier bounds padded with unbounded, zero-adder tiers to a common depth
+        depth = max(len(tariff.tiers) for tariff in self.tariffs)
+        self.tier_bounds = np.full((len(self.tariffs), depth), np.inf)
+        self.tier_adders = np.zeros((len(self.tariffs), depth))
+        for version, tariff in enumerate(self.tariffs):
+            for index, tier in enumerate(tariff.tiers):
+                if tier.up_to_kwh is not None:
+                    self.tier_bounds[version, index] = tier.up_to_kwh
+                self.tier_adders[version, index] = tier.adder
+
+    @property
+    def has_tiers(self) -> bool:
+        return bool(self.tier_adders.any())
+
+    def _local(self, timestamps) -> np.ndarray:
+        """Naive UTC timestamps to local wall-clock datetime64[s], same shape"""
+        times = np.asarray(timestamps, dtype='datetime64[s]')
+        if self.timezone == "UTC":
+            return times
+        local = pd.DatetimeIndex(times.ravel()).tz_localize("UTC").tz_convert(self.timezone).tz_localize(None)
+        return local.values.astype('datetime64[s]').reshape(times.shape)
+
+    def _slots(self, local: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Tariff version, month (0-11) and hour of week (Monday 00:00 = 0) of local times"""
+        days = local.astype('datetime64[D]')
+        weekday = (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+        hour = (local - days).astype('timedelta64[h]').astype(np.int64)
+        month = local.astype('datetime64[M]').astype(np.int64) % 12
+        version = np.maximum(np.searchsorted(self.effective_from, local, side='right') - 1, 0)
+        return version, month, weekday * 24 + hour
+
+    def rates(self, timestamps) -> np.ndarray:
+        """Time-of-use rate per kWh at each naive UTC timestamp, before tier adders"""
+        version, month, slot = self._slots(self._local(timestamps))
+        return self.rate_table[version, month, slot]
+
+    def cost(self, timestamps, kwh, month_to_date: float = 0.0) -> np.ndarray:
+        """
+        Cost of consumption at naive UTC hour timestamps
+
+        Args:
+            timestamps: Hour of every entry (any shape)
+            kwh: Consumption of every entry, same shape as timestamps
+            month_to_date: Consumption in the first billing month before the first entry (for tiers)
+
+        Returns:
+            Cost per entry, same shape as kwh
+        """
+        local = self._local(timestamps)
+        kwh = np.asarray(kwh, dtype=float)
+        version, month, slot = self._slots(local)
+        cost = kwh * self.rate_table[version, month, slot]
+        if not self.has_tiers or kwh.size == 0:
+            return cost
+
+        # Tiers apply to each billing month's running consumption, in time order
+        order = np.argsort(local.ravel(), kind='stable')
+        consumption = kwh.ravel()[order]
+        billing_month = local.astype('datetime64[M]').ravel()[order]
+        starts = np.flatnonzero(np.r_[True, billing_month[1:] != billing_month[:-1]])
+        before = np.cumsum(consumption) - consumption
+        before -= np.repeat(before[starts], np.diff(np.r_[starts, consumption.size]))
+        before[billing_month == billing_month[0]] += month_to_date
+        after = before + consumption
+
+        versions = version.ravel()[order]
+        upper = self.tier_bounds[versions]
+        lower = np.concatenate([np.zeros((len(order), 1)), upper[:, :-1]], axis=1)
+        in_tier = np.maximum(np.minimum(after[:, None], upper) - np.maximum(before[:, None], lower), 0.0)
+        surcharge = np.empty(len(order))
+        surcharge[order] = (in_tier * self.tier_adders[versions]).sum(axis=1)
+        return cost + surcharge.reshape(kwh.shape)
+
+    def local_hours(self, timestamps) -> np.ndarray:
+        """Local hour of day (0-23) of naive UTC timestamps"""
+        local = self._local(timestamps)
+        return (local - local.astype('datetime64[D]')).astype('timedelta64[h]').astype(np.int64)
+
+    def billing_months(self, timestamps) -> np.ndarray:
+        """Local billing month (datetime64[M]) of naive UTC timestamps"""
+        return self._local(timestamps).astype('datetime64[M]')
+
+    def demand_terms(self, timestamp: datetime) -> Tuple[float, int]:
+        """Demand charge per kW and its window in minutes, of the tariff in effect at a naive UTC timestamp"""
+        version, _, _ = self._slots(self._local([timestamp]))
+        tariff = self.tariffs[version[0]]
+        return tariff.demand_rate, tariff.demand_window_minutes
+
+    def billing_month_start(self, timestamp: datetime) -> datetime:
+        """Start of the local billing month containing a naive UTC timestamp, as naive UTC"""
+        local = pd.Timestamp(timestamp).tz_localize("UTC").tz_convert(self.timezone)
+        start = pd.Timestamp(local.year, local.month, 1).tz_localize(self.timezone)
+        return start.tz_convert("UTC").tz_localize(None).to_pydatetime()
+
+
+def _parse_tariff(entry: Dict) -> Tariff:
+    bands = []
+    for band in entry.get("bands", []):
+        hours = tuple(int(hour) for hour in band.get("hours", (0, 24)))
+        weekdays = tuple(int(day) for day in band.get("weekdays", range(7)))
+        months = tuple(int(month) for month in band.get("months", range(1, 13)))
+        if len(hours) != 2 or not all(0 <= hour <= 24 for hour in hours):
+            raise ValueError(f"Band {band.get('name')!r}: hours must be [start, end] within 0-24")
+        if not all(0 <= day <= 6 for day in weekdays) or not all(1 <= month <= 12 for month in months):
+            raise ValueError(f"Band {band.get('name')!r}: weekdays must be 0-6 and months 1-12")
+        bands.append(Band(band.get("name", ""), float(band["rate"]), hours, weekdays, months))
+
+    tiers = [Tier(float(tier.get("adder", 0.0)), tier.get("up_to_kwh")) for tier in entry.get("tiers", [])]
+    bounds = [tier.up_to_kwh for tier in tiers]
+    if tiers and (bounds[-1] is not None or None in bounds[:-1] or bounds[:-1] != sorted(bounds[:-1])):
+        raise ValueError("Tiers need increasing up_to_kwh bounds and an unbounded last tier")
+
+    demand_window = int(entry.get("demand_window_minutes", 15))
+    if demand_window <= 0:
+        raise ValueError("demand_window_minutes must be positive")
+
+    return Tariff(datetime.fromisoformat(entry.get("effective_from", "1970-01-01")),
+                  float(entry["base_rate"]), bands, tiers,
+                  float(entry.get("demand_charge_per_kw", 0.0)), demand_window)
+
+
+def load_schedule(path: str, flat_rate: float) -> TariffSchedule:
+    """
+    Compile the tariff file, or a flat-rate schedule when no file is configured
+
+    Raises:
+        ValueError: If the file holds no valid tariff definitions
+    """
+    if not path:
+        return TariffSchedule([Tariff(datetime(1970, 1, 1), flat_rate)])
+
+    with open(path) as f:
+        spec = json.load(f)
+    try:
+        tariffs = [_parse_tariff(entry) for entry in spec.get("tariffs", [])]
+        timezone = spec.get("timezone", "UTC")
+        pd.Timestamp("2000-01-01", tz=timezone)  # Unknown zones fail here instead of on first use
+        schedule = TariffSchedule(tariffs, spec.get("name", path), spec.get("currency", "USD"), timezone)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid tariff file {path}: {e}") from e
+    logger.info(f"Loaded tariff '{schedule.name}' ({len(tariffs)} version(s), {schedule.timezone})")
+    return schedule
+
+
+@dataclass
+class WindowCosts:
+    """Hourly consumption and cost of every device over a window"""
+    devices: np.ndarray
+    buckets: np.ndarray  # Naive UTC hours, datetime64[s]
+    kwh: np.ndarray
+    cost: np.ndarray
+
+    def total(self) -> float:
+        return float(self.cost.sum())
+
+    def average_rate(self) -> float:
+        """Effective price per kWh over the window (current rate if nothing was consumed)"""
+        consumption = float(self.kwh.sum())
+        if consumption > 0:
+            return self.total() / consumption
+        return float(tariffs.rates([datetime.utcnow()])[0])
+
+    def by_device(self) -> Dict[str, float]:
+        names, index = np.unique(self.devices, return_inverse=True)
+        sums = np.bincount(index, weights=self.cost, minlength=len(names))
+        return {str(name): float(total) for name, total in zip(names, sums)}
+
+    def by_period(self, grain: str) -> Dict[datetime, float]:
+        """Cost per time bucket, keyed like RollupService.series periods"""
+        days = self.buckets.astype('datetime64[D]')
+        if grain == "hour":
+            periods = self.buckets
+        elif grain == "day":
+            periods = days
+        elif grain == "week":
+            periods = days - (days.astype(np.int64) + 3) % 7  # Back to Monday, as DATE_TRUNC('week')
+        elif grain == "month":
+            periods = self.buckets.astype('datetime64[M]')
+        else:
+            raise ValueError(f"Unsupported grain '{grain}'")
+        keys, index = np.unique(periods.astype('datetime64[s]'), return_inverse=True)
+        sums = np.bincount(index, weights=self.cost, minlength=len(keys))
+        return {key.astype(datetime): float(total) for key, total in zip(keys, sums)}
+
+
+def window_costs(db: Session, start_time: Optional[datetime] = None,
+                 end_time: Optional[datetime] = None) -> WindowCosts:
+    """
+    Cost the hourly rollups of a window under the configured tariff
+
+    Args:
+        db: Database session
+        start_time: Window start (default: all data)
+        end_time: Window end (default: now)
+    """
+    rollups = RollupService(db)
+    rows = rollups.hourly_rows(start_time, end_time)
+    if not rows:
+        empty = np.empty(0)
+        return WindowCosts(np.empty(0, dtype=object), np.empty(0, dtype='datetime64[s]'), empty, empty)
+
+    devices, buckets, kwh = zip(*rows)
+    buckets = np.array(buckets, dtype='datetime64[s]')
+    month_to_date = 0.0
+    if tariffs.has_tiers:
+        first_hour = buckets[0].astype(datetime)
+        month_start = tariffs.billing_month_start(first_hour)
+        # The first hour may start before the window; only what precedes the window counts
+        window_start = naive_utc(start_time) if start_time is not None else first_hour
+        if month_start < window_start:
+            month_to_date = rollups.summary(month_start, window_start)["total"]
+
+    kwh = np.array(kwh, dtype=float)
+    return WindowCosts(np.array(devices, dtype=object), buckets, kwh,
+                       tariffs.cost(buckets, kwh, month_to_date))
+
+
+class ClosedDayCosts(ClosedDayTotals):
+    """Thread-safe memo of the cost of every closed (UTC) day"""
+
+    def forget(self, days: Optional[Iterable[datetime]] = None):
+        # Under consumption tiers a day's cost depends on the days before it in
+        # its billing month, so a late write also reprices every later day
+        if days is not None and tariffs.has_tiers:
+            days = set(days)
+            if days:
+                with self._lock:
+                    days.update(day for day in self._totals if day > min(days))
+        super().forget(days)
+
+
+closed_day_costs = ClosedDayCosts()
+closed_day_memos.append(closed_day_costs)
+
+
+def total_cost(db: Session, start_time: Optional[datetime] = None,
+               end_time: Optional[datetime] = None) -> float:
+    """
+    Cost of a window under the configured tariff
+
+    A window is costed from its hourly rollups. All data (no window) sums
+    the memoised cost of every closed day and prices only the days not
+    memoised yet and today's hours, so repeated calls do not grow with the
+    history.
+
+    Args:
+        db: Database session
+        start_time: Window start (default: all data)
+        end_time: Window end (default: now)
+    """
+    if start_time is not None or end_time is not None:
+        return window_costs(db, start_time, end_time).total()
+
+    today = datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+    days = [row[0] for row in db.execute(text("""
+        SELECT DISTINCT bucket FROM energy_consumption_daily WHERE bucket < :today ORDER BY bucket
+    """), {"today": today})]
+    costs, generation = closed_day_costs.lookup(days)
+
+    # Days not memoised yet, priced one run of consecutive data days at a time
+    filled = {}
+    run: List[datetime] = []
+    for day in days + [None]:
+        if day is not None and day not in costs:
+            run.append(day)
+            continue
+        if run:
+            by_day = window_costs(db, run[0], run[-1] + timedelta(days=1)).by_period("day")
+            filled.update({missing: by_day.get(missing, 0.0) for missing in run})
+            run = []
+    closed_day_costs.store(filled, generation)
+    costs.update(filled)
+
+    return sum(costs.values()) + window_costs(db, today).total()
+
+
+tariffs = load_schedule(settings.TARIFF_FILE, settings.ELECTRICITY_RATE)
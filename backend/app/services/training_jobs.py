@@ -0,0 +1,232 @@
+"""
+Background Model Training
+
+Training jobs run one at a time on a background thread, so model training
+never blocks a request worker (or the event loop). The thread only loads
+data and saves results; the model fits themselves are spread over a
+process pool by MLService.train_devices, using every core without
+contending for the GIL. Submitting returns a job id whose progress and
+per-device results can be polled.
+"""
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import logging
+import threading
+import uuid
+
+from config import settings
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+
+# Seconds before a device without a model is queued for training again
+MISSING_MODEL_RETRY = 600
+
+
+def training_targets(db) -> List[str]:
+    """
+    Models a full training run covers
+
+    Per-device mode trains every device plus the global model, which
+    serves devices that have no model of their own yet; global mode only
+    trains the global model.
+    """
+    from sqlalchemy import text
+    from services.global_model import GLOBAL_MODEL
+
+    if settings.ML_MODEL_MODE == "global":
+        return [GLOBAL_MODEL]
+    devices = [row[0] for row in db.execute(text("SELECT DISTINCT name FROM devices"))]
+    return devices + [GLOBAL_MODEL]
+
+
+class TrainingJob:
+    """One submitted training run over one or more devices"""
+
+    def __init__(self, devices: List[str], days: int, reason: str):
+        self.id = uuid.uuid4().hex[:12]
+        self.devices = devices
+        self.days = days
+        self.reason = reason
+        self.submitted_at = datetime.now()
+        self.finished_at: Optional[datetime] = None
+        self.results: Dict[str, Dict] = {}
+        self.futures: List[Future] = []
+
+    @property
+    def status(self) -> str:
+        if len(self.results) == len(self.devices):
+            successful = any(result.get("success") for result in self.results.values())
+            return COMPLETED if successful or not self.devices else FAILED
+        if self.results or any(future.running() for future in self.futures):
+            return RUNNING
+        return QUEUED
+
+    @property
+    def done(self) -> bool:
+        return self.status in (COMPLETED, FAILED)
+
+    def as_dict(self, include_results: bool = True) -> Dict:
+        successful = sum(1 for result in self.results.values() if result.get("success"))
+        job = {
+            "job_id": self.id,
+            "status": self.status,
+            "reason": self.reason,
+            "devices": self.devices,
+            "days": self.days,
+            "progress": {"completed": len(self.results), "total": len(self.devices)},
+            "successful": successful,
+            "failed": len(self.results) - successful,
+            "submitted_at": self.submitted_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+        if include_results:
+            job["results"] = [self.results[device] for device in self.devices if device in self.results]
+        return job
+
+
+class TrainingJobManager:
+    """Submits training jobs to a process pool and tracks their progress"""
+
+    def __init__(self, history: int = 50):
+        self.history = history
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: Dict[str, TrainingJob] = {}
+        self._lock = threading.Lock()
+
+    def _runner(self) -> ThreadPoolExecutor:
+        # Caller holds self._lock; jobs queue behind each other since each
+        # one already uses every core
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ml-training")
+        return self._executor
+
+    def submit(self, devices: List[str], days: int = 30, reason: str = "manual") -> TrainingJob:
+        """
+        Queue training for devices
+
+        Args:
+            devices: Devices to train
+            days: Days of history to train on
+            reason: Why the job was started (manual, scheduled, missing model)
+
+        Returns:
+            The queued job
+        """
+        job = TrainingJob(list(devices), days, reason)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._trim()
+            if not job.devices:
+                job.finished_at = datetime.now()
+                return job
+            job.futures = [self._runner().submit(self._run, job)]
+
+        job.futures[0].add_done_callback(lambda future: self._on_done(job, future))
+        logger.info(f"Training job {job.id} ({reason}) queued for {len(job.devices)} device(s)")
+        return job
+
+    def ensure_trained(self, devices: List[str], days: int = 30) -> Optional[TrainingJob]:
+        """
+        Queue training for devices without a model
+
+        Devices already in an unfinished job, or in one submitted during the
+        last MISSING_MODEL_RETRY seconds (e.g. too little data), are skipped.
+        """
+        cutoff = datetime.now() - timedelta(seconds=MISSING_MODEL_RETRY)
+        with self._lock:
+            pending = {
+                device
+                for job in self._jobs.values() if not job.done or job.submitted_at >= cutoff
+                for device in job.devices
+            }
+        missing = [device for device in devices if device not in pending]
+        if not missing:
+            return None
+        return self.submit(missing, days, reason="missing model")
+
+    def submit_all(self, days: int = 30, reason: str = "scheduled") -> Optional[TrainingJob]:
+        """Retrain every device unless a job is still running"""
+        from database.connection import SessionLocal
+
+        if self.running():
+            logger.info("Skipping training run, a training job is still in progress")
+            return None
+
+        db = SessionLocal()
+        try:
+            targets = training_targets(db)
+        finally:
+            db.close()
+        return self.submit(targets, days, reason)
+
+    def running(self) -> bool:
+        """True while any job is queued or running"""
+        with self._lock:
+            return any(not job.done for job in self._jobs.values())
+
+    def get(self, job_id: str) -> Optional[TrainingJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self) -> List[TrainingJob]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.submitted_at, reverse=True)
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _run(self, job: TrainingJob):
+        from database.connection import SessionLocal
+        from services.ml_service import MLService
+
+        db = SessionLocal()
+        try:
+            MLService(db).train_devices(
+                job.devices, job.days, on_result=lambda device, result: self._record(job, device, result)
+            )
+        finally:
+            db.close()
+
+    def _record(self, job: TrainingJob, device: str, result: Dict):
+        from services.cache_service import response_cache, ML
+
+        if result.get("success"):
+            # MLService published the new model to the registry already
+            response_cache.invalidate(ML)
+        with self._lock:
+            job.results[device] = result
+            if job.done:
+                job.finished_at = datetime.now()
+                logger.info(f"Training job {job.id} {job.status}: "
+                            f"{sum(1 for r in job.results.values() if r.get('success'))}/{len(job.devices)} devices trained")
+
+    def _on_done(self, job: TrainingJob, future: Future):
+        # Devices the job did not get to (cancelled or crashed) count as failed
+        if future.cancelled():
+            error = "Training cancelled"
+        elif future.exception() is not None:
+            error = str(future.exception())
+            logger.error(f"Training job {job.id} failed: {future.exception()}")
+        else:
+            return
+        for device in job.devices:
+            if device not in job.results:
+                self._record(job, device, {"success": False, "device_name": device, "error": error})
+
+    def _trim(self):
+        # Caller holds self._lock; forget the oldest finished jobs
+        finished = sorted((job for job in self._jobs.values() if job.done), key=lambda job: job.submitted_at)
+        while len(self._jobs) > self.history and finished:
+            del self._jobs[finished.pop(0).id]
+
+
+training_manager = TrainingJobManager()
@@ -0,0 +1,66 @@
+"""
+Feature store syncs of series too short for prepare_features
+
+A stored device whose refreshed hours come back with only a few rows
+(readings dropped by retention, a device that stopped reporting) gives
+prepare_features fewer than 50 rows of context plus new hours. The sync
+must leave the store as it is and retry later. No database is needed: the
+hourly series are served from memory.
+"""
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from services.feature_store import FeatureStore
+from services.ml_service import MLService
+
+DEVICE = "TV"
+
+
+class InMemorySeries(MLService):
+    """MLService whose hourly series come from a dict instead of the rollups"""
+
+    def __init__(self):
+        super().__init__(None)
+        self.series: Dict[str, pd.DataFrame] = {}
+
+    def get_hourly_series(self, device_names: Optional[List[str]], start_time, end_time=None):
+        return {name: self.series[name] for name in device_names if name in self.series}
+
+
+@pytest.fixture
+def ml_service(tmp_path, monkeypatch):
+    monkeypatch.setattr(MLService, "MODEL_DIR", str(tmp_path / "models"))
+    return InMemorySeries()
+
+
+def hourly(hours: int, consumption: float = 1.0) -> pd.DataFrame:
+    timestamps = pd.date_range("2026-01-01", periods=hours, freq=pd.Timedelta(hours=1))
+    return pd.DataFrame({"timestamp": timestamps, "consumption": consumption + np.arange(hours) % 24 / 10})
+
+
+def test_short_refresh_leaves_store_unchanged(tmp_path, ml_service):
+    store = FeatureStore(str(tmp_path / "features"), retention_days=30)
+    ml_service.series[DEVICE] = hourly(60)
+    assert store.sync(ml_service, [DEVICE]) == {DEVICE: 60}
+    before = store.window(DEVICE)
+
+    # Six changed hours from the refresh window; with the stored hours
+    # before them that is 20 rows, under prepare_features' minimum of 50
+    ml_service.series[DEVICE] = hourly(60, consumption=2.0).iloc[14:20]
+    assert store.sync(ml_service, [DEVICE]) == {DEVICE: 0}
+
+    after = store.window(DEVICE)
+    assert store.manifest(DEVICE)["rows"] == 60
+    np.testing.assert_array_equal(after.X, before.X)
+    np.testing.assert_array_equal(after.y, before.y)
+
+
+def test_short_series_builds_nothing(tmp_path, ml_service):
+    store = FeatureStore(str(tmp_path / "features"), retention_days=30)
+    ml_service.series[DEVICE] = hourly(20)
+
+    assert store.sync(ml_service, [DEVICE]) == {DEVICE: 0}
+    assert store.window(DEVICE) is None
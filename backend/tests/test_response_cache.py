@@ -0,0 +1,92 @@
+"""
+Response cache behaviour under a steady stream of readings
+
+The simulator writes a reading about every 2 seconds while dashboards
+poll every 10; a cached analytics response must still be computed at most
+once per READINGS_CACHE_MAX_STALENESS interval. Time is driven by a fake
+clock, so the tests need neither a database nor sleeps.
+"""
+import asyncio
+from types import SimpleNamespace
+
+from services import cache_service
+from services.cache_service import DEVICES, READINGS, ResponseCache
+
+INTERVAL = 10.0  # Poll interval, response TTL and staleness bound
+WRITE_EVERY = 2.0
+DASHBOARDS = 50
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+def install(monkeypatch, max_staleness: float):
+    clock = Clock()
+    cache = ResponseCache()
+    monkeypatch.setattr(cache_service, "time", SimpleNamespace(monotonic=clock.monotonic))
+    monkeypatch.setattr(cache_service, "response_cache", cache)
+    monkeypatch.setattr(cache_service.settings, "READINGS_CACHE_MAX_STALENESS", max_staleness)
+    return clock, cache
+
+
+def poll(clock: Clock, cache: ResponseCache, seconds: float, tags=(READINGS,)):
+    """Dashboards polling at staggered offsets while readings are written; returns compute times"""
+    computed = []
+
+    async def compute():
+        computed.append(clock.now)
+        # A reading lands while the response is being computed
+        cache_service.invalidate_readings()
+        await asyncio.sleep(0)
+        return {"total": len(computed)}
+
+    async def run():
+        step = 0.5
+        for tick in range(int(seconds / step)):
+            clock.now = 1000.0 + tick * step
+            if (tick * step) % WRITE_EVERY == 0:
+                cache_service.invalidate_readings()
+            # Each dashboard polls once per interval, at its own offset
+            for dashboard in range(DASHBOARDS):
+                if (tick * step) % INTERVAL == (dashboard * step) % INTERVAL:
+                    await cache.get_or_compute(("energy",), compute, INTERVAL, tags)
+
+    asyncio.run(run())
+    return computed
+
+
+def test_readings_stream_computes_once_per_interval(monkeypatch):
+    clock, cache = install(monkeypatch, max_staleness=INTERVAL)
+
+    computed = poll(clock, cache, seconds=60)
+
+    assert len(computed) <= 60 / INTERVAL + 1
+    assert all(later - earlier >= INTERVAL for earlier, later in zip(computed, computed[1:]))
+    assert cache.hits > len(computed)
+
+
+def test_zero_staleness_drops_on_every_write(monkeypatch):
+    clock, cache = install(monkeypatch, max_staleness=0.0)
+
+    computed = poll(clock, cache, seconds=20)
+
+    # The write during each computation discards its result, so every poll recomputes
+    assert len(computed) == cache.misses
+    assert cache.hits == 0
+
+
+def test_readings_do_not_touch_other_tags(monkeypatch):
+    clock, cache = install(monkeypatch, max_staleness=INTERVAL)
+    cache.set(("devices",), ["TV"], ttl=60, tags=(DEVICES,))
+
+    clock.now += 30
+    cache_service.invalidate_readings()
+
+    assert cache.get(("devices",)) == (True, ["TV"])
+    cache.invalidate(DEVICES)
+    assert cache.get(("devices",)) == (False, None)
@@ -20,7 +20,7 @@ const Dashboard = () => {
                 const [energyResponse, devicesResponse, consumptionResponse, costResponse, predictionsResponse] = await Promise.all([
                     axios.get(`${API_BASE_URL}/api/energy`),
                     axios.get(`${API_BASE_URL}/api/devices`),
-                    axios.get(`${API_BASE_URL}/api/energy/consumption`),
+                    axios.get(`${API_BASE_URL}/api/energy/consumption?limit=10`),
                     axios.get(`${API_BASE_URL}/api/energy/cost?period=7days`),
                     axios.get(`${API_BASE_URL}/api/ml/predictions/summary?hours=24`)
                 ]);
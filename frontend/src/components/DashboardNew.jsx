@@ -22,7 +22,7 @@ const Dashboard = () => {
                 const [energyResponse, devicesResponse, consumptionResponse] = await Promise.all([
                     axios.get(`${API_BASE_URL}/api/energy`),
                     axios.get(`${API_BASE_URL}/api/devices`),
-                    axios.get(`${API_BASE_URL}/api/energy/consumption`)
+                    axios.get(`${API_BASE_URL}/api/energy/consumption?limit=10`)
                 ]);
                 
                 setEnergyData(energyResponse.data);
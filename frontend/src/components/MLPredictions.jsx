@@ -75,6 +75,17 @@ const MLPredictions = () => {
         }
     };
 
+    // Training runs as a background job; poll it until it finishes
+    const waitForTrainingJob = async (jobId) => {
+        while (true) {
+            const response = await axios.get(`${API_BASE_URL}/api/ml/train/jobs/${jobId}`);
+            if (response.data.status === 'completed' || response.data.status === 'failed') {
+                return response.data;
+            }
+            await new Promise((resolve) => setTimeout(resolve, 2000));
+        }
+    };
+
     const trainModels = async () => {
         setTraining(true);
         try {
@@ -83,9 +94,10 @@ const MLPredictions = () => {
                 : `${API_BASE_URL}/api/ml/train?device=${selectedDevice}`;
             
             const response = await axios.post(url);
+            const job = await waitForTrainingJob(response.data.job_id);
             
-            if (response.data.success) {
-                toast.success('Models trained successfully!');
+            if (job.successful > 0) {
+                toast.success(`Models trained successfully! (${job.successful}/${job.progress.total})`);
                 fetchPredictions();
                 fetchSummary();
                 fetchAllModels();
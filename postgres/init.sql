@@ -1,10 +1,35 @@
 -- Create tables
+-- Raw readings are range-partitioned by timestamp so that time-bounded
+-- queries only touch the relevant partitions and old data can be retired
+-- by dropping whole partitions. The backend creates future partitions and
+-- applies the retention policy (see services/partition_service.py).
 CREATE TABLE IF NOT EXISTS energy_consumption (
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
     device_name VARCHAR(255) NOT NULL,
     consumption FLOAT NOT NULL,
-    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Catches readings outside every monthly partition
+CREATE TABLE IF NOT EXISTS energy_consumption_default
+    PARTITION OF energy_consumption DEFAULT;
+
+-- Monthly partitions covering the mock data below and the next two months
+DO $$
+DECLARE
+    month_start DATE := DATE_TRUNC('month', NOW() - INTERVAL '7 days');
+BEGIN
+    WHILE month_start <= DATE_TRUNC('month', NOW() + INTERVAL '2 months') LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF energy_consumption FOR VALUES FROM (%L) TO (%L)',
+            'energy_consumption_p' || to_char(month_start, 'YYYYMMDD'),
+            month_start,
+            month_start + INTERVAL '1 month'
+        );
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+END $$;
 
 CREATE TABLE IF NOT EXISTS devices (
     id SERIAL PRIMARY KEY,
@@ -14,10 +39,51 @@ CREATE TABLE IF NOT EXISTS devices (
     last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
 
+-- Per-device 5-minute, hourly and daily rollups of energy_consumption,
+-- maintained by the backend on every insert and used by the analytics endpoints
+CREATE TABLE IF NOT EXISTS energy_consumption_5min (
+    bucket TIMESTAMP NOT NULL,
+    device_name VARCHAR NOT NULL,
+    consumption_sum FLOAT NOT NULL DEFAULT 0,
+    consumption_sum_sq FLOAT NOT NULL DEFAULT 0,
+    consumption_min FLOAT,
+    consumption_max FLOAT,
+    reading_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, device_name)
+);
+
+CREATE TABLE IF NOT EXISTS energy_consumption_hourly (
+    bucket TIMESTAMP NOT NULL,
+    device_name VARCHAR NOT NULL,
+    consumption_sum FLOAT NOT NULL DEFAULT 0,
+    consumption_sum_sq FLOAT NOT NULL DEFAULT 0,
+    consumption_min FLOAT,
+    consumption_max FLOAT,
+    reading_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, device_name)
+);
+
+CREATE TABLE IF NOT EXISTS energy_consumption_daily (
+    bucket TIMESTAMP NOT NULL,
+    device_name VARCHAR NOT NULL,
+    consumption_sum FLOAT NOT NULL DEFAULT 0,
+    consumption_sum_sq FLOAT NOT NULL DEFAULT 0,
+    consumption_min FLOAT,
+    consumption_max FLOAT,
+    reading_count INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (bucket, device_name)
+);
+
 -- Create indexes for better performance
-CREATE INDEX IF NOT EXISTS idx_energy_device_name ON energy_consumption(device_name);
+-- Per-device history reads (device_name = ? AND timestamp range, ordered by
+-- timestamp) are answered from this index alone
+CREATE INDEX IF NOT EXISTS idx_energy_device_timestamp
+    ON energy_consumption(device_name, timestamp) INCLUDE (consumption, id);
 CREATE INDEX IF NOT EXISTS idx_energy_timestamp ON energy_consumption(timestamp);
 CREATE INDEX IF NOT EXISTS idx_devices_name ON devices(name);
+CREATE INDEX IF NOT EXISTS idx_energy_5min_device_bucket ON energy_consumption_5min(device_name, bucket);
+CREATE INDEX IF NOT EXISTS idx_energy_hourly_device_bucket ON energy_consumption_hourly(device_name, bucket);
+CREATE INDEX IF NOT EXISTS idx_energy_daily_device_bucket ON energy_consumption_daily(device_name, bucket);
 
 -- Insert sample devices
 INSERT INTO devices (name, type, status) VALUES
@@ -47,4 +113,29 @@ CROSS JOIN generate_series(
     NOW(),
     INTERVAL '1 hour'
 ) AS timestamp
-ON CONFLICT DO NOTHING;
\ No newline at end of file
+ON CONFLICT DO NOTHING;
+
+-- Build rollups for the mock data
+INSERT INTO energy_consumption_5min
+    (bucket, device_name, consumption_sum, consumption_sum_sq, consumption_min, consumption_max, reading_count)
+SELECT DATE_BIN('5 minutes', timestamp, TIMESTAMP '2000-01-01'), device_name, SUM(consumption),
+       SUM(consumption * consumption), MIN(consumption), MAX(consumption), COUNT(*)
+FROM energy_consumption
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+
+INSERT INTO energy_consumption_hourly
+    (bucket, device_name, consumption_sum, consumption_sum_sq, consumption_min, consumption_max, reading_count)
+SELECT DATE_TRUNC('hour', bucket), device_name, SUM(consumption_sum), SUM(consumption_sum_sq),
+       MIN(consumption_min), MAX(consumption_max), SUM(reading_count)
+FROM energy_consumption_5min
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
+
+INSERT INTO energy_consumption_daily
+    (bucket, device_name, consumption_sum, consumption_sum_sq, consumption_min, consumption_max, reading_count)
+SELECT DATE_TRUNC('day', bucket), device_name, SUM(consumption_sum), SUM(consumption_sum_sq),
+       MIN(consumption_min), MAX(consumption_max), SUM(reading_count)
+FROM energy_consumption_hourly
+GROUP BY 1, 2
+ON CONFLICT DO NOTHING;
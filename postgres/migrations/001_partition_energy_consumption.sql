@@ -0,0 +1,62 @@
+-- Convert an existing (pre-partitioning) energy_consumption table into the
+-- range-partitioned layout used by init.sql. New installs do not need this.
+--
+-- Run once with the backend stopped:
+--   psql -U user -d smart_home -f postgres/migrations/001_partition_energy_consumption.sql
+--
+-- Rows are copied month by month into monthly partitions; the id sequence
+-- is kept so existing ids stay valid.
+
+BEGIN;
+
+ALTER TABLE energy_consumption RENAME TO energy_consumption_legacy;
+ALTER INDEX IF EXISTS energy_consumption_pkey RENAME TO energy_consumption_legacy_pkey;
+DROP INDEX IF EXISTS idx_energy_device_name;
+DROP INDEX IF EXISTS idx_energy_timestamp;
+DROP INDEX IF EXISTS ix_energy_consumption_id;
+DROP INDEX IF EXISTS ix_energy_consumption_device_name;
+
+CREATE TABLE energy_consumption (
+    id INTEGER NOT NULL DEFAULT nextval('energy_consumption_id_seq'),
+    device_name VARCHAR(255) NOT NULL,
+    consumption FLOAT NOT NULL,
+    timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+ALTER SEQUENCE energy_consumption_id_seq OWNED BY energy_consumption.id;
+
+CREATE TABLE energy_consumption_default
+    PARTITION OF energy_consumption DEFAULT;
+
+DO $$
+DECLARE
+    month_start DATE;
+    last_month DATE := DATE_TRUNC('month', NOW() + INTERVAL '2 months');
+BEGIN
+    SELECT DATE_TRUNC('month', COALESCE(MIN(timestamp), NOW()))
+    INTO month_start
+    FROM energy_consumption_legacy;
+
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF energy_consumption FOR VALUES FROM (%L) TO (%L)',
+            'energy_consumption_p' || to_char(month_start, 'YYYYMMDD'),
+            month_start,
+            month_start + INTERVAL '1 month'
+        );
+        month_start := month_start + INTERVAL '1 month';
+    END LOOP;
+END $$;
+
+-- Readings without a timestamp cannot be placed in a partition
+INSERT INTO energy_consumption (id, device_name, consumption, timestamp)
+SELECT id, device_name, consumption, COALESCE(timestamp, NOW())
+FROM energy_consumption_legacy;
+
+DROP TABLE energy_consumption_legacy;
+
+CREATE INDEX idx_energy_device_name ON energy_consumption(device_name);
+CREATE INDEX idx_energy_timestamp ON energy_consumption(timestamp);
+
+COMMIT;
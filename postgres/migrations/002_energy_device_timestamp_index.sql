@@ -0,0 +1,24 @@
+-- Replace the single-column device_name index with a composite covering
+-- index, so per-device history reads (device_name = ? AND timestamp range,
+-- ORDER BY timestamp) become index-only scans instead of bitmap-ANDing the
+-- device_name and timestamp indexes and sorting.
+--
+--   psql -U user -d smart_home -f postgres/migrations/002_energy_device_timestamp_index.sql
+
+CREATE INDEX IF NOT EXISTS idx_energy_device_timestamp
+    ON energy_consumption(device_name, timestamp) INCLUDE (consumption, id);
+
+-- Its leading column makes the old index redundant
+DROP INDEX IF EXISTS idx_energy_device_name;
+
+-- Index-only scans need an up-to-date visibility map
+VACUUM ANALYZE energy_consumption;
+
+-- Verify (expect "Index Only Scan using ..._device_name_timestamp_..." on
+-- every partition in range, and no Sort node; backend/tests/test_query_plans.py
+-- asserts this plan and the latest-reading one):
+--
+--   EXPLAIN (ANALYZE, BUFFERS)
+--   SELECT timestamp, consumption FROM energy_consumption
+--   WHERE device_name = 'TV' AND timestamp >= NOW() - INTERVAL '30 days'
+--   ORDER BY timestamp;